@@ -0,0 +1,51 @@
+# Accuracy and train steps/s of A-GEM with a cached reference gradient against the exact per-step version.
+# Run from the directory used for main.py, the other arguments are passed to main.py, e.g.
+#   python benchmarks/agem_refresh.py --model agem_r --dataset oil-daily.csv --processing indicators --epochs 20
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.results import ResultsStore  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='agem', choices=['agem', 'agem_r'])
+    parser.add_argument('--settings', default='1:0,10:256,50:256,0:256',
+                        help="Comma separated refresh:ref_size pairs (ref_size 0: batch size), 1:0 is exact A-GEM")
+    return parser.parse_known_args()
+
+
+def main():
+    args, main_args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ResultsStore(os.path.join(tmp, 'results.h5'))
+        for setting in args.settings.split(','):
+            refresh, ref_size = setting.split(':')
+            cmd = [sys.executable, os.path.join(ROOT, 'main.py'), '--model', args.model,
+                   '--agem_refresh', refresh, '--suffix', setting, '--results', store.path] + main_args
+            if int(ref_size) > 0:
+                cmd += ['--agem_ref_size', ref_size]
+            print(' '.join(cmd))
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+
+        runs = store.select('runs', model=args.model)[['run_id', 'suffix']]
+        transfer = store.select('transfer', model=args.model)[['run_id', 'acc', 'forgetting']]
+        timings = store.select('timings', model=args.model)
+        steps = timings[timings.phase == 'train_step'][['run_id', 'seconds']]
+
+    table = runs.merge(transfer, on='run_id').merge(steps, on='run_id')
+    table['steps/s'] = 1 / table.pop('seconds')
+    exact = table.iloc[0]
+    table['speedup'] = table['steps/s'] / exact['steps/s']
+    table['acc diff'] = table['acc'] - exact['acc']
+    print(table.rename(columns={'suffix': 'refresh:ref_size'}).drop(columns='run_id').to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
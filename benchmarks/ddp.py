@@ -0,0 +1,74 @@
+# Data parallel training (--ddp) against a single process: trains every method with main.py in one process and on
+# every number of ranks of --ranks, reports the time of the runs and fails if a loss curve (mean train loss of every
+# epoch) differs from the single process one by more than --tolerance, e.g.
+#   python benchmarks/ddp.py --ranks 2,4 --models er,gem -- --dataset oil-daily.csv --processing indicators --epochs 3
+# Unknown arguments are passed to main.py, the dropout is disabled so that the runs can be compared
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import STRATEGIES  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=str, default=','.join(STRATEGIES),
+                        help="Comma separated CL methods to compare")
+    parser.add_argument('--ranks', type=str, default='2,4',
+                        help="Comma separated numbers of ranks")
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help="Tolerated absolute difference of the epoch losses")
+    args, main_argv = parser.parse_known_args()
+    if main_argv and main_argv[0] == '--':
+        main_argv = main_argv[1:]
+    unknown = set(args.models.split(',')) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+    return vars(args), main_argv
+
+
+def loss_curve(name, ranks, main_argv, tmp, cwd=None):
+    # Epoch losses of a main.py run (from the directory cwd, with dataset/ and chp_list.txt) and its seconds
+    from utils.results import ResultsStore
+    path = os.path.join(tmp, f"{name}_{ranks}.h5")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--model', name, '--ddp', str(ranks),
+                    '--dropout', '0', '--results', path] + main_argv,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=cwd)
+    seconds = time.perf_counter() - start
+    epochs = ResultsStore(path).select('epochs').sort_values(['domain', 'epoch'])
+    return epochs['loss'].to_numpy(), seconds
+
+
+def main():
+    args, main_argv = parse_args()
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args['models'].split(','):
+            reference, seconds = loss_curve(name, 1, main_argv, tmp)
+            print(f"{name} 1 rank: {seconds:.1f}s")
+            for ranks in (int(r) for r in args['ranks'].split(',')):
+                losses, ranks_seconds = loss_curve(name, ranks, main_argv, tmp)
+                difference = np.abs(losses - reference).max() if len(losses) == len(reference) else np.inf
+                print(f"{name} {ranks} ranks: {ranks_seconds:.1f}s ({seconds / ranks_seconds:.2f}x) | "
+                      f"max loss difference {difference:.2e}")
+                if not difference <= args['tolerance']:
+                    failures.append((name, ranks, difference))
+
+    for name, ranks, difference in failures:
+        print(f"Loss curve of {name} on {ranks} ranks differs from one process by {difference:.2e}")
+    if failures:
+        sys.exit(1)
+    print(f"All loss curves within {args['tolerance']} of one process")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Speed and accuracy of the bfloat16 autocast (--bf16) and channels last (--channels_last, CNN only) modes against
+# float32 on the synthetic series of benchmarks/strategies.py. Every method is trained in every mode from the same
+# weights and data, the run fails if the final mean accuracy of a mode is more than --tolerance points away from
+# float32, e.g.
+#   python benchmarks/precision.py --models er,ewc,gem --steps 1000 -- --cnn
+# Unknown arguments are passed to the argument parser of main.py
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import STRATEGIES  # noqa: E402
+from benchmarks.strategies import run_strategy  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=str, default='er,derpp,ewc,si,gem,agem',
+                        help="Comma separated CL methods to benchmark")
+    parser.add_argument('--steps', type=int, default=1000,
+                        help="Train steps (batches) of every method, rounded up to whole epochs")
+    parser.add_argument('--regimes', type=int, default=5,
+                        help="Regimes (domains) of the synthetic series")
+    parser.add_argument('--regime_length', type=int, default=400,
+                        help="Length of every regime")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Torch threads of the benchmark processes")
+    parser.add_argument('--tolerance', type=float, default=2.,
+                        help="Tolerated difference of the final mean accuracy from float32, in points")
+    parser.add_argument('--output', type=str, default='precision.json')
+    args, main_argv = parser.parse_known_args()
+    if main_argv and main_argv[0] == '--':
+        main_argv = main_argv[1:]
+    unknown = set(args.models.split(',')) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+    if 'online' in args.models.split(','):
+        parser.error("online reports no accuracy to compare")
+    return vars(args), main_argv
+
+
+def modes(main_argv):
+    # Extra arguments of main.py of every mode, float32 first
+    if '--cnn' in main_argv:
+        return {'float32': [], 'bf16': ['--bf16'], 'channels_last': ['--channels_last'],
+                'bf16+channels_last': ['--bf16', '--channels_last']}
+    return {'float32': [], 'bf16': ['--bf16']}
+
+
+def main():
+    args, main_argv = parse_args()
+    report = {'args': args, 'main_args': main_argv, 'strategies': {}}
+    failures = []
+    for name in args['models'].split(','):
+        results = {}
+        for mode, mode_argv in modes(main_argv).items():
+            with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+                results[mode] = pool.submit(run_strategy, name, main_argv + mode_argv, args).result()
+        report['strategies'][name] = results
+
+        reference = results['float32']
+        for mode, result in results.items():
+            delta = result['metrics']['acc'] - reference['metrics']['acc']
+            print(f"{name} {mode}: {result['steps_per_sec']:.1f} steps/s "
+                  f"({result['steps_per_sec'] / reference['steps_per_sec']:.2f}x) | "
+                  f"acc {result['metrics']['acc']:.2f}% ({delta:+.2f}) | "
+                  f"forgetting {result['metrics']['forgetting']:.2f}")
+            if abs(delta) > args['tolerance']:
+                failures.append((name, mode, delta))
+
+    with open(args['output'], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args['output']}")
+
+    for name, mode, delta in failures:
+        print(f"Accuracy of {name} {mode} differs from float32 by {delta:+.2f} points")
+    if failures:
+        sys.exit(1)
+    print(f"All modes within {args['tolerance']} points of float32")
+
+
+if __name__ == "__main__":
+    main()
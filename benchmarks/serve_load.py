@@ -0,0 +1,108 @@
+# Latency (p50/p99) and throughput of serve.py with concurrent clients, each one sending its next request once the
+# previous one is answered. Starts the server itself with --serve, e.g.
+#   python benchmarks/serve_load.py --serve oil_er.pt --clients 32 --requests 500
+# With --dataset every client streams the prices of the CSV as its own asset (one price per request, after a
+# warm up), otherwise the clients send random input windows
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.inference import HISTORY  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', type=str, default=None,
+                        help="Start serve.py with this model (otherwise connect to a running server)")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500,
+                        help="Requests per client")
+    parser.add_argument('--dataset', type=str, default=None,
+                        help="CSV of dataset/ streamed by the clients")
+    args, serve_args = parser.parse_known_args()
+    return vars(args), serve_args
+
+
+async def request(reader, writer, message):
+    writer.write((json.dumps(message) + '\n').encode())
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
+
+
+async def client(k, args, meta, prices, latencies):
+    reader, writer = await asyncio.open_connection(args['host'], args['port'])
+    rng = np.random.default_rng(k)
+    if prices is not None:
+        warm_up = HISTORY + meta['n_step']
+        await request(reader, writer, {'asset': f"client{k}", 'prices': prices[:warm_up]})
+    for i in range(args['requests']):
+        if prices is not None:
+            message = {'asset': f"client{k}", 'prices': [prices[(warm_up + i) % len(prices)]]}
+        else:
+            message = {'window': rng.normal(size=meta['window_shape']).tolist()}
+        start = time.perf_counter()
+        await request(reader, writer, message)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(args):
+    reader, writer = await asyncio.open_connection(args['host'], args['port'])
+    meta = await request(reader, writer, {'meta': True})
+    writer.close()
+    prices = None
+    if args['dataset'] is not None:
+        from utils.utils import read_csv
+        prices = read_csv(args['dataset']).tolist()
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(k, args, meta, prices, latencies) for k in range(args['clients'])])
+    seconds = time.perf_counter() - start
+    latencies = np.array(latencies) * 1e3
+    print(f"{len(latencies)} requests, {args['clients']} clients | {len(latencies) / seconds:.0f} requests/s | "
+          f"latency p50 {np.percentile(latencies, 50):.2f}ms p99 {np.percentile(latencies, 99):.2f}ms "
+          f"max {latencies.max():.2f}ms")
+
+
+def wait_for_server(process):
+    # serve.py prints a line once it accepts connections
+    line = process.stdout.readline()
+    if not line.startswith('Serving'):
+        process.kill()
+        raise SystemExit(f"serve.py did not start: {line}")
+
+
+def main():
+    args, serve_args = parse_args()
+    process = None
+    if args['serve'] is not None:
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py'), '--model', args['serve'],
+                                    '--host', args['host'], '--port', str(args['port'])] + serve_args,
+                                   stdout=subprocess.PIPE, text=True)
+        wait_for_server(process)
+    try:
+        asyncio.run(run(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
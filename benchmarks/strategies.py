@@ -0,0 +1,185 @@
+# Cost of the CL methods on a synthetic regime switching series (no dataset needed): train steps/s, time of the
+# phases of a step (forward, backward, replay, projection, step, end_task), peak memory and buffer memory.
+# Every method runs in a fresh process for a fixed number of train steps, the results are saved as JSON and can be
+# compared with the JSON of another version, e.g.
+#   python benchmarks/strategies.py --output new.json --compare old.json -- --buffer_size 200
+# Unknown arguments are passed to the argument parser of main.py
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from main import STRATEGIES  # noqa: E402
+
+# Window of the inputs (as the daily datasets)
+N_STEP = 30
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', type=str, default=','.join(STRATEGIES),
+                        help="Comma separated CL methods to benchmark")
+    parser.add_argument('--steps', type=int, default=300,
+                        help="Train steps (batches) of every method, rounded up to whole epochs")
+    parser.add_argument('--regimes', type=int, default=5,
+                        help="Regimes (domains) of the synthetic series")
+    parser.add_argument('--regime_length', type=int, default=400,
+                        help="Length of every regime")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Torch threads of the benchmark processes")
+    parser.add_argument('--output', type=str, default='benchmark.json')
+    parser.add_argument('--compare', type=str, default=None,
+                        help="JSON of a previous run, exit with an error if a method got slower than --threshold")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Tolerated relative drop of the steps/s before a regression is reported")
+    args, main_argv = parser.parse_known_args()
+    if main_argv and main_argv[0] == '--':
+        main_argv = main_argv[1:]
+    unknown = set(args.models.split(',')) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"unknown models: {', '.join(sorted(unknown))}")
+    return vars(args), main_argv
+
+
+def synthetic_domains(config, n_regimes, regime_length, seed):
+    # Train/test domains of the indicators preprocessing, one domain per regime
+    from utils.synthetic import regime_series
+    from utils.utils import split_with_indicators
+
+    prices, chps = regime_series(n_regimes, regime_length, seed)
+    train_data, test_data = split_with_indicators(config, prices, chps, N_STEP)
+    input_size = train_data[0][0][0].size()[0]
+    config['channels'] = input_size if config['cnn'] else input_size // N_STEP
+    return train_data, test_data
+
+
+def peak_rss():
+    # Peak resident memory of the process in bytes (ru_maxrss is in kilobytes on Linux, bytes on macOS)
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_strategy(name, main_argv, args):
+    import random
+    import numpy as np
+    import torch
+    import torch.nn as nn
+    from main import parse_args as parse_main_args, build_model, load_strategy
+    from utils.profiler import profiler
+    from utils.results import ResultsStore
+
+    torch.set_num_threads(args['threads'])
+    config = parse_main_args(main_argv + ['--model', name, '--processing', 'indicators'])
+    random.seed(config['seed'])
+    np.random.seed(config['seed'])
+    torch.manual_seed(config['seed'])
+
+    train_data, test_data = synthetic_domains(config, args['regimes'], args['regime_length'], config['seed'])
+    batches = sum(math.ceil(len(d) / config['batch_size']) for d in train_data)
+    config['epochs'] = max(1, math.ceil(args['steps'] / batches))
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model, optimizer = build_model(config, train_data[0][0][0].size()[0], device)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+
+    train = load_strategy(name)
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, 'w') as devnull:
+        results = ResultsStore(os.path.join(tmp, 'results.h5')).new_run(config)
+        profiler.enable()
+        profiler.watch(model)
+        stdout, sys.stdout = sys.stdout, devnull
+        start = time.perf_counter()
+        try:
+            metrics = train(train_set=train_data, test_set=test_data, model=model, loss=nn.CrossEntropyLoss(),
+                            optimizer=optimizer, device=device, config=config, suffix=config['suffix'],
+                            results=results)
+        finally:
+            seconds = time.perf_counter() - start
+            sys.stdout = stdout
+            profiler.disable()
+            results.close()
+
+    report = profiler.report()
+    phases = report['phases']
+    steps = phases['step']['calls']
+    # Train throughput: the evaluation of the domains and the end of task work are reported as separate phases
+    train_seconds = seconds - sum(phases[p]['seconds'] for p in ('evaluate', 'end_task') if p in phases)
+    return {'steps': steps,
+            'epochs': config['epochs'],
+            'seconds': seconds,
+            'steps_per_sec': steps / train_seconds,
+            'phases': phases,
+            'counters': report['counters'],
+            'peak_rss_bytes': peak_rss(),
+            'peak_cuda_bytes': torch.cuda.max_memory_allocated() if device.type == 'cuda' else 0,
+            'buffer_bytes': report['counters'].get('buffer_bytes', 0),
+            'metrics': {k: float(v) for k, v in metrics.items()} if metrics is not None else {}}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    # Methods of both runs whose steps/s dropped more than threshold, as (name, old steps/s, new steps/s)
+    regressions = []
+    for name, result in new['strategies'].items():
+        if name not in old['strategies']:
+            continue
+        before = old['strategies'][name]['steps_per_sec']
+        if result['steps_per_sec'] < before * (1 - threshold):
+            regressions.append((name, before, result['steps_per_sec']))
+    return regressions
+
+
+def main():
+    args, main_argv = parse_args()
+    import torch
+
+    report = {'meta': {'git': git_revision(), 'torch': torch.__version__, 'python': platform.python_version(),
+                       'device': torch.cuda.get_device_name(0) if torch.cuda.is_available() else platform.processor(),
+                       'args': args, 'main_args': main_argv},
+              'strategies': {}}
+    for name in args['models'].split(','):
+        # Fresh process for every method, so the peak memory is its own
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+            result = pool.submit(run_strategy, name, main_argv, args).result()
+        report['strategies'][name] = result
+        phases = ' | '.join(f"{p} {v['seconds'] / result['steps'] * 1e3:.3f}ms"
+                            for p, v in sorted(result['phases'].items()))
+        print(f"{name}: {result['steps_per_sec']:.1f} steps/s | peak RSS {result['peak_rss_bytes'] / 2 ** 20:.0f}MB "
+              f"| buffer {result['buffer_bytes'] / 2 ** 10:.1f}KB | per step: {phases}")
+
+    with open(args['output'], 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args['output']}")
+
+    if args['compare'] is not None:
+        with open(args['compare']) as f:
+            old = json.load(f)
+        regressions = compare(old, report, args['threshold'])
+        for name, before, after in regressions:
+            print(f"Regression {name}: {before:.1f} -> {after:.1f} steps/s ({after / before - 1:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args['compare']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -62,8 +62,15 @@ detection.
 >>> det.find_changepoints(data, 3, 0.5)
 array([10])
 
+Many datasets, possibly of different lengths, can be analyzed at once:
+
+>>> det = changepoint.BayesOnlineBatch(1, 1)
+>>> det.find_changepoints([data, data[:15]], 3, 0.5)
+[array([10]), array([10])]
+
 All algorithms also work with multivariate data. In that case, data should
-be a 2D array with one dataset per column.
+be a 2D array with one dataset per column. :py:class:`BayesOnline` needs the
+``"multivariate_t"`` observation likelihood for that.
 
 >>> # changepoint at t = 5
 >>> data2 = numpy.concatenate([numpy.random.normal(0, 0.1, 5),
@@ -80,6 +87,14 @@ array([ 5, 10])
 When using :py:class:`BayesOffline`, it is recommended to choose either the
 "ifm" or the "full_cov" model for multivariate data.
 
+Online detection with the multivariate Student t likelihood, whose prior mean
+determines the number of dimensions:
+
+>>> det = changepoint.BayesOnline("const", "multivariate_t",
+...                               obs_params={"mu": numpy.zeros(2)})
+>>> det.find_changepoints(data_m, 2, 0.5)
+array([ 5, 10])
+
 
 .. _pelt:
 
@@ -151,6 +166,14 @@ Detector class
 .. autoclass:: BayesOnline
     :members:
 
+Many series of the same model (``"const"`` hazard and ``"student_t"``
+likelihood) can be analyzed at once using :py:class:`BayesOnlineBatch`, which
+keeps the state of all series in arrays and, with the numba engine, updates
+them in parallel.
+
+.. autoclass:: BayesOnlineBatch
+    :members:
+
 Hazard classes
 ~~~~~~~~~~~~~~
 .. autoclass:: ConstHazard
@@ -163,15 +186,36 @@ Observation likelihood classes
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 .. autoclass:: StudentT
     :members:
+.. autoclass:: MultivariateT
+    :members:
 
-There exists also a numba-``jitclass``-ed version of the class named
-:py:class:`StudentTNumba`.
+There exist also numba-``jitclass``-ed versions of the classes named
+:py:class:`StudentTNumba` and :py:class:`MultivariateTNumba`.
+
+
+Compiled kernels
+----------------
+
+With the numba engine, :py:class:`BayesOnline` (using the ``"const"`` hazard
+and the ``"student_t"`` or ``"multivariate_t"`` likelihood) and
+:py:class:`Pelt` (using the ``"l1"`` or ``"l2"`` cost) run kernels which
+numba caches on disk, so that new processes do not need to compile them
+again. Call :py:func:`warmup` once to populate
+the cache before e.g. starting many short-lived worker processes.
+
+.. autofunction:: warmup
 
 
 Plotting of changepoints
 ------------------------
 .. autofunction:: plot_changepoints
 
+Long time series can be plotted faster by passing ``downsample="minmax"``
+(or ``"lttb"``) to :py:func:`plot_changepoints`, which only draws the points
+selected by :py:func:`decimate`.
+
+.. autofunction:: decimate
+
 
 References
 ----------
@@ -185,13 +229,41 @@ References
 .. [Adam2007] Adams and McKay: "Bayesian Online Changepoint
     Detection", `arXiv:0710.3742 <https://arxiv.org/abs/0710.3742>`_
 """
-from .pelt import Pelt, CostL1, CostL1Numba, CostL2, CostL2Numba
-from .bayes_offline import (BayesOffline, ConstPrior, ConstPriorNumba,
-                            GeometricPrior, GeometricPriorNumba,
-                            NegBinomialPrior, GaussianObsLikelihood,
-                            GaussianObsLikelihoodNumba, IfmObsLikelihood,
-                            IfmObsLikelihoodNumba, FullCovObsLikelihood,
-                            FullCovObsLikelihoodNumba)
-from .bayes_online import (BayesOnline, ConstHazard, ConstHazardNumba,
-                           StudentT, StudentTNumba)
-from .plot import plot_changepoints
+import importlib
+
+
+# Submodules are only imported when one of their names is first accessed. This
+# keeps ``import sdt.changepoint`` cheap, since the numba-jitted classes are
+# set up when their module is imported.
+_lazy_names = {
+    "pelt": ["Pelt", "CostL1", "CostL1Numba", "CostL2", "CostL2Numba"],
+    "bayes_offline": ["BayesOffline", "ConstPrior", "ConstPriorNumba",
+                      "GeometricPrior", "GeometricPriorNumba",
+                      "NegBinomialPrior", "GaussianObsLikelihood",
+                      "GaussianObsLikelihoodNumba", "IfmObsLikelihood",
+                      "IfmObsLikelihoodNumba", "FullCovObsLikelihood",
+                      "FullCovObsLikelihoodNumba"],
+    "bayes_online": ["BayesOnline", "BayesOnlineBatch", "ConstHazard",
+                     "ConstHazardNumba", "StudentT", "StudentTNumba",
+                     "MultivariateT", "MultivariateTNumba"],
+    "plot": ["plot_changepoints", "decimate"],
+    "kernels": ["warmup"],
+}
+_lazy_modules = {n: m for m, names in _lazy_names.items() for n in names}
+
+__all__ = list(_lazy_modules)
+
+
+def __getattr__(name):
+    try:
+        mod = _lazy_modules[name]
+    except KeyError:
+        raise AttributeError(
+            f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(f".{mod}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_modules))
@@ -12,9 +12,10 @@
 import math
 
 import numpy as np
-from scipy import stats, signal
+from scipy import stats, signal, special
 
 from ..helper import numba
+from . import kernels
 
 
 _jit = numba.jit(nopython=True, nogil=True)
@@ -155,6 +156,193 @@ class StudentTNumba(StudentT):
         return ret
 
 
+class MultivariateT:
+    """Multivariate Student t observation likelihood
+
+    Predictive distribution of a multivariate normal model with unknown mean
+    and covariance matrix and a Normal-inverse-Wishart prior. This allows
+    for detecting changepoints jointly in several features, passed as one
+    row per data point. For one dimension, ``nu = 2 * alpha``, and
+    ``psi = 2 * beta``, this is the same as :py:class:`StudentT`.
+    """
+    def __init__(self, mu, kappa=1., nu=None, psi=None):
+        """Parameters
+        ----------
+        mu : array-like, shape(d)
+            Prior mean. Its length determines the number of dimensions.
+        kappa : float, optional
+            Prior number of observations of the mean. Defaults to 1.
+        nu : float or None, optional
+            Prior degrees of freedom of the covariance matrix, has to be
+            larger than ``d - 1``. If `None`, use ``d - 0.8``, which
+            corresponds to the default `alpha` of :py:class:`StudentT`.
+        psi : array-like, shape(d, d) or None, optional
+            Prior scale matrix. If `None`, use ``0.02`` times the identity
+            matrix, which corresponds to the default `beta` of
+            :py:class:`StudentT`.
+        """
+        self._mu0 = np.array(mu, dtype=np.float64)
+        d = len(self._mu0)
+        self._kappa0 = np.float64(kappa)
+        self._nu0 = np.float64(d - 0.8 if nu is None else nu)
+        self._psi0 = (0.02 * np.eye(d) if psi is None
+                      else np.array(psi, dtype=np.float64))
+
+        self.reset()
+
+    def reset(self):
+        """Reset state"""
+        self._mu = self._mu0[None, :].copy()
+        self._kappa = np.full(1, self._kappa0)
+        self._nu = np.full(1, self._nu0)
+        self._psi = self._psi0[None, :, :].copy()
+
+    def pdf(self, data):
+        """Calculate probability density function (PDF)
+
+        Parameters
+        ----------
+        data : array-like, shape(d)
+            Data point for which to calculate the PDF
+        """
+        d = len(self._mu0)
+        df = self._nu - d + 1
+        shape = (self._psi * ((self._kappa + 1) /
+                              (self._kappa * df))[:, None, None])
+        diff = np.asarray(data, dtype=float) - self._mu
+        maha = np.sum(diff * np.linalg.solve(shape, diff[:, :, None])[..., 0],
+                      axis=1)
+        logdet = np.linalg.slogdet(shape)[1]
+
+        return np.exp(special.gammaln((df + d) / 2) -
+                      special.gammaln(df / 2) - d / 2 * np.log(df * np.pi) -
+                      logdet / 2 - (df + d) / 2 * np.log1p(maha / df))
+
+    def update_theta(self, data):
+        """Update parameters for every possible run length
+
+        Parameters
+        ----------
+        data : array-like, shape(d)
+            Data point to use for update
+        """
+        data = np.asarray(data, dtype=float)
+        diff = data - self._mu
+        k = self._kappa[:, None]
+
+        muT0 = np.empty((len(self._mu) + 1, len(self._mu0)))
+        muT0[0] = self._mu0
+        muT0[1:] = (k * self._mu + data) / (k + 1)
+
+        kappaT0 = np.empty(len(self._kappa) + 1)
+        kappaT0[0] = self._kappa0
+        kappaT0[1:] = self._kappa + 1.
+
+        nuT0 = np.empty(len(self._nu) + 1)
+        nuT0[0] = self._nu0
+        nuT0[1:] = self._nu + 1.
+
+        psiT0 = np.empty((len(self._psi) + 1,) + self._psi0.shape)
+        psiT0[0] = self._psi0
+        psiT0[1:] = (self._psi + (k / (k + 1))[:, :, None] *
+                     diff[:, :, None] * diff[:, None, :])
+
+        self._mu = muT0
+        self._kappa = kappaT0
+        self._nu = nuT0
+        self._psi = psiT0
+
+
+@numba.jitclass([("_mu0", numba.float64[:]), ("_kappa0", numba.float64),
+                 ("_nu0", numba.float64), ("_chol0", numba.float64[:, :]),
+                 ("_mu", numba.float64[:, :]), ("_kappa", numba.float64[:]),
+                 ("_nu", numba.float64[:]),
+                 ("_chol", numba.float64[:, :, :]),
+                 ("_work", numba.float64[:])])
+class MultivariateTNumba(MultivariateT):
+    """Multivariate Student t observation likelihood (numba-accelerated)
+
+    Instead of the scale matrices, this keeps their Cholesky factors, which
+    are updated in O(d²) operations per run length.
+    """
+    def __init__(self, mu, kappa=1., nu=None, psi=None):
+        """Parameters
+        ----------
+        mu, kappa, nu, psi
+            See :py:class:`MultivariateT`.
+        """
+        self._mu0 = np.asarray(mu, dtype=np.float64).copy()
+        d = len(self._mu0)
+        self._kappa0 = kappa
+        if nu is None:
+            self._nu0 = d - 0.8
+        else:
+            self._nu0 = nu
+        if psi is None:
+            self._chol0 = np.sqrt(0.02) * np.eye(d)
+        else:
+            self._chol0 = np.linalg.cholesky(
+                np.asarray(psi, dtype=np.float64))
+        self._work = np.empty(d)
+
+        self.reset()
+
+    def reset(self):
+        """Reset state"""
+        d = len(self._mu0)
+        self._mu = self._mu0.copy().reshape((1, d))
+        self._kappa = np.full(1, self._kappa0)
+        self._nu = np.full(1, self._nu0)
+        self._chol = self._chol0.copy().reshape((1, d, d))
+
+    def pdf(self, data):
+        """Calculate probability density function (PDF)
+
+        Parameters
+        ----------
+        data : array-like, shape(d)
+            Data point for which to calculate the PDF
+        """
+        x = np.asarray(data, dtype=np.float64)
+        ret = np.empty(len(self._kappa))
+        for r in range(len(ret)):
+            ret[r] = math.exp(kernels.mv_t_logpdf(
+                x, self._mu[r], self._kappa[r], self._nu[r], self._chol[r],
+                self._work))
+        return ret
+
+    def update_theta(self, data):
+        """Update parameters for every possible run length
+
+        Parameters
+        ----------
+        data : array-like, shape(d)
+            Data point to use for update
+        """
+        x = np.asarray(data, dtype=np.float64)
+        n = len(self._kappa) + 1
+        d = len(self._mu0)
+        mu = np.empty((n, d))
+        kappa = np.empty(n)
+        nu = np.empty(n)
+        chol = np.empty((n, d, d))
+        mu[:-1] = self._mu
+        kappa[:-1] = self._kappa
+        nu[:-1] = self._nu
+        chol[:-1] = self._chol
+        for r in range(n - 1, 0, -1):
+            kernels.niw_update(x, mu, kappa, nu, chol, r, self._work)
+        mu[0] = self._mu0
+        kappa[0] = self._kappa0
+        nu[0] = self._nu0
+        chol[0] = self._chol0
+
+        self._mu = mu
+        self._kappa = kappa
+        self._nu = nu
+        self._chol = chol
+
+
 def segmentation_step(x, old_p, hazard, obs_likelihood):
     """Calculate changepoint probabilites for new datapoint
 
@@ -231,7 +419,8 @@ class BayesOnline:
     probabilities from :py:attr:`probabilities`.
     """
     hazard_map = dict(const=(ConstHazard, ConstHazardNumba))
-    likelihood_map = dict(student_t=(StudentT, StudentTNumba))
+    likelihood_map = dict(student_t=(StudentT, StudentTNumba),
+                          multivariate_t=(MultivariateT, MultivariateTNumba))
 
     def __init__(self, hazard="const", obs_likelihood="student_t",
                  hazard_params={"time_scale": 250.},
@@ -246,10 +435,13 @@ class BayesOnline:
             See the `hazard_params` parameter for details. It has to return
             the hazards corresponding to the runlengths.
             If "const", use :py:func:`constant_hazard`. Defaults to "const".
-        obs_likelihood : "student_t" or type
+        obs_likelihood : "student_t", "multivariate_t" or type
             Class implementing the observation likelihood. See
             :py:class:`StudentTPython` for an example. If "student_t", use
-            :py:class:`StudentTPython`. Defaults to "student_t".
+            :py:class:`StudentTPython`. If "multivariate_t", use
+            :py:class:`MultivariateT` for data with one row per data point,
+            whose `obs_params` need at least the prior mean ``"mu"``.
+            Defaults to "student_t".
         hazard_params : numpy.ndarray, optional
             Parameters to pass as second argument to the hazard function.
             Defaults to ``numpy.array([250])``.
@@ -288,8 +480,8 @@ class BayesOnline:
 
         Parameters
         ----------
-        x : number
-            New data point
+        x : number or array-like
+            New data point. An array for the "multivariate_t" likelihood.
         """
         old_p = self.probabilities[-1]
         if self._use_numba:
@@ -309,7 +501,8 @@ class BayesOnline:
         Parameters
         ----------
         data : array-like
-            Dataset
+            Dataset. For the "multivariate_t" likelihood, a 2D array with one
+            data point per row.
         past : int, optional
             How many datapoints into the past to look. Larger values will
             increase robustness, but also latency, meaning that if `past`
@@ -334,7 +527,28 @@ class BayesOnline:
         """
         self.reset()
 
-        if self._use_numba:
+        if (self._use_numba and isinstance(self.hazard, ConstHazardNumba) and
+                isinstance(self.obs_likelihood, StudentTNumba)):
+            # Use the cacheable kernel, which avoids compiling on every run
+            ol = self.obs_likelihood
+            prob, params = kernels.bayes_online_segmentation(
+                np.asarray(data, dtype=float), self.hazard.time_scale,
+                ol._alpha0, ol._beta0, ol._kappa0, ol._mu0)
+            ol._alpha, ol._beta, ol._kappa, ol._mu = params
+            self.probabilities = []
+            for i, p in enumerate(prob):
+                self.probabilities.append(p[:i+1])
+        elif (self._use_numba and isinstance(self.hazard, ConstHazardNumba)
+                and isinstance(self.obs_likelihood, MultivariateTNumba)):
+            ol = self.obs_likelihood
+            prob, params = kernels.bayes_online_segmentation_mv(
+                np.asarray(data, dtype=float), self.hazard.time_scale,
+                ol._mu0, ol._kappa0, ol._nu0, ol._chol0)
+            ol._mu, ol._kappa, ol._nu, ol._chol = params
+            self.probabilities = []
+            for i, p in enumerate(prob):
+                self.probabilities.append(p[:i+1])
+        elif self._use_numba:
             prob = segmentation_numba(data, self.hazard, self.obs_likelihood)
             self.probabilities = []
             for i, p in enumerate(prob):
@@ -377,3 +591,170 @@ class BayesOnline:
             the array equals the number of datapoints - `past`.
         """
         return np.array([p[past] for p in self.probabilities[past:-1]])
+
+
+def segmentation_step_batch(x, mask, prob, params, n_seen, time_scale):
+    """Advance the detection of many series by one data point (NumPy)
+
+    Same as :py:func:`kernels.bayes_online_batch_step`, vectorized over
+    series and run lengths. The entries of `params` beyond the valid run
+    lengths have to hold valid parameters (e.g. the prior), since they are
+    evaluated too (with probability 0).
+    """
+    a, b, k, m = params
+    xs = x[:, None]
+    scale = np.sqrt(b * (k + 1) / (a * k))
+    pred = prob * stats.t.pdf(xs, 2 * a, m, scale)
+    h = 1. / time_scale
+
+    new_p = np.empty_like(prob)
+    new_p[:, 1:] = pred[:, :-1] * (1 - h)
+    new_p[:, 0] = np.sum(pred * h, axis=1)
+    new_p /= np.sum(new_p, axis=1, keepdims=True)
+
+    new_params = params.copy()
+    new_params[1, :, 1:] = (b[:, :-1] + k[:, :-1] * (xs - m[:, :-1])**2 /
+                            (2. * (k[:, :-1] + 1.)))
+    new_params[3, :, 1:] = (k[:, :-1] * m[:, :-1] + xs) / (k[:, :-1] + 1)
+    new_params[2, :, 1:] = k[:, :-1] + 1.
+    new_params[0, :, 1:] = a[:, :-1] + 0.5
+
+    prob[mask] = new_p[mask]
+    params[:, mask] = new_params[:, mask]
+    n_seen[mask] += 1
+
+
+class BayesOnlineBatch:
+    """Bayesian online changepoint detector for many series at once
+
+    Runs the same detection as :py:class:`BayesOnline` with the constant
+    hazard function and the Student t observation likelihood on many
+    independent series. The run length probabilities and the likelihood
+    parameters of all series are kept in ``(n_series, R)`` arrays and each
+    call to :py:meth:`update` advances all series by one data point. With
+    the numba engine, this runs in parallel over the series.
+
+    Series of different lengths are supported by masking the series which
+    have no new data point.
+    """
+    def __init__(self, n_series, max_length, time_scale=250.,
+                 obs_params={"alpha": 0.1, "beta": 0.01, "kappa": 1.,
+                             "mu": 0.},
+                 engine="numba"):
+        """Parameters
+        ----------
+        n_series : int
+            Number of series
+        max_length : int
+            Maximum number of data points per series
+        time_scale : float, optional
+            Time scale of the constant hazard function. Defaults to 250.
+        obs_params : dict, optional
+            Prior parameters of the Student t likelihood, see
+            :py:class:`StudentT`. Defaults to
+            ``{"alpha": 0.1, "beta": 0.01, "kappa": 1., "mu": 0.}``.
+        engine : {"numba", "python"}, optional
+            Whether to use the parallel numba kernel or NumPy. Defaults to
+            "numba".
+        """
+        self._use_numba = (engine == "numba") and numba.numba_available
+        self.n_series = n_series
+        self.max_length = max_length
+        self.time_scale = float(time_scale)
+        self._prior = np.array([obs_params[n] for n in
+                                ("alpha", "beta", "kappa", "mu")],
+                               dtype=float)
+        self.reset()
+
+    def reset(self):
+        """Reset the detector
+
+        All previous data of all series will be forgotten.
+        """
+        size = (self.n_series, self.max_length + 1)
+        self.probabilities = np.zeros(size)
+        self.probabilities[:, 0] = 1.
+        self.params = np.empty((4,) + size)
+        self.params[:] = self._prior.reshape((4, 1, 1))
+        self.n_seen = np.zeros(self.n_series, dtype=np.int64)
+
+    def update(self, x, mask=None):
+        """Add one data point to every series
+
+        Parameters
+        ----------
+        x : array-like, shape(n_series)
+            New data point of every series
+        mask : array-like of bool, shape(n_series) or None, optional
+            Series which have a new data point. Entries of `x` of the other
+            series are ignored. If `None`, update all series.
+        """
+        x = np.asarray(x, dtype=float)
+        if mask is None:
+            mask = np.ones(self.n_series, dtype=bool)
+        else:
+            mask = np.asarray(mask, dtype=bool)
+        if np.any(self.n_seen[mask] >= self.max_length):
+            raise ValueError("More than `max_length` data points.")
+
+        if self._use_numba:
+            kernels.bayes_online_batch_step(x, mask, self.probabilities,
+                                            self.params, self.n_seen,
+                                            self.time_scale)
+        else:
+            segmentation_step_batch(x, mask, self.probabilities,
+                                    self.params, self.n_seen,
+                                    self.time_scale)
+
+    def find_changepoints(self, data, past=3, prob_threshold=None):
+        """Analyze many datasets
+
+        This resets the detector (for ``len(data)`` series of up to the
+        length of the longest dataset) and calls :py:meth:`update` for
+        every time step.
+
+        Parameters
+        ----------
+        data : list of array-like or numpy.ndarray, shape(n_series, n)
+            One dataset per series, they may differ in length.
+        past : int, optional
+            How many datapoints into the past to look. See
+            :py:meth:`BayesOnline.find_changepoints`. Defaults to 3.
+        prob_threshold : float or None, optional
+            If this is a float, local maxima in the changepoint probabilities
+            are considered changepoints, if they are above the threshold.
+            Defaults to `None`.
+
+        Returns
+        -------
+        list of numpy.ndarray
+            For every dataset, what :py:meth:`BayesOnline.find_changepoints`
+            returns for it: the probabilities for a changepoint as a function
+            of time or the changepoints.
+        """
+        lengths = np.array([len(d) for d in data], dtype=np.int64)
+        padded = np.zeros((len(data), lengths.max(initial=0)))
+        for p, d in zip(padded, data):
+            p[:len(d)] = d
+
+        self.n_series = len(data)
+        self.max_length = padded.shape[1]
+        self.reset()
+        # Probability of run length `past` after every time step, the same
+        # as `BayesOnline.probabilities[i][past]`
+        run_prob = np.zeros((len(data), padded.shape[1] + 1))
+        run_prob[:, 0] = self.probabilities[:, past]
+        for t in range(padded.shape[1]):
+            self.update(padded[:, t], t < lengths)
+            run_prob[:, t+1] = self.probabilities[:, past]
+
+        ret = []
+        for p, n in zip(run_prob, lengths):
+            prob = p[past:n].copy()
+            if len(prob):
+                prob[0] = 0
+            if prob_threshold is not None:
+                lmax = signal.argrelmax(prob)[0]
+                prob = lmax[prob[lmax] >= prob_threshold]
+            ret.append(prob)
+        return ret
@@ -0,0 +1,455 @@
+# SPDX-FileCopyrightText: 2020 Lukas Schrangl <lukas.schrangl@tuwien.ac.at>
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""Cacheable numba kernels for changepoint detection
+
+The numba engines of :py:class:`BayesOnline` and :py:class:`Pelt` take
+``jitclass`` instances as arguments, which cannot be cached on disk. Thus
+every new process has to compile them again. The kernels in this module are
+plain functions taking arrays (the parameters of the model are passed as
+struct of arrays) and are compiled with ``cache=True``. Call
+:py:func:`warmup` once (e.g. when installing or before starting a pool of
+worker processes) to compile them and persist the machine code to numba's
+cache.
+"""
+import math
+
+import numpy as np
+
+from ..helper import numba
+
+
+_jit = numba.jit(nopython=True, nogil=True, cache=True)
+_jit_parallel = numba.jit(nopython=True, nogil=True, cache=True,
+                          parallel=True)
+
+#: Codes for the cost functions of :py:func:`pelt_segmentation`
+COST_L1 = 0
+COST_L2 = 1
+
+
+@_jit
+def t_pdf(x, df, loc, scale):
+    """Student t probability density function for scalars"""
+    y = (x - loc) / scale
+    ret = math.exp(math.lgamma((df + 1) / 2) - math.lgamma(df / 2))
+    ret /= (math.sqrt(math.pi * df) * (1 + y**2 / df)**((df + 1) / 2))
+    return ret / scale
+
+
+@_jit
+def bayes_online_segmentation(data, time_scale, alpha, beta, kappa, mu):
+    """Online Bayesian changepoint detection
+
+    Equivalent to :py:func:`bayes_online.segmentation_numba` with a
+    :py:class:`ConstHazard` and a :py:class:`StudentT` observation
+    likelihood.
+
+    Parameters
+    ----------
+    data : numpy.ndarray, shape(n)
+        Data points
+    time_scale : float
+        Time scale of the constant hazard function
+    alpha, beta, kappa, mu : float
+        Prior parameters of the Student t likelihood
+
+    Returns
+    -------
+    prob : numpy.ndarray, shape(n + 1, n + 1)
+        Run length probabilities. Row `i` holds the ``i + 1`` probabilities
+        after observing the first `i` data points.
+    params : numpy.ndarray, shape(4, n + 1)
+        Posterior parameters (alpha, beta, kappa, mu) for every run length
+        after observing all data points.
+    """
+    n = len(data)
+    ret = np.zeros((n + 1, n + 1))
+    ret[0, 0] = 1.
+
+    # Struct of arrays, one entry per run length. Updated in place.
+    params = np.empty((4, n + 1))
+    a = params[0]
+    b = params[1]
+    k = params[2]
+    m = params[3]
+    a[0] = alpha
+    b[0] = beta
+    k[0] = kappa
+    m[0] = mu
+
+    h = 1. / time_scale
+    for i in range(n):
+        x = data[i]
+        old_p = ret[i, :i+1]
+        new_p = ret[i+1, :i+2]
+
+        cp = 0.
+        for r in range(i + 1):
+            scale = math.sqrt(b[r] * (k[r] + 1) / (a[r] * k[r]))
+            p = old_p[r] * t_pdf(x, 2 * a[r], m[r], scale)
+            new_p[r+1] = p * (1 - h)
+            cp += p * h
+        new_p[0] = cp
+        new_p /= new_p.sum()
+
+        # Update parameters. Go backwards so that entry r - 1 is still the
+        # old value when computing entry r.
+        for r in range(i + 1, 0, -1):
+            b[r] = b[r-1] + k[r-1] * (x - m[r-1])**2 / (2. * (k[r-1] + 1.))
+            m[r] = (k[r-1] * m[r-1] + x) / (k[r-1] + 1)
+            k[r] = k[r-1] + 1.
+            a[r] = a[r-1] + 0.5
+    return ret, params
+
+
+@_jit
+def mv_t_logpdf(x, mu, kappa, nu, chol, work):
+    """Log PDF of the predictive distribution of a Normal-inverse-Wishart
+    model
+
+    This is a multivariate Student t distribution with ``nu - d + 1`` degrees
+    of freedom, location `mu` and shape matrix ``psi * (kappa + 1) /
+    (kappa * (nu - d + 1))``, where ``chol`` is the lower Cholesky factor of
+    ``psi``. Takes O(d²) operations.
+
+    Parameters
+    ----------
+    x, mu : numpy.ndarray, shape(d)
+        Data point and location
+    kappa, nu : float
+        Posterior parameters
+    chol : numpy.ndarray, shape(d, d)
+        Lower Cholesky factor of the posterior scale matrix
+    work : numpy.ndarray, shape(d)
+        Scratch space
+
+    Returns
+    -------
+    float
+        Logarithm of the PDF
+    """
+    d = len(x)
+    df = nu - d + 1
+    c = (kappa + 1) / (kappa * df)
+    # Solve chol @ work = x - mu by forward substitution
+    maha = 0.
+    logdet = 0.
+    for i in range(d):
+        s = x[i] - mu[i]
+        for j in range(i):
+            s -= chol[i, j] * work[j]
+        work[i] = s / chol[i, i]
+        maha += work[i]**2
+        logdet += math.log(chol[i, i])
+    return (math.lgamma((df + d) / 2) - math.lgamma(df / 2) -
+            d / 2 * math.log(df * math.pi * c) - logdet -
+            (df + d) / 2 * math.log1p(maha / (c * df)))
+
+
+@_jit
+def niw_update(x, mu, kappa, nu, chol, r, work):
+    """Update the Normal-inverse-Wishart parameters of run length `r`
+
+    Entry ``r`` of the parameter arrays is set to the posterior of entry
+    ``r - 1`` after observing `x`. The scale matrix gets the rank-1 update
+    ``kappa / (kappa + 1) * outer(x - mu, x - mu)``, which is applied to its
+    Cholesky factor in O(d²) operations.
+
+    Parameters
+    ----------
+    x : numpy.ndarray, shape(d)
+        Data point
+    mu : numpy.ndarray, shape(R, d)
+        Locations
+    kappa, nu : numpy.ndarray, shape(R)
+        Posterior parameters
+    chol : numpy.ndarray, shape(R, d, d)
+        Lower Cholesky factors of the scale matrices
+    r : int
+        Run length to update, ``r >= 1``
+    work : numpy.ndarray, shape(d)
+        Scratch space
+    """
+    k = kappa[r-1]
+    w = math.sqrt(k / (k + 1))
+    for i in range(len(x)):
+        work[i] = w * (x[i] - mu[r-1, i])
+        mu[r, i] = (k * mu[r-1, i] + x[i]) / (k + 1)
+    kappa[r] = k + 1.
+    nu[r] = nu[r-1] + 1.
+
+    L = chol[r]
+    L[:] = chol[r-1]
+    for j in range(len(x)):
+        rad = math.sqrt(L[j, j]**2 + work[j]**2)
+        c = rad / L[j, j]
+        s = work[j] / L[j, j]
+        L[j, j] = rad
+        for i in range(j + 1, len(x)):
+            L[i, j] = (L[i, j] + s * work[i]) / c
+            work[i] = c * work[i] - s * L[i, j]
+
+
+@_jit
+def bayes_online_segmentation_mv(data, time_scale, mu, kappa, nu, chol):
+    """Online Bayesian changepoint detection for multivariate data
+
+    Equivalent to :py:func:`bayes_online.segmentation_numba` with a
+    :py:class:`ConstHazard` and a :py:class:`MultivariateT` observation
+    likelihood. Each time step takes O(R·d²) operations for `R` run lengths
+    and `d` dimensions.
+
+    Parameters
+    ----------
+    data : numpy.ndarray, shape(n, d)
+        Data points, one per row
+    time_scale : float
+        Time scale of the constant hazard function
+    mu : numpy.ndarray, shape(d)
+        Prior location
+    kappa, nu : float
+        Prior parameters
+    chol : numpy.ndarray, shape(d, d)
+        Lower Cholesky factor of the prior scale matrix
+
+    Returns
+    -------
+    prob : numpy.ndarray, shape(n + 1, n + 1)
+        Run length probabilities. Row `i` holds the ``i + 1`` probabilities
+        after observing the first `i` data points.
+    params : tuple of numpy.ndarray
+        Posterior parameters (mu, kappa, nu, chol) for every run length
+        after observing all data points.
+    """
+    n, d = data.shape
+    ret = np.zeros((n + 1, n + 1))
+    ret[0, 0] = 1.
+
+    m = np.empty((n + 1, d))
+    k = np.empty(n + 1)
+    v = np.empty(n + 1)
+    L = np.zeros((n + 1, d, d))
+    m[0] = mu
+    k[0] = kappa
+    v[0] = nu
+    L[0] = chol
+    work = np.empty(d)
+
+    h = 1. / time_scale
+    for i in range(n):
+        x = data[i]
+        old_p = ret[i, :i+1]
+        new_p = ret[i+1, :i+2]
+
+        cp = 0.
+        for r in range(i + 1):
+            p = old_p[r] * math.exp(mv_t_logpdf(x, m[r], k[r], v[r], L[r],
+                                                work))
+            new_p[r+1] = p * (1 - h)
+            cp += p * h
+        new_p[0] = cp
+        new_p /= new_p.sum()
+
+        # Go backwards so that entry r - 1 is still the old value
+        for r in range(i + 1, 0, -1):
+            niw_update(x, m, k, v, L, r, work)
+    return ret, (m, k, v, L)
+
+
+@_jit_parallel
+def bayes_online_batch_step(x, mask, prob, params, n_seen, time_scale):
+    """Advance the online Bayesian changepoint detection of many series
+
+    One time step of :py:func:`bayes_online_segmentation` for every series
+    `s` with ``mask[s]`` set, in parallel over the series. The state of the
+    series is updated in place.
+
+    Parameters
+    ----------
+    x : numpy.ndarray, shape(n_series)
+        New data point of every series
+    mask : numpy.ndarray, shape(n_series), dtype(bool)
+        Series which have a new data point. The others are left unchanged,
+        which allows for series of different lengths.
+    prob : numpy.ndarray, shape(n_series, R)
+        Run length probabilities of every series. Row `s` holds
+        ``n_seen[s] + 1`` valid entries, the rest is 0.
+    params : numpy.ndarray, shape(4, n_series, R)
+        Posterior parameters (alpha, beta, kappa, mu) of the Student t
+        likelihood for every series and run length. Entry 0 along the last
+        axis holds the prior.
+    n_seen : numpy.ndarray, shape(n_series), dtype(int)
+        Number of data points seen by every series. `R` has to be larger
+        than ``n_seen[s] + 1`` for every updated series.
+    time_scale : float
+        Time scale of the constant hazard function
+    """
+    h = 1. / time_scale
+    for s in numba.prange(len(x)):
+        if not mask[s]:
+            continue
+        i = n_seen[s]
+        xs = x[s]
+        p = prob[s]
+        a = params[0, s]
+        b = params[1, s]
+        k = params[2, s]
+        m = params[3, s]
+
+        # Same operations in the same order as bayes_online_segmentation:
+        # growth probabilities in place first, then shifted to the right
+        cp = 0.
+        for r in range(i + 1):
+            scale = math.sqrt(b[r] * (k[r] + 1) / (a[r] * k[r]))
+            p[r] = p[r] * t_pdf(xs, 2 * a[r], m[r], scale)
+            cp += p[r] * h
+        for r in range(i, -1, -1):
+            p[r+1] = p[r] * (1 - h)
+        p[0] = cp
+        # Explicit loops, numba's parfor pass gets array expressions on views
+        # inside of prange wrong
+        norm = 0.
+        for r in range(i + 2):
+            norm += p[r]
+        for r in range(i + 2):
+            p[r] /= norm
+
+        for r in range(i + 1, 0, -1):
+            b[r] = b[r-1] + k[r-1] * (xs - m[r-1])**2 / (2. * (k[r-1] + 1.))
+            m[r] = (k[r-1] * m[r-1] + xs) / (k[r-1] + 1)
+            k[r] = k[r-1] + 1.
+            a[r] = a[r-1] + 0.5
+        n_seen[s] = i + 1
+
+
+@_jit
+def cost_l1(data, t, s):
+    """L1 norm cost of ``data[t:s]``, see :py:class:`CostL1`"""
+    sub = data[t:s]
+    ret = 0.
+    for i in range(sub.shape[1]):
+        med = np.median(sub[:, i])
+        ret += np.abs(sub[:, i] - med).sum()
+    return ret
+
+
+@_jit
+def cost_l2(data, t, s):
+    """L2 norm cost of ``data[t:s]``, see :py:class:`CostL2`"""
+    sub = data[t:s]
+    ret = 0.
+    for i in range(sub.shape[1]):
+        ret += np.var(sub[:, i])
+    return ret * (s - t)
+
+
+@_jit
+def pelt_segmentation(data, cost, min_size, jump, penalty, max_exp_cp):
+    """PELT changepoint detection
+
+    Equivalent to :py:func:`pelt.segmentation_numba`, but the cost function
+    is selected by a code instead of passing a cost class instance.
+
+    Parameters
+    ----------
+    data : numpy.ndarray, shape(n, m)
+        m datasets of n data points
+    cost : int
+        :py:data:`COST_L1` or :py:data:`COST_L2`
+    min_size, jump, penalty, max_exp_cp
+        See :py:func:`pelt.segmentation`.
+
+    Returns
+    -------
+    numpy.ndarray, shape(n)
+        Array of changepoints
+    """
+    n_samples = len(data)
+    times = np.arange(0, n_samples + jump, jump)
+    times[-1] = n_samples
+    min_idx_diff = math.ceil(min_size/jump)
+
+    if len(times) <= min_idx_diff:
+        return np.empty(0, dtype=np.int64)
+
+    costs = np.full(len(times), np.inf)
+    costs[0] = 0
+
+    le = len(times) - min_idx_diff
+    partitions = np.empty(le * max_exp_cp, dtype=np.int64)
+    partition_starts = np.zeros(len(times) + 1, dtype=np.int64)
+
+    start_idx = np.zeros(1, dtype=np.int64)
+    for new_start, end_idx in enumerate(range(min_idx_diff, len(times))):
+        new_costs = np.empty(len(start_idx), dtype=np.float64)
+        for j, s in enumerate(start_idx):
+            if cost == COST_L1:
+                c = cost_l1(data, times[s], times[end_idx])
+            else:
+                c = cost_l2(data, times[s], times[end_idx])
+            new_costs[j] = c + penalty + costs[s]
+
+        best_idx = np.argmin(new_costs)
+        best_cost = new_costs[best_idx]
+        best_real_idx = start_idx[best_idx]
+
+        if best_real_idx == 0:
+            best_part = np.empty(0, dtype=np.int64)
+        else:
+            best_part_start = partition_starts[best_real_idx]
+            best_part_end = partition_starts[best_real_idx+1]
+            best_part = partitions[best_part_start:best_part_end]
+
+        if end_idx == len(times) - 1:
+            return times[best_part]
+
+        new_partition = np.empty(len(best_part)+1, dtype=np.int64)
+        new_partition[:-1] = best_part
+        new_partition[-1] = end_idx
+
+        new_part_start = partition_starts[end_idx]
+        new_part_end = new_part_start + len(new_partition)
+
+        while new_part_end > partitions.size:
+            old_part = partitions
+            partitions = np.empty(2 * old_part.size, dtype=np.int64)
+            partitions[:old_part.size] = old_part
+
+        partitions[new_part_start:new_part_end] = new_partition
+        partition_starts[end_idx+1] = new_part_end
+
+        costs[end_idx] = best_cost
+
+        s2 = start_idx[new_costs <= best_cost + penalty]
+        start_idx = np.empty(len(s2) + 1, dtype=np.int64)
+        start_idx[:-1] = s2
+        start_idx[-1] = new_start + 1
+    return np.empty(0, dtype=np.int64)
+
+
+def warmup():
+    """Compile all kernels and store them in numba's on-disk cache
+
+    Subsequent processes will load the machine code from the cache instead
+    of compiling it. If numba is not available, this does nothing.
+    """
+    if not numba.numba_available:
+        return
+    data = np.linspace(0., 1., 10)
+    bayes_online_segmentation(data, 250., 0.1, 0.01, 1., 0.)
+    bayes_online_segmentation_mv(data.reshape((-1, 2)), 250., np.zeros(2),
+                                 1., 1.2, 0.1 * np.eye(2))
+    params = np.empty((4, 2, len(data) + 1))
+    params[:] = np.array([0.1, 0.01, 1., 0.]).reshape((4, 1, 1))
+    bayes_online_batch_step(data[:2], np.ones(2, dtype=bool),
+                            np.zeros((2, len(data) + 1)), params,
+                            np.zeros(2, dtype=np.int64), 250.)
+    data2 = data.reshape((-1, 1))
+    for c in (COST_L1, COST_L2):
+        pelt_segmentation(data2, c, 2, 1, 1., 10)
+
+
+if __name__ == "__main__":
+    warmup()
@@ -8,6 +8,7 @@ import math
 import numpy as np
 
 from ..helper import numba
+from . import kernels
 
 
 class CostL1:
@@ -261,6 +262,14 @@ class Pelt:
 
         self.segmentation = segmentation_numba if use_numba else segmentation
 
+        # Builtin costs can use the cacheable kernel
+        self._kernel_cost = None
+        if use_numba:
+            if isinstance(self.cost, CostL1Numba):
+                self._kernel_cost = kernels.COST_L1
+            elif isinstance(self.cost, CostL2Numba):
+                self._kernel_cost = kernels.COST_L2
+
         self._min_size = max(min_size, self.cost.min_size)
         self._jump = jump
 
@@ -286,6 +295,10 @@ class Pelt:
         """
         if data.ndim == 1:
             data = data.reshape((-1, 1))
+        if self._kernel_cost is not None:
+            return kernels.pelt_segmentation(
+                np.ascontiguousarray(data, dtype=float), self._kernel_cost,
+                self._min_size, self._jump, penalty, max_exp_cp)
         self.cost.set_data(data)
         return self.segmentation(self.cost, self._min_size, self._jump,
                                  penalty, max_exp_cp)
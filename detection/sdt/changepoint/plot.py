@@ -8,9 +8,86 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 
+def _minmax(data, n_out):
+    """Indices of the minimum and maximum of ``n_out // 2`` bins"""
+    size = -(-len(data) // max(n_out // 2, 1))
+    n_bins = -(-len(data) // size)
+    lo = np.full(n_bins * size, np.inf)
+    hi = np.full(n_bins * size, -np.inf)
+    lo[:len(data)] = data
+    hi[:len(data)] = data
+    offsets = np.arange(n_bins) * size
+    idx = np.concatenate([
+        offsets + np.argmin(lo.reshape((n_bins, size)), axis=1),
+        offsets + np.argmax(hi.reshape((n_bins, size)), axis=1),
+        [0, len(data) - 1]])
+    return np.unique(idx)
+
+
+def _lttb(data, n_out):
+    """Indices chosen by the Largest-Triangle-Three-Buckets algorithm"""
+    n = len(data)
+    x = np.arange(n, dtype=float)
+    # The first and the last point are kept, the others are split into
+    # ``n_out - 2`` buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    edges_next = np.append(edges[2:], n)
+    ret = np.empty(n_out, dtype=int)
+    ret[0] = 0
+    ret[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        s, e = edges[i], edges[i+1]
+        # Average of the next bucket (the last point for the last bucket)
+        avg_x = x[e:edges_next[i]].mean()
+        avg_y = data[e:edges_next[i]].mean()
+        area = np.abs((x[a] - avg_x) * (data[s:e] - data[a]) -
+                      (x[a] - x[s:e]) * (avg_y - data[a]))
+        a = s + np.argmax(area)
+        ret[i+1] = a
+    return ret
+
+
+def decimate(data, n_out, method="minmax"):
+    """Select data points for plotting a long time series
+
+    Drawing more points than the axes have pixel columns only costs
+    rendering time. This selects about `n_out` points which look (nearly)
+    the same when plotted.
+
+    Parameters
+    ----------
+    data : numpy.ndarray, shape(n)
+        Data points in time series
+    n_out : int
+        Number of points to select. If ``len(data) <= n_out``, all points
+        are returned.
+    method : {"minmax", "lttb"}, optional
+        If "minmax" (default), split the data into ``n_out // 2`` bins and
+        keep the minimum and the maximum of each. With one bin per pixel
+        column, the plot is the same as that of all data points. If "lttb",
+        use the Largest-Triangle-Three-Buckets algorithm, which keeps
+        exactly `n_out` points preserving the visual shape, assuming equally
+        spaced data points.
+
+    Returns
+    -------
+    numpy.ndarray
+        Sorted indices of the selected data points
+    """
+    data = np.asarray(data, dtype=float)
+    if len(data) <= n_out:
+        return np.arange(len(data))
+    if method == "minmax":
+        return _minmax(data, n_out)
+    if method == "lttb":
+        return _lttb(data, max(n_out, 3))
+    raise ValueError(f"Unknown method \"{method}\".")
+
+
 def plot_changepoints(data, changepoints, time=None, style="shade",
                       segment_alpha=0.2, segment_colors=["#4286f4", "#f44174"],
-                      ax=None):
+                      ax=None, downsample=None, n_points=None):
     """Plot time series with changepoints
 
     Parameters
@@ -35,6 +112,12 @@ def plot_changepoints(data, changepoints, time=None, style="shade",
     ax : matplotlib.axes.Axes or None
         Axes object to plots on. If `None` (the default), get it by calling
         pyplot's ``gca()``.
+    downsample : {"minmax", "lttb"} or None, optional
+        If not `None`, plot only the data points selected by
+        :py:func:`decimate` using this method. Defaults to `None`.
+    n_points : int or None, optional
+        Number of data points to plot with `downsample`. If `None` (the
+        default), use two per pixel column of the axes.
 
     Returns
     -------
@@ -58,5 +141,16 @@ def plot_changepoints(data, changepoints, time=None, style="shade",
             t_c = time[c]
             ax.axvline(x=t_c, linestyle="--", color="k")
 
-    ax.plot(time, data)
+    if downsample is None:
+        ax.plot(time, data)
+        return ax
+
+    if n_points is None:
+        n_points = 2 * max(int(ax.bbox.width), 1)
+    data = np.asarray(data)
+    columns = data.reshape((len(data), -1)).T
+    time = np.asarray(time)
+    for d in columns:
+        idx = decimate(d, n_points, downsample)
+        ax.plot(time[idx], d[idx])
     return ax
@@ -4,16 +4,27 @@
 
 import unittest
 import os
+import subprocess
+import sys
+import tempfile
 import types
 
 import numpy as np
 import scipy
 import scipy.stats
 
+try:
+    import matplotlib.pyplot as plt
+    plt.switch_backend("Agg")
+    mpl_available = True
+except ImportError:
+    mpl_available = False
+
 from sdt.helper import numba
 from sdt.changepoint import bayes_offline as offline
 from sdt.changepoint import bayes_online as online
 from sdt.changepoint import pelt
+from sdt.changepoint import kernels
 
 
 path, f = os.path.split(os.path.abspath(__file__))
@@ -319,6 +330,85 @@ class TestOnlineStudentTNumba(TestOnlineStudentT):
         super().test_reset()
 
 
+class TestOnlineMultivariateT(unittest.TestCase):
+    likelihood = online.MultivariateT
+
+    def setUp(self):
+        self.rand_state = np.random.RandomState(0)
+        self.data = self.rand_state.normal(size=(5, 3))
+        self.psi = np.array([[2., 0.5, 0.], [0.5, 1., 0.2], [0., 0.2, 1.5]])
+        self.t = self.likelihood(np.zeros(3), 1.5, 4., self.psi)
+
+    def _psi(self):
+        return self.t._psi
+
+    def test_updatetheta(self):
+        """changepoint.bayes_online.MultivariateT.update_theta"""
+        x = self.data[0]
+        self.t.update_theta(x)
+        np.testing.assert_allclose(self.t._mu, [np.zeros(3), x / 2.5])
+        np.testing.assert_allclose(self.t._kappa, [1.5, 2.5])
+        np.testing.assert_allclose(self.t._nu, [4., 5.])
+        np.testing.assert_allclose(self._psi(),
+                                   [self.psi,
+                                    self.psi + 0.6 * np.outer(x, x)])
+
+    def test_pdf(self):
+        """changepoint.bayes_online.MultivariateT.pdf"""
+        for x in self.data[:3]:
+            self.t.update_theta(x)
+        r = self.t.pdf(self.data[3])
+        exp = [scipy.stats.multivariate_t.pdf(
+                   self.data[3], m, p * (k + 1) / (k * (n - 2)), n - 2)
+               for m, k, n, p in zip(self.t._mu, self.t._kappa, self.t._nu,
+                                     self._psi())]
+        np.testing.assert_allclose(r, exp)
+
+    def test_univariate(self):
+        """changepoint.bayes_online.MultivariateT: same as StudentT if d=1"""
+        t = online.StudentT(0.1, 0.01, 1., 0.)
+        self.t = self.likelihood(np.zeros(1))
+        for x in self.data[:, :1]:
+            t.update_theta(x[0])
+            self.t.update_theta(x)
+        np.testing.assert_allclose(self.t.pdf(np.array([0.3])), t.pdf(0.3))
+
+    def test_reset(self):
+        """changepoint.bayes_online.MultivariateT.reset"""
+        self.t.update_theta(self.data[0])
+        self.t.update_theta(self.data[1])
+        self.t.reset()
+
+        np.testing.assert_equal(self.t._mu, [np.zeros(3)])
+        np.testing.assert_equal(self.t._kappa, [1.5])
+        np.testing.assert_equal(self.t._nu, [4.])
+        np.testing.assert_allclose(self._psi(), [self.psi])
+
+
+@unittest.skipIf(not numba.numba_available, "Numba not available")
+class TestOnlineMultivariateTNumba(TestOnlineMultivariateT):
+    likelihood = online.MultivariateTNumba
+
+    def _psi(self):
+        return self.t._chol @ np.transpose(self.t._chol, (0, 2, 1))
+
+    def test_updatetheta(self):
+        """changepoint.bayes_online.MultivariateTNumba.update_theta"""
+        super().test_updatetheta()
+
+    def test_pdf(self):
+        """changepoint.bayes_online.MultivariateTNumba.pdf"""
+        super().test_pdf()
+
+    def test_univariate(self):
+        """changepoint.bayes_online.MultivariateTNumba: StudentT if d=1"""
+        super().test_univariate()
+
+    def test_reset(self):
+        """changepoint.bayes_online.MultivariateTNumba.reset"""
+        super().test_reset()
+
+
 class TestOnlineFinderPython(unittest.TestCase):
     def setUp(self):
         self.rand_state = np.random.RandomState(0)
@@ -435,6 +525,178 @@ class TestOnlineFinderNumba(TestOnlineFinderPython):
         """changepoint.BayesOnline.find_changepoints: returned prob. (numba)"""
         super().test_find_changepoints_prob()
 
+    def test_find_changepoints_update(self):
+        """changepoint.BayesOnline: update after find_changepoints (numba)"""
+        py_finder = online.BayesOnline("const", "student_t", self.h_params,
+                                       self.t_params, engine="python")
+        for f in (self.finder, py_finder):
+            f.find_changepoints(self.data[:50])
+            f.update(self.data[50])
+        np.testing.assert_allclose(self.finder.probabilities[-1],
+                                   py_finder.probabilities[-1])
+
+
+class TestOnlineFinderMultivariatePython(unittest.TestCase):
+    engine = "python"
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.data = np.concatenate([
+            rs.multivariate_normal([0, 1, 2], np.eye(3), 50),
+            rs.multivariate_normal([0, 5, 2], np.eye(3), 60),
+            rs.multivariate_normal([-4, 5, 2], np.eye(3), 40)])
+        self.t_params = {"mu": np.zeros(3), "kappa": 1., "nu": 4.,
+                         "psi": np.eye(3)}
+        self.finder = online.BayesOnline("const", "multivariate_t",
+                                         {"time_scale": 250}, self.t_params,
+                                         engine=self.engine)
+
+    def test_find_changepoints_prob_thresh(self):
+        """changepoint.BayesOnline.find_changepoints: multivariate"""
+        cp = self.finder.find_changepoints(self.data, past=10,
+                                           prob_threshold=0.2)
+        np.testing.assert_array_equal(cp, [50, 110])
+
+    def test_update(self):
+        """changepoint.BayesOnline.update: multivariate"""
+        self.finder.find_changepoints(self.data[:30])
+        exp = self.finder.probabilities
+        self.finder.reset()
+        for x in self.data[:30]:
+            self.finder.update(x)
+        for p, e in zip(self.finder.probabilities, exp):
+            np.testing.assert_allclose(p, e, atol=1e-14)
+
+
+@unittest.skipIf(not numba.numba_available, "Numba not available")
+class TestOnlineFinderMultivariateNumba(TestOnlineFinderMultivariatePython):
+    engine = "numba"
+
+    def test_find_changepoints_prob_thresh(self):
+        """changepoint.BayesOnline.find_changepoints: multivariate (numba)"""
+        super().test_find_changepoints_prob_thresh()
+
+    def test_update(self):
+        """changepoint.BayesOnline.update: multivariate (numba)"""
+        super().test_update()
+
+    def test_python(self):
+        """changepoint.BayesOnline: multivariate numba vs. python engine"""
+        prob = self.finder.find_changepoints(self.data)
+        py_finder = online.BayesOnline("const", "multivariate_t",
+                                       {"time_scale": 250}, self.t_params,
+                                       engine="python")
+        np.testing.assert_allclose(prob, py_finder.find_changepoints(
+            self.data), atol=1e-12)
+
+    def test_kernel(self):
+        """changepoint.kernels.bayes_online_segmentation_mv"""
+        prob, params = kernels.bayes_online_segmentation_mv(
+            self.data, 250., np.zeros(3), 1., 4., np.eye(3))
+        exp = online.segmentation_numba(self.data, self.finder.hazard,
+                                        self.finder.obs_likelihood)
+        np.testing.assert_allclose(prob, exp, atol=1e-14)
+        np.testing.assert_allclose(params[2], self.finder.obs_likelihood._nu)
+
+
+class TestOnlineBatchPython(unittest.TestCase):
+    engine = "python"
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.data = [np.concatenate([rs.normal(100, 10, 30),
+                                     rs.normal(30, 5, 40),
+                                     rs.normal(50, 20, 20)]),
+                     np.concatenate([rs.normal(10, 1, 25),
+                                     rs.normal(20, 2, 30)]),
+                     rs.normal(0, 1, 40)]
+        self.t_params = {"alpha": 0.1, "beta": 0.01, "kappa": 1, "mu": 0}
+        self.finder = online.BayesOnlineBatch(len(self.data), 90, 250,
+                                              self.t_params,
+                                              engine=self.engine)
+
+    def _single(self):
+        return online.BayesOnline("const", "student_t",
+                                  {"time_scale": 250}, self.t_params,
+                                  engine=self.engine)
+
+    def test_engine(self):
+        """changepoint.BayesOnlineBatch: set python engine"""
+        self.assertFalse(self.finder._use_numba)
+
+    def test_update(self):
+        """changepoint.BayesOnlineBatch.update"""
+        f = self._single()
+        for i in range(10):
+            self.finder.update([d[i] for d in self.data])
+            f.update(self.data[0][i])
+        np.testing.assert_array_equal(self.finder.n_seen, [10] * 3)
+        np.testing.assert_allclose(self.finder.probabilities[0, :11],
+                                   f.probabilities[-1])
+        np.testing.assert_array_equal(self.finder.probabilities[:, 11:], 0)
+
+    def test_update_mask(self):
+        """changepoint.BayesOnlineBatch.update: `mask` parameter"""
+        self.finder.update([d[0] for d in self.data])
+        prob = self.finder.probabilities.copy()
+        params = self.finder.params.copy()
+        self.finder.update([d[1] for d in self.data], [True, False, True])
+        np.testing.assert_array_equal(self.finder.n_seen, [2, 1, 2])
+        np.testing.assert_array_equal(self.finder.probabilities[1], prob[1])
+        np.testing.assert_array_equal(self.finder.params[:, 1],
+                                      params[:, 1])
+
+    def test_update_max_length(self):
+        """changepoint.BayesOnlineBatch.update: more than `max_length`"""
+        finder = online.BayesOnlineBatch(2, 1, engine=self.engine)
+        finder.update([1., 2.])
+        with self.assertRaises(ValueError):
+            finder.update([1., 2.])
+
+    def test_reset(self):
+        """changepoint.BayesOnlineBatch.reset"""
+        self.finder.update([d[0] for d in self.data])
+        self.finder.reset()
+        np.testing.assert_array_equal(self.finder.n_seen, 0)
+        np.testing.assert_array_equal(self.finder.probabilities[:, 0], 1)
+        np.testing.assert_array_equal(self.finder.probabilities[:, 1:], 0)
+
+    def test_find_changepoints_prob(self):
+        """changepoint.BayesOnlineBatch.find_changepoints: probabilities"""
+        res = self.finder.find_changepoints(self.data, past=5)
+        self.assertEqual(len(res), len(self.data))
+        for d, r in zip(self.data, res):
+            np.testing.assert_allclose(
+                r, self._single().find_changepoints(d, past=5), atol=1e-12)
+
+    def test_find_changepoints_prob_thresh(self):
+        """changepoint.BayesOnlineBatch.find_changepoints: `prob_threshold`"""
+        res = self.finder.find_changepoints(self.data, prob_threshold=0.2)
+        for d, r in zip(self.data, res):
+            np.testing.assert_array_equal(
+                r, self._single().find_changepoints(d, prob_threshold=0.2))
+        np.testing.assert_array_equal(res[0], [30, 70])
+
+
+@unittest.skipIf(not numba.numba_available, "Numba not available")
+class TestOnlineBatchNumba(TestOnlineBatchPython):
+    engine = "numba"
+
+    def test_engine(self):
+        """changepoint.BayesOnlineBatch: set numba engine"""
+        self.assertTrue(self.finder._use_numba)
+
+    def test_kernel(self):
+        """changepoint.kernels.bayes_online_batch_step"""
+        for d in self.data:
+            exp, _ = kernels.bayes_online_segmentation(d, 250, 0.1, 0.01, 1.,
+                                                       0.)
+            finder = online.BayesOnlineBatch(1, len(d), engine="numba")
+            for i, x in enumerate(d):
+                finder.update([x])
+                np.testing.assert_array_equal(
+                    finder.probabilities[0, :i+2], exp[i+1, :i+2])
+
 
 class TestPeltCosts(unittest.TestCase):
     def setUp(self):
@@ -582,5 +844,150 @@ class TestPeltNumba(TestPelt):
         super().test_find_changepoints()
 
 
+@unittest.skipIf(not numba.numba_available, "Numba not available")
+class TestKernels(unittest.TestCase):
+    def setUp(self):
+        self.rand_state = np.random.RandomState(0)
+        self.data = np.concatenate([self.rand_state.normal(100, 10, 30),
+                                    self.rand_state.normal(30, 5, 40),
+                                    self.rand_state.normal(50, 20, 20)])
+
+    def test_bayes_online_segmentation(self):
+        """changepoint.kernels.bayes_online_segmentation"""
+        t_params = (0.1, 0.01, 1., 0.)
+        prob, params = kernels.bayes_online_segmentation(self.data, 250.,
+                                                         *t_params)
+        hazard = online.ConstHazardNumba(250.)
+        obs = online.StudentTNumba(*t_params)
+        exp = online.segmentation_numba(self.data, hazard, obs)
+        np.testing.assert_allclose(prob, exp)
+        np.testing.assert_allclose(
+            params, [obs._alpha, obs._beta, obs._kappa, obs._mu])
+
+    def test_pelt_segmentation(self):
+        """changepoint.kernels.pelt_segmentation"""
+        data = self.data.reshape((-1, 1))
+        for code, cost in ((kernels.COST_L1, pelt.CostL1()),
+                           (kernels.COST_L2, pelt.CostL2())):
+            for penalty in (1e3, 5e3):
+                cost.set_data(data)
+                exp = pelt.segmentation(cost, 2, 1, penalty, 10)
+                cp = kernels.pelt_segmentation(data, code, 2, 1, penalty, 10)
+                np.testing.assert_equal(cp, exp)
+
+    def test_pelt_init(self):
+        """changepoint.Pelt: use kernel for builtin costs"""
+        self.assertEqual(pelt.Pelt("l1")._kernel_cost, kernels.COST_L1)
+        self.assertEqual(pelt.Pelt("l2")._kernel_cost, kernels.COST_L2)
+        self.assertIsNone(pelt.Pelt("l2", engine="python")._kernel_cost)
+
+    def test_warmup(self):
+        """changepoint.kernels.warmup: compiled code is loaded from cache"""
+        code = ("from sdt.changepoint import kernels\n"
+                "kernels.warmup()\n"
+                "print(sum(sum(f.stats.cache_hits.values()) for f in\n"
+                "          (kernels.bayes_online_segmentation,\n"
+                "           kernels.pelt_segmentation)))")
+        with tempfile.TemporaryDirectory() as d:
+            env = dict(os.environ, NUMBA_CACHE_DIR=d)
+            hits = []
+            for i in range(2):
+                out = subprocess.run([sys.executable, "-c", code],
+                                     cwd=os.path.dirname(path), env=env,
+                                     capture_output=True, text=True,
+                                     check=True)
+                hits.append(int(out.stdout))
+        self.assertEqual(hits[0], 0)
+        self.assertGreater(hits[1], 0)
+
+
+class TestLazyImport(unittest.TestCase):
+    def _run(self, code):
+        out = subprocess.run([sys.executable, "-c", code],
+                             cwd=os.path.dirname(path), capture_output=True,
+                             text=True, check=True)
+        return out.stdout.split()
+
+    def test_import(self):
+        """changepoint: importing the package does not load submodules"""
+        code = ("import sys, time\n"
+                "t = time.perf_counter()\n"
+                "import sdt.changepoint\n"
+                "print(time.perf_counter() - t)\n"
+                "print(sorted(m for m in sys.modules\n"
+                "             if m.startswith('sdt.changepoint.')))\n"
+                "print('numba' in sys.modules, 'scipy' in sys.modules)")
+        elapsed, mods, has_numba, has_scipy = self._run(code)
+        self.assertEqual(mods, "[]")
+        self.assertEqual(has_numba, "False")
+        self.assertEqual(has_scipy, "False")
+        # Only the package itself is imported, this should be very fast.
+        self.assertLess(float(elapsed), 0.5)
+
+    def test_getattr(self):
+        """changepoint: accessing a name imports only its submodule"""
+        code = ("import sys\n"
+                "from sdt.changepoint import BayesOnline\n"
+                "print(','.join(sorted(m for m in sys.modules\n"
+                "                      if m.startswith('sdt.changepoint.'))))")
+        mods, = self._run(code)
+        self.assertEqual(mods, "sdt.changepoint.bayes_online,"
+                               "sdt.changepoint.kernels")
+
+class TestDecimate(unittest.TestCase):
+    def setUp(self):
+        self.data = np.cumsum(np.random.RandomState(0).normal(size=10007))
+
+    def test_minmax(self):
+        """changepoint.decimate: "minmax" method"""
+        from sdt.changepoint import plot
+        idx = plot.decimate(self.data, 200)
+        np.testing.assert_array_equal(idx, np.unique(idx))
+        self.assertLessEqual(len(idx), 202)
+        self.assertEqual(idx[0], 0)
+        self.assertEqual(idx[-1], len(self.data) - 1)
+        # Extrema of every bin are kept
+        size = -(-len(self.data) // 100)
+        for s in range(0, len(self.data), size):
+            b = self.data[s:s+size]
+            self.assertIn(s + np.argmin(b), idx)
+            self.assertIn(s + np.argmax(b), idx)
+
+    def test_lttb(self):
+        """changepoint.decimate: "lttb" method"""
+        from sdt.changepoint import plot
+        idx = plot.decimate(self.data, 200, "lttb")
+        self.assertEqual(len(idx), 200)
+        self.assertTrue(np.all(np.diff(idx) > 0))
+        self.assertEqual(idx[0], 0)
+        self.assertEqual(idx[-1], len(self.data) - 1)
+        # A spike is kept
+        data = np.zeros(1000)
+        data[517] = 10.
+        self.assertIn(517, plot.decimate(data, 20, "lttb"))
+
+    def test_short(self):
+        """changepoint.decimate: fewer data points than requested"""
+        from sdt.changepoint import plot
+        for m in ("minmax", "lttb"):
+            np.testing.assert_array_equal(plot.decimate(np.ones(5), 10, m),
+                                          np.arange(5))
+        with self.assertRaises(ValueError):
+            plot.decimate(self.data, 10, "nonsense")
+
+    @unittest.skipUnless(mpl_available, "matplotlib not available")
+    def test_plot_changepoints(self):
+        """changepoint.plot_changepoints: `downsample` parameter"""
+        from sdt.changepoint import plot
+        fig, ax = plt.subplots(1, 1)
+        plot.plot_changepoints(self.data, [1000, 5000], ax=ax,
+                               downsample="minmax", n_points=300)
+        line = ax.get_lines()[0]
+        idx = plot.decimate(self.data, 300)
+        np.testing.assert_array_equal(line.get_xdata(), idx)
+        np.testing.assert_array_equal(line.get_ydata(), self.data[idx])
+        plt.close(fig)
+
+
 if __name__ == "__main__":
     unittest.main()
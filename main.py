@@ -1,66 +1,122 @@
 import argparse
+import importlib
+import multiprocessing
 import os
 import warnings
-import torch
 import time
 import random
 
-from models.online import train_online
-from models.agem import train_agem
-from models.agem_r import train_agem_r
-from models.si import train_si
-from models.gem import train_gem
-from models.dark_exp_replay import train_dark_er
-from models.exp_replay import train_er
-from models.ewc import train_ewc
-from models.derpp import train_derpp
-
-from numba.core.errors import NumbaDeprecationWarning, NumbaPendingDeprecationWarning
-from utils.backbone import ClassficationMLP, SimpleCNN
-from utils.utils import read_csv, split_data, split_with_indicators, eval_bayesian, check_changepoints, timeperiod
-from torchsummary import summary
-
-import numpy as np
-import torch.nn as nn
-import detection.sdt.changepoint as detection
-
-warnings.simplefilter('ignore', category=NumbaDeprecationWarning)
-warnings.simplefilter('ignore', category=NumbaPendingDeprecationWarning)
 os.environ["KMP_DUPLICATE_LIB_OK"] = 'True'
 
+# CL methods, the module of a method is imported only when it is selected with --model
+STRATEGIES = {
+    'online': 'models.online:train_online',
+    'er': 'models.exp_replay:train_er',
+    'der': 'models.dark_exp_replay:train_dark_er',
+    'derpp': 'models.derpp:train_derpp',
+    'ewc': 'models.ewc:train_ewc',
+    'si': 'models.si:train_si',
+    'gem': 'models.gem:train_gem',
+    'agem': 'models.agem:train_agem',
+    'agem_r': 'models.agem_r:train_agem_r',
+}
 
-def parse_args():
+# Replay strategies whose state is the model, the optimizer and the buffer
+SNAPSHOT_STRATEGIES = ['er', 'der', 'derpp', 'agem_r']
+
+
+def load_strategy(name):
+    module, function = STRATEGIES[name].split(':')
+    return getattr(importlib.import_module(module), function)
+
+
+def parse_args(argv=None):
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--batch_size', type=int, default=64,
                         help="Batch size")
     parser.add_argument('--epochs', type=int, default=300,
-                        help="Number of train epochs")
+                        help="Number of train epochs per domain (maximum with --patience)")
     parser.add_argument('--lr', type=float, default=0.0001,
                         help="Learning rate")
     parser.add_argument('--dataset', type=str, help="CSV file")
+    parser.add_argument('--datasets', type=str, default=None,
+                        help="Comma separated CSV files or patterns of dataset/ (e.g. '*-daily.csv') trained together, "
+                             "one model per asset (online and er only). Replaces --dataset")
     parser.add_argument('--processing', default='none', choices=['none', 'difference', 'indicators'],
                         help="Type of pre-processing")
+    parser.add_argument('--horizons', type=str, default=None,
+                        help="Comma separated label horizons (steps after the window) learnt together by one head "
+                             "each, with --processing indicators (default: one horizon of the window length)")
+    parser.add_argument('--detect_on', default='price', choices=['price', 'indicators'],
+                        help="Series of the changepoint detection of datasets missing in chp_list.txt: the price, or "
+                             "jointly the seven standardized features of --processing indicators")
     parser.add_argument('--split', action='store_true',
                         help="Show tasks split")
+    parser.add_argument('--split_dir', type=str, default=None,
+                        help="Save the tasks split figure of every dataset to DIR/<dataset>_split.png instead of "
+                             "showing it (no display needed)")
     parser.add_argument('--suffix', type=str, default="default",
                         help="Suffix name")
     parser.add_argument('--evaluate', action='store_true',
                         help="Test current and previous tasks each epoch")
+    parser.add_argument('--results', type=str, default="results.h5",
+                        help="HDF5 results store shared by all the runs")
     parser.add_argument('--seed',type=int,default=230,
                         help='Seed')
+    parser.add_argument('--domains', type=int, default=None,
+                        help="Train on the first N domains only")
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help="Save the training state after every domain, and resume from it if it exists")
+    parser.add_argument('--snapshot', type=str, default=None,
+                        help="Save model, optimizer and replay buffer to this directory after every domain "
+                             "(er, der, derpp, agem_r)")
+    parser.add_argument('--warm_start', type=str, default=None,
+                        help="Start from a --snapshot directory and train the domains after its last one only")
+    parser.add_argument('--n_seeds', type=int, default=1,
+                        help="Train seeds seed, seed+1, ... as one vectorized ensemble (online and er only)")
+    parser.add_argument('--export', type=str, default=None,
+                        help="Save the trained backbone as TorchScript for serve.py")
+    parser.add_argument('--profile', type=str, default=None,
+                        help="Time the phases of the run, write PROFILE.json and the Chrome trace PROFILE.trace.json")
+    parser.add_argument('--torch_profile', type=str, default=None,
+                        help="FIRST:LAST epochs (counted over all the domains) run under torch.profiler, with "
+                             "--profile, written to PROFILE.torch.json")
+
+    # Adaptive epoch budget
+    parser.add_argument('--patience', type=int, default=0,
+                        help="Stop a domain after this many epochs without improvement (0: always train --epochs)")
+    parser.add_argument('--min_epochs', type=int, default=1,
+                        help="Minimum number of epochs per domain with --patience")
+    parser.add_argument('--min_delta', type=float, default=1e-3,
+                        help="Minimum decrease of the train loss (or validation error) counted as improvement")
+    parser.add_argument('--val_fraction', type=float, default=0.,
+                        help="Hold out the last fraction of each domain and watch its error instead of the train loss")
 
     # Network arguments
     parser.add_argument('--cnn', action='store_true',
                         help="Convolutional Network")
+    parser.add_argument('--bf16', action='store_true',
+                        help="Run the forward passes under bfloat16 autocast, weights and optimizer stay float32")
+    parser.add_argument('--channels_last', action='store_true',
+                        help="Run the convolutions of the CNN on channels last tensors")
     parser.add_argument('--dropout', type=float, default=0.5,
                         help="Probability for dropout in MLP")
     parser.add_argument('--l1_lambda', type=float, default=0.01,
                         help="Regularization param in L1 Norm (used in CNN only)")
+    parser.add_argument('--group_lambda', type=float, default=0.,
+                        help="Group lasso param on the conv output channels (used in CNN only)")
     # Methods
     parser.add_argument('--model', default='online',
-                        choices=['online', 'er', 'der', 'derpp', 'ewc', 'si', 'gem', 'agem', 'agem_r'],
+                        choices=list(STRATEGIES),
                         help="CL method")
+    parser.add_argument('--models', type=str, default=None,
+                        help="Comma separated CL methods (or all) trained from the same data and initial weights, "
+                             "followed by a comparison table. Replaces --model")
+    parser.add_argument('--ddp', type=int, default=1,
+                        help="Data parallel training of the backbone on N local processes (gloo)")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="CL methods of --models trained at the same time by forked processes")
     # Regularization arguments
     parser.add_argument('--gamma', type=float, default=0.7,
                         help="gamma value for EWC")
@@ -73,24 +129,93 @@ def parse_args():
     # Replay arguments
     parser.add_argument('--buffer_size', type=int, default=500,
                         help="Size of the buffer for replay methods")
+    parser.add_argument('--buffer_storage', type=str, default='float32',
+                        choices=['float32', 'float16', 'bfloat16', 'int8'],
+                        help="Storage dtype of the replay buffer examples (int8 uses per-channel scales)")
     parser.add_argument('--alpha', type=float, default=0.5,
                         help="penalty weight for DER")
     parser.add_argument('--beta', type=float, default=0.5,
                         help="penalty weight for DER++")
     parser.add_argument('--gem_gamma', type=float, default=0.25,
                         help="gamma value for GEM")
-
-    args = vars(parser.parse_args())
+    parser.add_argument('--agem_refresh', type=int, default=1,
+                        help="Steps between two refreshes of the A-GEM reference gradient (0: once per epoch)")
+    parser.add_argument('--agem_ref_size', type=int, default=None,
+                        help="Memories used for the A-GEM reference gradient (default: batch size)")
+
+    args = vars(parser.parse_args(argv))
+    if args['n_seeds'] > 1 and args['model'] not in ['online', 'er']:
+        parser.error("--n_seeds is only supported with --model online or er")
+    if args['checkpoint'] is not None and (args['model'] == 'online' or args['n_seeds'] > 1):
+        parser.error("--checkpoint is not supported with --model online or --n_seeds")
+    if args['channels_last'] and (not args['cnn'] or args['n_seeds'] > 1 or args['datasets'] is not None):
+        # The vectorized ensembles of --n_seeds and --datasets can't change the memory format under vmap
+        parser.error("--channels_last needs --cnn, without --n_seeds or --datasets")
+    if args['snapshot'] is not None or args['warm_start'] is not None:
+        if args['model'] not in SNAPSHOT_STRATEGIES:
+            parser.error("--snapshot and --warm_start are only supported with --model "
+                         + ", ".join(SNAPSHOT_STRATEGIES))
+        if args['n_seeds'] > 1 or args['models'] is not None or args['datasets'] is not None:
+            parser.error("--snapshot and --warm_start are not supported with --n_seeds, --models or --datasets")
+    if args['warm_start'] is not None and args['checkpoint'] is not None:
+        parser.error("--warm_start is not supported with --checkpoint")
+    if args['export'] is not None and (args['models'] is not None or args['datasets'] is not None
+                                       or args['n_seeds'] > 1):
+        parser.error("--export needs a single model (no --models, --datasets or --n_seeds)")
+    if args['export'] is not None and args['processing'] != 'indicators':
+        parser.error("--export is only supported with --processing indicators")
+    if args['horizons'] is not None:
+        try:
+            args['horizons'] = [int(h) for h in args['horizons'].split(',')]
+        except ValueError:
+            parser.error("--horizons must be comma separated integers")
+        if min(args['horizons']) < 1:
+            parser.error("--horizons must be positive")
+        if args['processing'] != 'indicators':
+            parser.error("--horizons is only supported with --processing indicators")
+        if args['n_seeds'] > 1 or args['datasets'] is not None or args['export'] is not None:
+            parser.error("--horizons is not supported with --n_seeds, --datasets or --export")
+    if args['datasets'] is not None:
+        if args['model'] not in ['online', 'er']:
+            parser.error("--datasets is only supported with --model online or er")
+        if args['n_seeds'] > 1 or args['checkpoint'] is not None or args['models'] is not None:
+            parser.error("--datasets is not supported with --n_seeds, --checkpoint or --models")
+    if args['models'] is not None:
+        args['models'] = list(STRATEGIES) if args['models'] == 'all' else args['models'].split(',')
+        unknown = set(args['models']) - set(STRATEGIES)
+        if unknown:
+            parser.error(f"unknown --models: {', '.join(sorted(unknown))}")
+        if args['n_seeds'] > 1 or args['checkpoint'] is not None:
+            parser.error("--models is not supported with --n_seeds or --checkpoint")
+    if args['ddp'] > 1 and (args['n_seeds'] > 1 or args['datasets'] is not None or args['models'] is not None
+                            or args['profile'] is not None):
+        parser.error("--ddp is not supported with --n_seeds, --datasets, --models or --profile")
+    if args['jobs'] > 1:
+        if args['models'] is None:
+            parser.error("--jobs needs --models")
+        if args['profile'] is not None:
+            parser.error("--jobs is not supported with --profile")
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            parser.error("--jobs needs the fork start method")
+    if args['torch_profile'] is not None:
+        if args['profile'] is None:
+            parser.error("--torch_profile needs --profile")
+        try:
+            first, last = (int(epoch) for epoch in args['torch_profile'].split(':'))
+        except ValueError:
+            parser.error("--torch_profile must be FIRST:LAST")
+        if not 0 <= first <= last:
+            parser.error("--torch_profile needs 0 <= FIRST <= LAST")
+        args['torch_profile'] = (first, last)
     return args
 
 
-def main(config):
-    start = time.time()
-
-    random.seed(config['seed'])
-    np.random.seed(config['seed'])
-    torch.manual_seed(config['seed'])
-    torch.cuda.manual_seed_all(config['seed'])
+def load_data(config):
+    # Read the time series, find the changepoints and split them in train/test domains
+    import numpy as np
+    from utils.profiler import profiler
+    from utils.utils import read_csv, split_data, split_with_indicators, eval_bayesian, check_changepoints, \
+        timeperiod, detect_changepoints
 
     # Read raw time series
     raw_data = read_csv(config["dataset"])
@@ -98,101 +223,309 @@ def main(config):
     # Check if chekpoints are already stored
     saved, chps = check_changepoints(config["dataset"])
 
+    # Type of dataset (yearly,quarterly...)
+    n_step = timeperiod(config['dataset'])
+
     # Online changepoint
     if not saved:
-        det = detection.BayesOnline()
+        from numba.core.errors import NumbaDeprecationWarning, NumbaPendingDeprecationWarning
+        warnings.simplefilter('ignore', category=NumbaDeprecationWarning)
+        warnings.simplefilter('ignore', category=NumbaPendingDeprecationWarning)
+
         # past and threshold heavily depend on data
-        chp_online = det.find_changepoints(raw_data, past=50, prob_threshold=0.2)
+        with profiler.phase('changepoints'):
+            # Domains of the features need room for the train and test windows and their horizons
+            min_size = 2 * (n_step + max(config.get('horizons') or [n_step]))
+            chp_online = detect_changepoints(raw_data, config['detect_on'] == 'indicators', past=50,
+                                             prob_threshold=0.2, min_size=min_size)
         chps = chp_online[1:]
 
     # Evaluation bayesian analysis
-    if config['split']:
+    if config['split_dir'] is not None:
+        os.makedirs(config['split_dir'], exist_ok=True)
+        eval_bayesian(chps, raw_data, os.path.join(config['split_dir'],
+                                                   f"{os.path.splitext(config['dataset'])[0]}_split.png"))
+    elif config['split']:
         eval_bayesian(chps, raw_data)
 
-    # Type of dataset (yearly,quarterly...)
-    n_step = timeperiod(config['dataset'])
-
     # Split in N train/test set (data + features)
-    if config['processing'] == 'indicators':
-        train_data, test_data = split_with_indicators(config, raw_data, chps, n_step)
-    elif config['processing'] == 'difference':
-        raw_data = np.diff(raw_data, axis=0)
-        train_data, test_data = split_data(config, raw_data, chps, n_step)
+    with profiler.phase('windowing'):
+        if config['processing'] == 'indicators':
+            train_data, test_data = split_with_indicators(config, raw_data, chps, n_step)
+        elif config['processing'] == 'difference':
+            raw_data = np.diff(raw_data, axis=0)
+            train_data, test_data = split_data(config, raw_data, chps, n_step)
+        else:
+            raw_data = np.array(raw_data).reshape(-1, 1)
+            train_data, test_data = split_data(config, raw_data, chps, n_step)
+
+    input_size = train_data[0][0][0].size()[0]
+    # Number of input series, the MLP inputs are the flattened (channels, n_step) windows
+    config['channels'] = input_size if config['cnn'] else input_size // n_step
+    return train_data, test_data
+
+
+def report_horizons(model, test_data, device, config, results):
+    # Final accuracy of every horizon of a multi-horizon run on every domain
+    from utils.evaluation import evaluate_horizons
+    accs = evaluate_horizons(model, test_data, device)
+    print("\nDomain | " + " | ".join(f"h={h}" for h in config['horizons']))
+    for domain, domain_accs in enumerate(accs):
+        print(f"{domain} | " + " | ".join(f"{acc:.2f}" for acc in domain_accs))
+    print("Mean | " + " | ".join(f"{acc:.2f}" for acc in accs.mean(axis=0)))
+    results.log_horizons(accs, config['horizons'])
+
+
+def load_asset(config):
+    # load_data in a worker process: the domains are returned as numpy arrays, cheaper to send back than tensors
+    train_data, test_data = load_data(config)
+    domains = [[[(x.numpy(), y.numpy()) for x, y in domain] for domain in data] for data in (train_data, test_data)]
+    return domains, config['channels']
+
+
+def load_assets(config):
+    # Changepoints and domains of every dataset of --datasets, computed by parallel processes
+    import glob
+    from concurrent.futures import ProcessPoolExecutor
+    import torch
+    from utils.utils import timeperiod
+
+    names = []
+    for pattern in config['datasets'].split(','):
+        matches = sorted(os.path.basename(f) for f in glob.glob(os.path.join('dataset', pattern)))
+        if not matches:
+            raise SystemExit(f"No dataset matches {pattern}")
+        names += [name for name in matches if name not in names]
+    if len({timeperiod(name) for name in names}) > 1:
+        raise SystemExit("--datasets must have the same sampling (daily or monthly), their windows differ")
+
+    with ProcessPoolExecutor(min(len(names), os.cpu_count()),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        loaded = list(pool.map(load_asset, [dict(config, dataset=name) for name in names]))
+    config['channels'] = loaded[0][1]
+    train_sets, test_sets = zip(*[[[[(torch.from_numpy(x), torch.from_numpy(y)) for x, y in domain]
+                                    for domain in data] for data in domains] for domains, _ in loaded])
+    return names, list(train_sets), list(test_sets)
+
+
+def build_model(config, input_size, device):
+    import torch
+    from utils.backbone import ClassficationMLP, SimpleCNN, enable_bf16
+    from utils.regularization import ProxSGD, prox_param_groups
+
+    # One head per horizon
+    n_heads = len(config['horizons']) if config.get('horizons') else 1
+    if config["cnn"]:
+        model = SimpleCNN(input_size=input_size, n_heads=n_heads, channels_last=config['channels_last'])
+    else:
+        model = ClassficationMLP(input_size=input_size, dropout=config['dropout'], n_heads=n_heads)
+    if config['bf16']:
+        enable_bf16(model)
+    if config['ddp'] > 1:
+        from utils.distributed import distribute
+        distribute(model)
+
+    if config['cnn']:
+        # L1 and channel group lasso applied as proximal steps of the optimizer
+        optimizer = ProxSGD(prox_param_groups(model, config['l1_lambda'], config['group_lambda']), lr=config["lr"],
+                            momentum=0.7)
     else:
-        raw_data = np.array(raw_data).reshape(-1, 1)
-        train_data, test_data = split_data(config, raw_data, chps, n_step)
+        optimizer = torch.optim.SGD(model.parameters(), lr=config["lr"], momentum=0.7)
+    return model.to(device), optimizer
+
+
+# Data, initial weights and RNG state of a --models run, shared with the forked workers of --jobs
+_shared = {}
+
+
+def train_strategy(name):
+    # Train the CL method `name` from the shared initial weights and RNG state, returns its metrics and time
+    import numpy as np
+    import torch
+    import torch.nn as nn
+    from utils.profiler import profiler
+    from utils.results import ResultsStore
+
+    start = time.time()
+    config = dict(_shared['config'], model=name)
+    train_data, test_data, device = _shared['train_data'], _shared['test_data'], _shared['device']
+    model, optimizer = build_model(config, train_data[0][0][0].size()[0], device)
+    model.load_state_dict(_shared['scratch'])
+    python_state, numpy_state, torch_state, cuda_state = _shared['rng']
+    random.setstate(python_state)
+    np.random.set_state(numpy_state)
+    torch.set_rng_state(torch_state)
+    if cuda_state is not None:
+        torch.cuda.set_rng_state_all(cuda_state)
+
+    results = ResultsStore(config['results']).new_run(config)
+    if config['profile'] is not None:
+        profiler.watch(model)
+    print(f"===== {name} =====")
+    train = load_strategy(name)
+    metrics = train(train_set=train_data, test_set=test_data, model=model, loss=nn.CrossEntropyLoss(),
+                    optimizer=optimizer, device=device, config=config, suffix=config['suffix'], results=results)
+    if config['horizons'] is not None and len(config['horizons']) > 1:
+        report_horizons(model, test_data, device, config, results)
+    results.log_timing('total', time.time() - start)
+    results.close()
+    return metrics, time.time() - start
+
+
+def print_comparison(outcomes):
+    print("\nModel | Acc | Backward | Forward | Forgetting | Time (s)")
+    for name, (metrics, seconds) in outcomes.items():
+        # online has no transfer metrics
+        values = ' | '.join('-' if metrics is None else f"{metrics[k]:.2f}"
+                            for k in ('acc', 'backward', 'forward', 'forgetting'))
+        print(f"{name} | {values} | {seconds:.1f}")
+
+
+def main(config):
+    start = time.time()
+
+    # Heavy imports (torch, pandas, numba through the changepoint detection) happen
+    # after the arguments are parsed, so -h and argument errors return immediately
+    import numpy as np
+    import torch
+    import torch.nn as nn
+    from utils.results import ResultsStore
+    from utils.regularization import sparsity
+    from utils.profiler import profiler
+
+    random.seed(config['seed'])
+    np.random.seed(config['seed'])
+    torch.manual_seed(config['seed'])
+    torch.cuda.manual_seed_all(config['seed'])
+
+    from utils.distributed import is_main
+    # Only rank 0 of a --ddp run writes the results
+    store = ResultsStore(config['results'] if is_main() else None)
+    if config['profile'] is not None:
+        profiler.enable(trace=True, torch_epochs=config['torch_profile'])
+
+    with profiler.phase('load_data'):
+        if config['datasets'] is not None:
+            names, train_sets, test_sets = load_assets(config)
+            train_data, test_data = train_sets[0], test_sets[0]
+        else:
+            train_data, test_data = load_data(config)
 
     # Cuda
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    device = torch.device('cuda' if torch.cuda.is_available() and config['ddp'] == 1 else 'cpu')
     print(f"Device: {device}")
-    print(torch.cuda.get_device_name(0))
+    if device.type == 'cuda':
+        print(torch.cuda.get_device_name(0))
 
     # Setup the backbone
     input_size = train_data[0][0][0].size()[0]
-    if config["cnn"]:
-        model = SimpleCNN(input_size=input_size)
-    else:
-        model = ClassficationMLP(input_size=input_size, dropout=config['dropout'])
-
-    optimizer = torch.optim.SGD(model.parameters(), lr=config["lr"], momentum=0.7)
-    model = model.to(device)
+    if config['datasets'] is not None:
+        models = []
+        for name in names:
+            # Same initial weights as the single asset run
+            torch.manual_seed(config['seed'])
+            models.append(build_model(config, input_size, torch.device('cpu'))[0])
+        runs = [store.new_run(dict(config, dataset=name)) for name in names]
+        from models.multi_asset import train_multi_asset
+        with profiler.phase('train'):
+            train_multi_asset(train_sets=train_sets, test_sets=test_sets, models=models, loss=nn.CrossEntropyLoss(),
+                              device=device, config=config, names=names, results=runs)
+        if config['profile'] is not None:
+            profiler.save(config['profile'])
+        end = time.time()
+        for run in runs:
+            run.log_timing('total', end - start)
+            run.close()
+        print("\nTime elapsed: ", end - start, "s")
+        return
+
+    if config['n_seeds'] > 1:
+        models = []
+        for k in range(config['n_seeds']):
+            torch.manual_seed(config['seed'] + k)
+            models.append(build_model(config, input_size, torch.device('cpu'))[0])
+        runs = [store.new_run(config, seed=config['seed'] + k) for k in range(config['n_seeds'])]
+        from models.ensemble import train_ensemble
+        with profiler.phase('train'):
+            train_ensemble(train_set=train_data, test_set=test_data, models=models, loss=nn.CrossEntropyLoss(),
+                           device=device, config=config, suffix=config['suffix'], results=runs)
+        if config['profile'] is not None:
+            profiler.save(config['profile'])
+        end = time.time()
+        for run in runs:
+            run.log_timing('total', end - start)
+            run.close()
+        print("\nTime elapsed: ", end - start, "s")
+        return
+
+    model, optimizer = build_model(config, input_size, device)
     loss = nn.CrossEntropyLoss()
-    torch.save({'model_state_dict': model.state_dict(),
-                'optimizer_state_dict': optimizer.state_dict(),
-                }, 'checkpoints/model_scratch.pt')
+    if config['models'] is None and is_main():
+        torch.save({'model_state_dict': model.state_dict(),
+                    'optimizer_state_dict': optimizer.state_dict(),
+                    }, 'checkpoints/model_scratch.pt')
 
     # print(model)
+    from torchsummary import summary
     summary(model, train_data[0][0][0].size())
 
-    # Online training
-    if config["model"] == 'online':
-        train_online(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                     optimizer=optimizer, config=config, device=device, suffix=config['suffix'])
-
-    # Continual learning with ER
-    if config["model"] == 'er':
-        train_er(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                 optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with Dark ER
-    if config["model"] == 'der':
-        train_dark_er(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                      optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with Dark ER++
-    if config["model"] == 'derpp':
-        train_derpp(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                    optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with EWC
-    if config["model"] == 'ewc':
-        train_ewc(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                  optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with SI
-    if config["model"] == 'si':
-        train_si(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                 optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with GEM
-    if config["model"] == 'gem':
-        train_gem(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                  optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with A-GEM
-    if config["model"] == 'agem':
-        train_agem(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                   optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
-
-    # Continual learning with A-GEM with Reservoir
-    if config["model"] == 'agem_r':
-        train_agem_r(train_set=train_data, test_set=test_data, model=model, loss=loss,
-                     optimizer=optimizer, device=device, config=config, suffix=config['suffix'])
+    if config['models'] is not None:
+        # Every method starts from the same weights and RNG state, as if it was the only one of the run
+        _shared.update(config=config, train_data=train_data, test_data=test_data, device=device,
+                       scratch={k: v.clone() for k, v in model.state_dict().items()},
+                       rng=(random.getstate(), np.random.get_state(), torch.get_rng_state(),
+                            torch.cuda.get_rng_state_all() if device.type == 'cuda' else None))
+        if config['jobs'] > 1:
+            if device.type == 'cuda':
+                raise SystemExit("--jobs is only supported on the CPU (CUDA cannot be used after a fork)")
+            from concurrent.futures import ProcessPoolExecutor
+            threads = max(1, torch.get_num_threads() // config['jobs'])
+            with ProcessPoolExecutor(config['jobs'], mp_context=multiprocessing.get_context('fork'),
+                                     initializer=torch.set_num_threads, initargs=(threads,)) as pool:
+                outcomes = dict(zip(config['models'], pool.map(train_strategy, config['models'])))
+        else:
+            with profiler.phase('train'):
+                outcomes = {name: train_strategy(name) for name in config['models']}
+        print_comparison(outcomes)
+        if config['profile'] is not None:
+            profiler.save(config['profile'])
+        print("\nTime elapsed: ", time.time() - start, "s")
+        return
+
+    results = store.new_run(config)
+    if config['profile'] is not None:
+        profiler.watch(model)
+
+    # Train with the selected CL method
+    train = load_strategy(config['model'])
+    with profiler.phase('train'):
+        train(train_set=train_data, test_set=test_data, model=model, loss=loss,
+              optimizer=optimizer, device=device, config=config, suffix=config['suffix'], results=results)
+    if config['profile'] is not None:
+        profiler.save(config['profile'])
+    if config['horizons'] is not None and len(config['horizons']) > 1:
+        report_horizons(model, test_data, device, config, results)
+
+    if config['export'] is not None and is_main():
+        from utils.inference import export_model
+        from utils.utils import timeperiod
+        export_model(model, config['export'], config, timeperiod(config['dataset']))
+        print(f"Exported {config['export']}")
+
+    if config['cnn']:
+        zero_weights, zero_channels = sparsity(model)
+        print(f"Zero weights: {zero_weights * 100:.2f}% | Zero conv channels: {zero_channels * 100:.2f}%")
 
     end = time.time()
+    results.log_timing('total', end - start)
+    results.close()
     print("\nTime elapsed: ", end - start, "s")
 
 
 if __name__ == "__main__":
     args = parse_args()
-    main(args)
+    if args['ddp'] > 1:
+        from utils.distributed import launch
+        launch(main, args, args['ddp'])
+    else:
+        main(args)
@@ -1,139 +1,123 @@
 import statistics
+import time
 import torch
-from utils.buffer import Buffer
+from utils.buffer import Buffer, report_memory
 from torch.utils.data import DataLoader
 from tqdm import tqdm
-from models.gem import store_gradient, overwrite_gradient
-from utils.metrics import backward_transfer, forgetting, forward_transfer
+from utils.metrics import AccuracyMatrix, summarize
+from utils.checkpoint import load_checkpoint, save_checkpoint
+from utils.early_stopping import EpochController
 from utils.evaluation import evaluate_past, test_epoch, evaluate_next
 from utils.utils import binary_accuracy
-import pandas as pd
+from utils.profiler import profiler
 import numpy as np
 
 
-def train_agem(model, loss, device, optimizer, train_set, test_set, suffix, config):
+def train_agem(model, loss, device, optimizer, train_set, test_set, suffix, config, results):
     a_gem = AGEM(config, device, model, loss, optimizer)
-    accuracy = []
+    accuracy = AccuracyMatrix(len(train_set))
+    controller = EpochController(config)
 
-    # N SummaryWriter for N domains
-    if config['evaluate']:
-        text_file = open("a_gem_" + suffix + ".txt", "a")
-        text_file.write("A-GEM LEARNING \n")
-        test_list = [[] for _ in range(len(train_set))]
-
-    # Eval without training
-    _, _, random_mean_accuracy, _ = evaluate_past(a_gem.model, len(test_set) - 1, test_set, a_gem.loss, device)
+    checkpoint = load_checkpoint(config['checkpoint'], model, optimizer)
+    if checkpoint is not None:
+        # Continue after the last domain trained in the checkpoint
+        a_gem, accuracy, random_mean_accuracy, controller = checkpoint['objects']
+    else:
+        # Eval without training
+        _, _, random_mean_accuracy, _ = evaluate_past(a_gem.model, len(test_set) - 1, test_set, a_gem.loss, device)
 
     # Train
+    train_time = 0
+    train_steps = 0
     for index, data_set in enumerate(train_set):
+        if checkpoint is not None and index <= checkpoint['domain']:
+            continue
         a_gem.model.train()
         print(f"----- DOMAIN {index} -----")
-        train_loader = DataLoader(data_set, batch_size=config["batch_size"], shuffle=False)
+        train_loader = DataLoader(controller.start_domain(data_set), batch_size=config["batch_size"], shuffle=False)
 
-        for epoch in tqdm(range(config['epochs'])):
+        for epoch in profiler.epochs(tqdm(range(config['epochs']))):
             a_gem.model.train()
 
             epoch_loss = []
             epoch_acc = []
+            # Reference gradient is recomputed at the first step of every epoch
+            a_gem.steps = 0
+            start = time.time()
             for j, (x, y) in enumerate(train_loader):
 
                 # Gradient current task
-                a_gem.optimizer.zero_grad()
+                a_gem.zero_grad()
                 x = x.to(device)
                 output = a_gem.model(x)
                 y = y.to(device)
                 s_loss = a_gem.loss(output, y.squeeze(1))
 
-                if config['cnn']:
-                    l1_reg = 0
-                    for param in a_gem.model.parameters():
-                        l1_reg += torch.norm(param, 1)
-                    s_loss += config['l1_lambda'] * l1_reg
-
                 _, pred = torch.max(output.data, 1)
                 acc = binary_accuracy(pred, y.squeeze(1))
                 epoch_loss.append(s_loss.item())
                 epoch_acc.append(acc.item())
 
-                s_loss.backward()
+                with profiler.phase('backward'):
+                    s_loss.backward()
 
                 if not a_gem.buffer.is_empty():
-                    store_gradient(a_gem.model.parameters(), a_gem.grad_xy, a_gem.grad_dims)
-
-                    buf_inputs, buf_labels, _ = a_gem.buffer.get_data(config['batch_size'])
-                    a_gem.optimizer.zero_grad()
-                    buf_outputs = a_gem.model(torch.stack(buf_inputs))
-                    penalty = a_gem.loss(buf_outputs, torch.stack(buf_labels).squeeze(1))
-                    penalty.backward()
-                    store_gradient(a_gem.model.parameters(), a_gem.grad_er, a_gem.grad_dims)
+                    a_gem.project()
 
-                    dot_prod = torch.dot(a_gem.grad_xy, a_gem.grad_er)
-                    if dot_prod.item() < 0:
-                        gradient_tilde = project(gxy=a_gem.grad_xy, ger=a_gem.grad_er)
-                        overwrite_gradient(a_gem.model.parameters(), gradient_tilde, a_gem.grad_dims)
-                    else:
-                        overwrite_gradient(a_gem.model.parameters(), a_gem.grad_xy, a_gem.grad_dims)
+                with profiler.phase('step'):
+                    a_gem.optimizer.step()
+                profiler.step(len(x))
 
-                a_gem.optimizer.step()
+            train_time += time.time() - start
+            train_steps += len(train_loader)
 
             if (epoch % 100 == 0) or (epoch == (config['epochs'] - 1)):
                 print(f'\nEpoch {epoch:03}/{config["epochs"]} | Loss: {statistics.mean(epoch_loss):.5f} '
                       f'| Acc: {statistics.mean(epoch_acc):.2f}%')
 
+            results.log_epoch(index, epoch, statistics.mean(epoch_loss), statistics.mean(epoch_acc))
+
             # Test each epoch
             if config['evaluate']:
-                tmp_list = []
-                # Past tasks
-                for past in range(index):
+                epoch_eval = []
+                for past in range(index + 1):
                     test_loader = DataLoader(test_set[past], batch_size=1, shuffle=False)
                     tmp, _ = test_epoch(a_gem.model, test_loader, a_gem.loss, device)
-                    test_list[past].append(statistics.mean(tmp))
-                    for t in tmp:
-                        tmp_list.append(t)
-                # Current task
-                test_loader = DataLoader(test_set[index], batch_size=1, shuffle=False)
-                tmp, loss_task = test_epoch(a_gem.model, test_loader, a_gem.loss, device)
-                test_list[index].append(statistics.mean(tmp))
-                for t in tmp:
-                    tmp_list.append(t)
+                    epoch_eval.append(statistics.mean(tmp))
+                results.log_evaluation(index, epoch, epoch_eval)
+
+            if controller.stop(epoch, statistics.mean(epoch_loss), a_gem.model):
+                break
 
         a_gem.end_task(train_set, index)
 
         # Test at the end of domain
         evaluation, error, mean_evaluation, mean_error = evaluate_past(a_gem.model, index, test_set, a_gem.loss, device)
         print(f"Mean Error: {statistics.mean(error):.5f} | Mean Acc: {statistics.mean(evaluation):.2f}%")
-        accuracy.append(mean_evaluation)
-        if config['evaluate']:
-            text_file.write(f"---Evaluation after domain {index}--- \n")
-            for i, a in enumerate(mean_evaluation):
-                text_file.write(f"Domain {i} | Error: {mean_error[i]:.5f} | Acc: {a:.2f}%\n")
-            text_file.write(f"Mean Error: {statistics.mean(error):.5f} | "
-                            f"Mean Acc: {statistics.mean(evaluation):.2f}% \n")
+        accuracy.update(index, mean_evaluation)
+        results.log_domain(index, mean_evaluation, mean_error)
 
         if index != len(train_set) - 1:
-            accuracy[index].append(evaluate_next(a_gem.model, index, test_set, a_gem.loss, device))
+            accuracy.update_next(index, evaluate_next(a_gem.model, index, test_set, a_gem.loss, device))
 
-    # Compute transfer metrics
-    backward = backward_transfer(accuracy)
-    forward = forward_transfer(accuracy, random_mean_accuracy)
-    forget = forgetting(accuracy)
-    print(f'Backward transfer: {backward}')
-    print(f'Forward transfer: {forward}')
-    print(f'Forgetting: {forget}')
+        if config['checkpoint'] is not None:
+            save_checkpoint(config['checkpoint'], index, (a_gem, accuracy, random_mean_accuracy, controller))
+        if index + 1 == config['domains']:
+            break
 
-    if config['evaluate']:
-        text_file.write(f"Backward: {backward}\n")
-        text_file.write(f"Forward: {forward}\n")
-        text_file.write(f"Forgetting: {forget}\n")
-        text_file.close()
-
-        df = pd.DataFrame(test_list)
-        df.to_csv(f"a_gem_{suffix}.csv")
-
-
-def project(gxy, ger):
-    cor = torch.dot(gxy, ger) / torch.dot(ger, ger)
-    return gxy - cor * ger
+    # Compute transfer metrics
+    metrics = summarize(accuracy, random_mean_accuracy)
+    print(f"Backward transfer: {metrics['backward']}")
+    print(f"Forward transfer: {metrics['forward']}")
+    print(f"Forgetting: {metrics['forgetting']}")
+    results.log_transfer(metrics)
+    # No train steps when a checkpoint is resumed after its last domain
+    if train_steps:
+        print(f"Train steps/s: {train_steps / train_time:.1f}")
+        results.log_timing('train_step', train_time / train_steps)
+    controller.report(results)
+    report_memory(a_gem.buffer, results)
+    return metrics
 
 
 class AGEM:
@@ -144,13 +128,53 @@ class AGEM:
         self.loss = loss
         self.optimizer = optimizer
 
-        self.buffer = Buffer(self.config['buffer_size'], self.device)
+        self.buffer = Buffer(self.config['buffer_size'], self.device, self.config['buffer_storage'],
+                             self.config['channels'])
         self.grad_dims = []
         for p in self.model.parameters():
             self.grad_dims.append(p.data.numel())
-        self.grad_xy = torch.Tensor(np.sum(self.grad_dims)).to(self.device)
-        self.grad_er = torch.Tensor(np.sum(self.grad_dims)).to(self.device)
-
+        # Flat gradient of the current batch, the .grad of every parameter is a view of it
+        self.grad_xy = torch.zeros(np.sum(self.grad_dims)).to(self.device)
+        self.link_grads()
+        # Cached reference gradient on the memories and its squared norm
+        self.grad_er = torch.zeros(np.sum(self.grad_dims)).to(self.device)
+        self.grad_er_norm = None
+        self.steps = 0
+
+    def link_grads(self):
+        offset = 0
+        for p, n in zip(self.model.parameters(), self.grad_dims):
+            p.grad = self.grad_xy[offset:offset + n].view_as(p)
+            offset += n
+
+    def zero_grad(self):
+        # optimizer.zero_grad() would replace the views with None
+        self.grad_xy.zero_()
+
+    @profiler.timed('reference')
+    def update_reference(self):
+        ref_size = self.config['agem_ref_size'] or self.config['batch_size']
+        buf_inputs, buf_labels, _ = self.buffer.get_data(ref_size)
+        penalty = self.loss(self.model(buf_inputs), buf_labels.squeeze(1))
+        grads = torch.autograd.grad(penalty, list(self.model.parameters()))
+        torch.cat([g.reshape(-1) for g in grads], out=self.grad_er)
+        self.grad_er_norm = torch.dot(self.grad_er, self.grad_er)
+
+    @profiler.timed('projection')
+    def project(self):
+        # Reference gradient refreshed every agem_refresh steps (0: once per epoch), the current
+        # gradient is projected in place when it conflicts with it
+        refresh = self.config['agem_refresh']
+        if self.steps == 0 or (refresh > 0 and self.steps % refresh == 0):
+            self.update_reference()
+        self.steps += 1
+
+        dot_prod = torch.dot(self.grad_xy, self.grad_er)
+        if dot_prod.item() < 0:
+            profiler.count('projections')
+            self.grad_xy.sub_(dot_prod / self.grad_er_norm * self.grad_er)
+
+    @profiler.timed('end_task')
     def end_task(self, dataset, index):
         # Add data to the buffer
         num_samples = self.config['buffer_size'] // len(dataset)
@@ -1,34 +1,41 @@
 import statistics
-import pandas as pd
 import torch
 import torch.nn.functional as F
 from torch.utils.data import DataLoader
 from tqdm import tqdm
-from utils.buffer import Buffer
-from utils.metrics import backward_transfer, forgetting, forward_transfer
+from utils.buffer import Buffer, report_memory
+from utils.metrics import AccuracyMatrix, summarize
+from utils.checkpoint import load_checkpoint, save_checkpoint, load_snapshot, save_snapshot
+from utils.early_stopping import EpochController
 from utils.evaluation import evaluate_past, test_epoch, evaluate_next
 from utils.utils import binary_accuracy
+from utils.profiler import profiler
 
 
-def train_dark_er(train_set, test_set, model, loss, optimizer, device, config, suffix):
+def train_dark_er(train_set, test_set, model, loss, optimizer, device, config, suffix, results):
 
     der = DarkER(config, device, model, loss, optimizer)
-    accuracy = []
-
-    if config['evaluate']:
-        text_file = open("dark_er_" + suffix + ".txt", "a")
-        text_file.write("\nCONTINUAL LEARNING W\\ DER \n")
-        test_list = [[] for _ in range(len(train_set))]
-
-    # Eval without training
-    _, _, random_mean_accuracy, _ = evaluate_past(der.model, len(test_set) - 1, test_set, loss, device)
+    accuracy = AccuracyMatrix(len(train_set))
+    controller = EpochController(config)
+
+    checkpoint = load_checkpoint(config['checkpoint'], model, optimizer)
+    if checkpoint is not None:
+        # Continue after the last domain trained in the checkpoint
+        der, accuracy, random_mean_accuracy, controller = checkpoint['objects']
+    else:
+        # Eval without training
+        _, _, random_mean_accuracy, _ = evaluate_past(der.model, len(test_set) - 1, test_set, loss, device)
+        # Start from the state of a previous run, only the domains after its last one are trained
+        checkpoint = load_snapshot(config['warm_start'], 'der', der, accuracy, train_set, test_set, device)
 
     for index, data_set in enumerate(train_set):
+        if checkpoint is not None and index <= checkpoint['domain']:
+            continue
         der.model.train()
         print(f"----- DOMAIN {index} -----")
-        train_loader = DataLoader(data_set, batch_size=config['batch_size'], shuffle=False)
+        train_loader = DataLoader(controller.start_domain(data_set), batch_size=config['batch_size'], shuffle=False)
 
-        for epoch in tqdm(range(config['epochs'])):
+        for epoch in profiler.epochs(tqdm(range(config['epochs']))):
             der.model.train()
             epoch_loss = []
             epoch_acc = []
@@ -37,33 +44,32 @@ def train_dark_er(train_set, test_set, model, loss, optimizer, device, config, s
 
                 inputs = x.to(device)
                 labels = y.to(device)
-                output = der.model(inputs)
-
-                first_loss = loss(output, labels.squeeze(1))
-                _, pred = torch.max(output.data, 1)
-                acc = binary_accuracy(pred, labels.squeeze(1))
 
                 if not der.buffer.is_empty():
+                    # One forward over current + replay batches
                     buf_input, _, buf_logit = der.buffer.get_data(config['batch_size'])
-                    buf_input = torch.stack(buf_input)
-                    buf_logit = torch.stack(buf_logit)
-                    buf_output = der.model(buf_input)
+                    all_output = der.model(torch.cat((inputs, buf_input)))
+                    output, buf_output = all_output.split([inputs.shape[0], buf_input.shape[0]])
+
+                    first_loss = loss(output, labels.squeeze(1))
                     add_loss = F.mse_loss(buf_output, buf_logit)
                     final_loss = first_loss + config['alpha'] * add_loss.data
                 else:
+                    output = der.model(inputs)
+                    first_loss = loss(output, labels.squeeze(1))
                     final_loss = first_loss
 
-                if config['cnn']:
-                    l1_reg = 0
-                    for param in der.model.parameters():
-                        l1_reg += torch.norm(param, 1)
-                    final_loss += config['l1_lambda'] * l1_reg
+                _, pred = torch.max(output.data, 1)
+                acc = binary_accuracy(pred, labels.squeeze(1))
 
                 epoch_loss.append(final_loss.item())
                 epoch_acc.append(acc.item())
 
-                final_loss.backward()
-                optimizer.step()
+                with profiler.phase('backward'):
+                    final_loss.backward()
+                with profiler.phase('step'):
+                    optimizer.step()
+                profiler.step(len(x))
 
                 if epoch == 0:
                     der.buffer.add_data(examples=x.to(device), logits=output.to(device))
@@ -72,54 +78,45 @@ def train_dark_er(train_set, test_set, model, loss, optimizer, device, config, s
                 print(f'\nEpoch {epoch:03}/{config["epochs"]} | Loss: {statistics.mean(epoch_loss):.5f} '
                       f'| Acc: {statistics.mean(epoch_acc):.2f}%')
 
+            results.log_epoch(index, epoch, statistics.mean(epoch_loss), statistics.mean(epoch_acc))
+
             # Test each epoch
             if config['evaluate']:
-                tmp_list = []
-                # Past tasks
-                for past in range(index):
+                epoch_eval = []
+                for past in range(index + 1):
                     test_loader = DataLoader(test_set[past], batch_size=1, shuffle=False)
                     tmp, _ = test_epoch(der.model, test_loader, loss, device)
-                    test_list[past].append(statistics.mean(tmp))
-                    for t in tmp:
-                        tmp_list.append(t)
-                # Current task
-                test_loader = DataLoader(test_set[index], batch_size=1, shuffle=False)
-                tmp, loss_task = test_epoch(der.model, test_loader, loss, device)
+                    epoch_eval.append(statistics.mean(tmp))
+                results.log_evaluation(index, epoch, epoch_eval)
 
-                test_list[index].append(statistics.mean(tmp))
-                for t in tmp:
-                    tmp_list.append(t)
+            if controller.stop(epoch, statistics.mean(epoch_loss), der.model):
+                break
 
         # Test at the end of domain
         evaluation, error, mean_evaluation, mean_error = evaluate_past(der.model, index, test_set, loss, device)
         print(f"Mean Error: {statistics.mean(error):.5f} | Mean Acc: {statistics.mean(evaluation):.2f}%")
-        accuracy.append(mean_evaluation)
-        if config['evaluate']:
-            text_file.write(f"---Evaluation after domain {index}--- \n")
-            for i, a in enumerate(mean_evaluation):
-                text_file.write(f"Domain {i} | Error: {mean_error[i]:.5f} | Acc: {a:.2f}%\n")
-            text_file.write(f"Mean Error: {statistics.mean(error):.5f} | "
-                            f"Mean Acc: {statistics.mean(evaluation):.2f}% \n")
+        accuracy.update(index, mean_evaluation)
+        results.log_domain(index, mean_evaluation, mean_error)
 
         if index != len(train_set) - 1:
-            accuracy[index].append(evaluate_next(der.model, index, test_set, loss, device))
+            accuracy.update_next(index, evaluate_next(der.model, index, test_set, loss, device))
 
-    # Compute transfer metrics
-    backward = backward_transfer(accuracy)
-    forward = forward_transfer(accuracy, random_mean_accuracy)
-    forget = forgetting(accuracy)
-    print(f'\nBackward transfer: {backward}')
-    print(f'Forward transfer: {forward}')
-    print(f'Forgetting: {forget}')
-
-    if config['evaluate']:
-        text_file.write(f"Backward: {backward}\n")
-        text_file.write(f"Forward: {forward}\n")
-        text_file.write(f"Forgetting: {forget}\n")
-        text_file.close()
+        if config['checkpoint'] is not None:
+            save_checkpoint(config['checkpoint'], index, (der, accuracy, random_mean_accuracy, controller))
+        if config['snapshot'] is not None:
+            save_snapshot(config['snapshot'], index, 'der', der, accuracy, train_set)
+        if index + 1 == config['domains']:
+            break
 
-        df = pd.DataFrame(test_list)
-        df.to_csv(f'dark_er_{suffix}.csv')
+    # Compute transfer metrics
+    metrics = summarize(accuracy, random_mean_accuracy)
+    print(f"\nBackward transfer: {metrics['backward']}")
+    print(f"Forward transfer: {metrics['forward']}")
+    print(f"Forgetting: {metrics['forgetting']}")
+    results.log_transfer(metrics)
+    controller.report(results)
+    report_memory(der.buffer, results)
+    return metrics
 
 
 class DarkER:
@@ -129,4 +126,5 @@ class DarkER:
         self.model = model
         self.loss = loss
         self.optimizer = optimizer
-        self.buffer = Buffer(self.config['buffer_size'], self.device)
+        self.buffer = Buffer(self.config['buffer_size'], self.device, self.config['buffer_storage'],
+                             self.config['channels'])
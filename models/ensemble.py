@@ -0,0 +1,171 @@
+import statistics
+import torch
+import torch.nn.functional as F
+import numpy as np
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from utils.buffer import Buffer, report_memory
+from utils.ensemble import ModelEnsemble, MemberRNG, step_members
+from utils.metrics import AccuracyMatrix, summarize
+from utils.regularization import ProxSGD, prox_param_groups
+from utils.early_stopping import EpochController
+from utils.evaluation import evaluate_past, test_epoch, evaluate_next
+from utils.profiler import profiler
+
+
+def train_ensemble(train_set, test_set, models, loss, device, config, suffix, results):
+    # results: one RunRecorder per seed
+    ens = Ensemble(config, device, models, loss)
+    n_seeds = ens.model.n_members
+    seeds = [config['seed'] + k for k in range(n_seeds)]
+    accuracy = [AccuracyMatrix(len(train_set)) for _ in range(n_seeds)]
+    random_mean_accuracy = []
+
+    # Eval without training
+    for k in range(n_seeds):
+        _, _, random_acc, _ = evaluate_past(ens.model.member(k), len(test_set) - 1, test_set, loss, device)
+        random_mean_accuracy.append(random_acc)
+
+    # Train, with the epoch budget of every member decided by its own controller as in the run of its seed
+    controllers = [EpochController(config) for _ in range(n_seeds)]
+    for index, data_set in enumerate(train_set):
+        ens.model.train()
+        print(f"----- DOMAIN {index} -----")
+        # Every controller holds out the same validation part of the domain
+        train_part = [controller.start_domain(data_set) for controller in controllers][0]
+        train_loader = DataLoader(train_part, batch_size=config["batch_size"], shuffle=False)
+        # Members still training on the current domain, the others are frozen until the next one
+        training = list(range(n_seeds))
+        active = torch.ones(n_seeds, dtype=torch.bool, device=device)
+
+        for epoch in profiler.epochs(tqdm(range(config['epochs']))):
+            ens.model.train()
+
+            epoch_loss = []
+            epoch_acc = []
+            for j, (x, y) in enumerate(train_loader):
+                ens.optimizer.zero_grad()
+
+                x = x.to(device)
+                y = y.to(device)
+                inputs = ens.model.expand(x)
+                labels = ens.model.expand(y)
+
+                if config['model'] == 'er' and not ens.buffers[0].is_empty():
+                    # Strategy 50/50, one replay batch per member
+                    buf_input, buf_label = ens.get_replay(config['batch_size'], training)
+                    inputs = torch.cat((inputs, buf_input), dim=1)
+                    labels = torch.cat((labels, buf_label), dim=1)
+
+                output = ens.model(inputs)
+                # Mean over the flattened members scaled by K == sum of the per-member mean losses
+                s_loss = loss(output.flatten(0, 1), labels.flatten(0, 1).squeeze(1)) * n_seeds
+
+                _, pred = torch.max(output.data, 2)
+                acc = (pred == labels.squeeze(2)).float().mean(dim=1) * 100
+                member_loss = F.cross_entropy(output.data.transpose(1, 2), labels.squeeze(2), reduction='none')
+                epoch_loss.append(member_loss.mean(dim=1).cpu().numpy())
+                epoch_acc.append(acc.cpu().numpy())
+
+                with profiler.phase('backward'):
+                    s_loss.backward()
+                with profiler.phase('step'):
+                    step_members(ens.optimizer, active)
+                profiler.step(len(x))
+
+                if config['model'] == 'er' and epoch == 0:
+                    for k in training:
+                        with MemberRNG(ens.rng, k):
+                            ens.buffers[k].add_data(examples=x, labels=y)
+
+            # Per-member mean over the batches of the epoch
+            epoch_loss = np.mean(epoch_loss, axis=0)
+            epoch_acc = np.mean(epoch_acc, axis=0)
+            if (epoch % 100 == 0) or (epoch == (config['epochs'] - 1)):
+                print(f'\nEpoch {epoch:03}/{config["epochs"]} | Mean Loss: {epoch_loss[training].mean():.5f} '
+                      f'| Mean Acc: {epoch_acc[training].mean():.2f}%')
+
+            for k in list(training):
+                results[k].log_epoch(index, epoch, epoch_loss[k], epoch_acc[k])
+
+                # Test each epoch
+                if config['evaluate']:
+                    member = ens.model.member(k)
+                    epoch_eval = []
+                    for past in range(index + 1):
+                        test_loader = DataLoader(test_set[past], batch_size=1, shuffle=False)
+                        tmp, _ = test_epoch(member, test_loader, loss, device)
+                        epoch_eval.append(statistics.mean(tmp))
+                    results[k].log_evaluation(index, epoch, epoch_eval)
+
+                member = ens.model.member(k) if controllers[k].val_x is not None else None
+                if controllers[k].stop(epoch, epoch_loss[k], member):
+                    training.remove(k)
+                    active[k] = False
+            if not training:
+                break
+
+        # Test at the end of domain
+        for k in range(n_seeds):
+            print(f"Seed {seeds[k]} | ", end="")
+            member = ens.model.member(k)
+            evaluation, error, mean_evaluation, mean_error = evaluate_past(member, index, test_set, loss, device)
+            print(f"Mean Error: {statistics.mean(error):.5f} | Mean Acc: {statistics.mean(evaluation):.2f}%")
+            accuracy[k].update(index, mean_evaluation)
+            results[k].log_domain(index, mean_evaluation, mean_error)
+
+            if index != len(train_set) - 1:
+                accuracy[k].update_next(index, evaluate_next(member, index, test_set, loss, device))
+
+        if index + 1 == config['domains']:
+            break
+
+    # Compute transfer metrics for all the seeds at once
+    metrics = summarize(np.stack(accuracy), np.array(random_mean_accuracy))
+    for k in range(n_seeds):
+        print(f"Seed {seeds[k]} | Backward transfer: {metrics['backward'][k]} | "
+              f"Forward transfer: {metrics['forward'][k]} | Forgetting: {metrics['forgetting'][k]}")
+
+    print(f"Backward transfer: {metrics['backward'].mean()} ± {metrics['backward'].std()}")
+    print(f"Forward transfer: {metrics['forward'].mean()} ± {metrics['forward'].std()}")
+    print(f"Forgetting: {metrics['forgetting'].mean()} ± {metrics['forgetting'].std()}")
+    print(f"Accuracy: {metrics['acc'].mean():.2f} ± {metrics['acc'].std():.2f} | "
+          f"Learning accuracy: {metrics['learning_acc'].mean():.2f} ± {metrics['learning_acc'].std():.2f}")
+
+    for k in range(n_seeds):
+        results[k].log_transfer({key: value[k] for key, value in metrics.items()})
+        print(f"Seed {seeds[k]} | ", end="")
+        controllers[k].report(results[k])
+    if config['model'] == 'er':
+        report_memory(ens.buffers[0], results[0])
+        for buffer, run in zip(ens.buffers[1:], results[1:]):
+            run.log_buffer(buffer.storage, buffer.buffer_size, buffer.memory_report())
+
+
+class Ensemble:
+    def __init__(self, config, device, models, loss):
+        self.config = config
+        self.device = device
+        self.model = ModelEnsemble(models).to(device)
+        self.loss = loss
+        # SGD is elementwise: one optimizer on the stacked weights == one optimizer per member
+        if config['cnn']:
+            self.optimizer = ProxSGD(prox_param_groups(self.model, config['l1_lambda'], config['group_lambda']),
+                                     lr=config["lr"], momentum=0.7)
+        else:
+            self.optimizer = torch.optim.SGD(self.model.parameters(), lr=config["lr"], momentum=0.7)
+        self.buffers = [Buffer(self.config['buffer_size'], self.device, self.config['buffer_storage'],
+                               self.config['channels']) for _ in range(len(models))]
+        # numpy RNG state of each member (reservoir and replay sampling), seeded as the run of its seed
+        self.rng = [np.random.RandomState(config['seed'] + k).get_state() for k in range(len(models))]
+
+    def get_replay(self, size, members):
+        # One replay batch per member in `members` from its own buffer and RNG, zeros for the frozen members
+        batches = {}
+        for k in members:
+            with MemberRNG(self.rng, k):
+                batches[k] = self.buffers[k].get_data(size)[:2]
+        buf_input, buf_label = next(iter(batches.values()))
+        buf_inputs = [batches[k][0] if k in batches else torch.zeros_like(buf_input) for k in range(len(self.buffers))]
+        buf_labels = [batches[k][1] if k in batches else torch.zeros_like(buf_label) for k in range(len(self.buffers))]
+        return torch.stack(buf_inputs), torch.stack(buf_labels)
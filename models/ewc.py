@@ -4,33 +4,38 @@ import torch
 from torch import nn
 from torch.utils.data import DataLoader
 from tqdm import tqdm
-from utils.metrics import backward_transfer, forgetting, forward_transfer
+from utils.metrics import AccuracyMatrix, summarize
+from utils.checkpoint import load_checkpoint, save_checkpoint
+from utils.early_stopping import EpochController
 from utils.evaluation import evaluate_past, test_epoch, evaluate_next
 from utils.utils import binary_accuracy
-import pandas as pd
+from utils.profiler import profiler
 import torch.nn.functional as F
 
 
-def train_ewc(model, loss, device, optimizer, train_set, test_set, suffix, config):
+def train_ewc(model, loss, device, optimizer, train_set, test_set, suffix, config, results):
 
     ewc = EWC(model, loss, config, optimizer, device)
-    accuracy = []
+    accuracy = AccuracyMatrix(len(train_set))
+    controller = EpochController(config)
 
-    if config['evaluate']:
-        text_file = open("ewc_" + suffix + ".txt", "a")
-        text_file.write("EWC LEARNING \n")
-        test_list = [[] for _ in range(len(train_set))]
-
-    # Eval without training
-    _, _, random_mean_accuracy, _ = evaluate_past(ewc.model, len(test_set) - 1, test_set, ewc.loss, device)
+    checkpoint = load_checkpoint(config['checkpoint'], model, optimizer)
+    if checkpoint is not None:
+        # Continue after the last domain trained in the checkpoint
+        ewc, accuracy, random_mean_accuracy, controller = checkpoint['objects']
+    else:
+        # Eval without training
+        _, _, random_mean_accuracy, _ = evaluate_past(ewc.model, len(test_set) - 1, test_set, ewc.loss, device)
 
     # Train
     for index, data_set in enumerate(train_set):
+        if checkpoint is not None and index <= checkpoint['domain']:
+            continue
         ewc.model.train()
         print(f"----- DOMAIN {index} -----")
-        train_loader = DataLoader(data_set, batch_size=config["batch_size"], shuffle=False)
+        train_loader = DataLoader(controller.start_domain(data_set), batch_size=config["batch_size"], shuffle=False)
 
-        for epoch in tqdm(range(config['epochs'])):
+        for epoch in profiler.epochs(tqdm(range(config['epochs']))):
             ewc.model.train()
 
             epoch_loss = []
@@ -45,12 +50,6 @@ def train_ewc(model, loss, device, optimizer, train_set, test_set, suffix, confi
                 penalty = ewc.penalty()
                 s_loss = ewc.loss(output, y.squeeze(1)) + (config['e_lambda'] * penalty)
 
-                if config['cnn']:
-                    l1_reg = 0
-                    for param in ewc.model.parameters():
-                        l1_reg += torch.norm(param, 1)
-                    s_loss += config['l1_lambda'] * l1_reg
-
                 assert not torch.isnan(s_loss)
 
                 _, pred = torch.max(output.data, 1)
@@ -58,62 +57,54 @@ def train_ewc(model, loss, device, optimizer, train_set, test_set, suffix, confi
                 epoch_loss.append(s_loss.item())
                 epoch_acc.append(acc.item())
 
-                s_loss.backward()
-                ewc.optimizer.step()
+                with profiler.phase('backward'):
+                    s_loss.backward()
+                with profiler.phase('step'):
+                    ewc.optimizer.step()
+                profiler.step(len(x))
 
             if (epoch % 100 == 0) or (epoch == (config['epochs'] - 1)):
                 print(f'\nEpoch {epoch:03}/{config["epochs"]} | Loss: {statistics.mean(epoch_loss):.5f} '
                       f'| Acc: {statistics.mean(epoch_acc):.2f}%')
 
+            results.log_epoch(index, epoch, statistics.mean(epoch_loss), statistics.mean(epoch_acc))
+
             # Test each epoch
             if config['evaluate']:
-                tmp_list = []
-                # Past tasks
-                for past in range(index):
+                epoch_eval = []
+                for past in range(index + 1):
                     test_loader = DataLoader(test_set[past], batch_size=1, shuffle=False)
                     tmp, _ = test_epoch(ewc.model, test_loader, ewc.loss, device)
-                    test_list[past].append(statistics.mean(tmp))
-                    for t in tmp:
-                        tmp_list.append(t)
-                # Current task
-                test_loader = DataLoader(test_set[index], batch_size=1, shuffle=False)
-                tmp, loss_task = test_epoch(ewc.model, test_loader, ewc.loss, device)
-                test_list[index].append(statistics.mean(tmp))
-                for t in tmp:
-                    tmp_list.append(t)
+                    epoch_eval.append(statistics.mean(tmp))
+                results.log_evaluation(index, epoch, epoch_eval)
+
+            if controller.stop(epoch, statistics.mean(epoch_loss), ewc.model):
+                break
 
         ewc.end_task(data_set)
 
         # Test at the end of domain
         evaluation, error, mean_evaluation, mean_error = evaluate_past(ewc.model, index, test_set, ewc.loss, device)
         print(f"Mean Error: {statistics.mean(error):.5f} | Mean Acc: {statistics.mean(evaluation):.2f}%")
-        accuracy.append(mean_evaluation)
-        if config['evaluate']:
-            text_file.write(f"---Evaluation after domain {index}--- \n")
-            for i, a in enumerate(mean_evaluation):
-                text_file.write(f"Domain {i} | Error: {mean_error[i]:.5f} | Acc: {a:.2f}%\n")
-            text_file.write(f"Mean Error: {statistics.mean(error):.5f} | "
-                            f"Mean Acc: {statistics.mean(evaluation):.2f}% \n")
+        accuracy.update(index, mean_evaluation)
+        results.log_domain(index, mean_evaluation, mean_error)
 
         if index != len(train_set) - 1:
-            accuracy[index].append(evaluate_next(ewc.model, index, test_set, ewc.loss, device))
+            accuracy.update_next(index, evaluate_next(ewc.model, index, test_set, ewc.loss, device))
 
-    # Compute transfer metrics
-    backward = backward_transfer(accuracy)
-    forward = forward_transfer(accuracy, random_mean_accuracy)
-    forget = forgetting(accuracy)
-    print(f'Backward transfer: {backward}')
-    print(f'Forward transfer: {forward}')
-    print(f'Forgetting: {forget}')
-
-    if config['evaluate']:
-        text_file.write(f"Backward: {backward}\n")
-        text_file.write(f"Forward: {forward}\n")
-        text_file.write(f"Forgetting: {forget}\n")
-        text_file.close()
+        if config['checkpoint'] is not None:
+            save_checkpoint(config['checkpoint'], index, (ewc, accuracy, random_mean_accuracy, controller))
+        if index + 1 == config['domains']:
+            break
 
-        df = pd.DataFrame(test_list)
-        df.to_csv(f'ewc_{suffix}.csv')
+    # Compute transfer metrics
+    metrics = summarize(accuracy, random_mean_accuracy)
+    print(f"Backward transfer: {metrics['backward']}")
+    print(f"Forward transfer: {metrics['forward']}")
+    print(f"Forgetting: {metrics['forgetting']}")
+    results.log_transfer(metrics)
+    controller.report(results)
+    return metrics
 
 
 class EWC:
@@ -134,6 +125,7 @@ class EWC:
             penalty = (self.fish * ((self.model.get_params() - self.checkpoint) ** 2)).sum()
             return penalty
 
+    @profiler.timed('end_task')
     def end_task(self, dataset):
         train_loader = DataLoader(dataset, batch_size=self.config["batch_size"], shuffle=False)
         fish = torch.zeros_like(self.model.get_params())
@@ -144,7 +136,8 @@ class EWC:
             for ex, lab in zip(inputs, labels):
                 self.optimizer.zero_grad()
                 output = self.model(ex.unsqueeze(0))
-                loss = - F.cross_entropy(output, lab, reduction='none')
+                # Joint log-likelihood of the heads of a multi-horizon backbone
+                loss = - F.cross_entropy(output, lab.view(1, *output.shape[2:]), reduction='none').sum()
                 exp_cond_prob = torch.mean(torch.exp(loss.detach().clone()))
                 loss.backward()
                 fish += exp_cond_prob * self.model.get_grads() ** 2
@@ -0,0 +1,147 @@
+import statistics
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from models.ensemble import Ensemble
+from utils.buffer import report_memory
+from utils.ensemble import MemberRNG, step_members
+from utils.metrics import AccuracyMatrix, summarize
+from utils.early_stopping import EpochController
+from utils.evaluation import evaluate_past, test_epoch, evaluate_next
+from utils.profiler import profiler
+
+
+def train_multi_asset(train_sets, test_sets, models, loss, device, config, names, results):
+    # One backbone per asset, trained together as a vectorized ensemble. Round r trains the domain r of every
+    # asset that has one: each asset sees its own batches, replay draws and optimizer updates, as in its single
+    # asset run. results: one RunRecorder per asset
+    ens = Ensemble(config, device, models, loss)
+    n_assets = len(models)
+    n_domains = [len(t) if config['domains'] is None else min(len(t), config['domains']) for t in train_sets]
+    accuracy = [AccuracyMatrix(len(t)) for t in train_sets]
+    controllers = [EpochController(config) for _ in range(n_assets)]
+    # numpy RNG state of each asset (reservoir and replay sampling)
+    rng = [np.random.get_state() for _ in range(n_assets)]
+
+    # Eval without training
+    random_mean_accuracy = []
+    for k in range(n_assets):
+        _, _, random_acc, _ = evaluate_past(ens.model.member(k), len(test_sets[k]) - 1, test_sets[k], loss, device)
+        random_mean_accuracy.append(random_acc)
+
+    for index in range(max(n_domains)):
+        print(f"----- DOMAIN {index} -----")
+        assets = [k for k in range(n_assets) if index < n_domains[k]]
+        loaders = {k: DataLoader(controllers[k].start_domain(train_sets[k][index]), batch_size=config['batch_size'],
+                                 shuffle=False) for k in assets}
+        # Assets still training on the current domain (early stopping is per asset)
+        training = list(assets)
+
+        for epoch in profiler.epochs(tqdm(range(config['epochs']))):
+            ens.model.train()
+
+            epoch_loss = {k: [] for k in training}
+            epoch_acc = {k: [] for k in training}
+            iterators = {k: iter(loaders[k]) for k in training}
+            while True:
+                batches = {k: batch for k in training if (batch := next(iterators[k], None)) is not None}
+                if not batches:
+                    break
+                ens.optimizer.zero_grad()
+
+                inputs, labels = {}, {}
+                for k, (x, y) in batches.items():
+                    inputs[k], labels[k] = x.to(device), y.to(device)
+                    if config['model'] == 'er' and not ens.buffers[k].is_empty():
+                        # Strategy 50/50
+                        with MemberRNG(rng, k):
+                            buf_input, buf_label, _ = ens.buffers[k].get_data(config['batch_size'])
+                        inputs[k] = torch.cat((inputs[k], buf_input))
+                        labels[k] = torch.cat((labels[k], buf_label))
+
+                x_pad, y_pad, weights = pad_members(inputs, labels, n_assets)
+                output = ens.model(x_pad)
+                # Sum over the assets of the mean loss of their rows
+                row_loss = F.cross_entropy(output.flatten(0, 1), y_pad.flatten(), reduction='none').view(weights.shape)
+                s_loss = (row_loss * weights).sum()
+
+                member_loss = (row_loss.detach() * weights).sum(dim=1)
+                correct = (output.data.argmax(dim=2) == y_pad).float() * (weights > 0)
+                for k in batches:
+                    epoch_loss[k].append(member_loss[k].item())
+                    epoch_acc[k].append(correct[k].sum().item() / len(labels[k]) * 100)
+
+                with profiler.phase('backward'):
+                    s_loss.backward()
+                with profiler.phase('step'):
+                    step_members(ens.optimizer, weights.sum(dim=1) > 0)
+                profiler.step(sum(len(x) for x, _ in batches.values()))
+
+                if config['model'] == 'er' and epoch == 0:
+                    for k, (x, y) in batches.items():
+                        with MemberRNG(rng, k):
+                            ens.buffers[k].add_data(examples=x.to(device), labels=y.to(device))
+
+            for k in list(training):
+                if (epoch % 100 == 0) or (epoch == (config['epochs'] - 1)):
+                    print(f'\n{names[k]} | Epoch {epoch:03}/{config["epochs"]} | '
+                          f'Loss: {statistics.mean(epoch_loss[k]):.5f} | Acc: {statistics.mean(epoch_acc[k]):.2f}%')
+                results[k].log_epoch(index, epoch, statistics.mean(epoch_loss[k]), statistics.mean(epoch_acc[k]))
+
+                # Test each epoch
+                if config['evaluate']:
+                    member = ens.model.member(k)
+                    epoch_eval = []
+                    for past in range(index + 1):
+                        test_loader = DataLoader(test_sets[k][past], batch_size=1, shuffle=False)
+                        tmp, _ = test_epoch(member, test_loader, loss, device)
+                        epoch_eval.append(statistics.mean(tmp))
+                    results[k].log_evaluation(index, epoch, epoch_eval)
+
+                member = ens.model.member(k) if controllers[k].val_x is not None else None
+                if controllers[k].stop(epoch, statistics.mean(epoch_loss[k]), member):
+                    training.remove(k)
+            if not training:
+                break
+
+        # Test at the end of domain
+        for k in assets:
+            print(f"{names[k]} | ", end="")
+            member = ens.model.member(k)
+            evaluation, error, mean_evaluation, mean_error = evaluate_past(member, index, test_sets[k], loss, device)
+            print(f"Mean Error: {statistics.mean(error):.5f} | Mean Acc: {statistics.mean(evaluation):.2f}%")
+            accuracy[k].update(index, mean_evaluation)
+            results[k].log_domain(index, mean_evaluation, mean_error)
+
+            if index != len(train_sets[k]) - 1:
+                accuracy[k].update_next(index, evaluate_next(member, index, test_sets[k], loss, device))
+
+    # Compute transfer metrics of every asset
+    metrics = {}
+    for k in range(n_assets):
+        metrics[names[k]] = summarize(accuracy[k], random_mean_accuracy[k])
+        print(f"{names[k]} | Backward transfer: {metrics[names[k]]['backward']} | "
+              f"Forward transfer: {metrics[names[k]]['forward']} | Forgetting: {metrics[names[k]]['forgetting']}")
+        results[k].log_transfer(metrics[names[k]])
+        controllers[k].report(results[k])
+        if config['model'] == 'er':
+            report_memory(ens.buffers[k], results[k])
+    return metrics
+
+
+def pad_members(inputs, labels, n_members):
+    # (K, B, ...) inputs and (K, B) labels padded to the largest batch, with the weight of every row in the mean
+    # loss of its member (0 for the padding and for the members without a batch)
+    size = max(len(x) for x in inputs.values())
+    x = next(iter(inputs.values()))
+    x_pad = x.new_zeros((n_members, size) + x.shape[1:])
+    y_pad = torch.zeros((n_members, size), dtype=torch.long, device=x.device)
+    weights = x.new_zeros((n_members, size))
+    for k in inputs:
+        n = len(inputs[k])
+        x_pad[k, :n] = inputs[k]
+        y_pad[k, :n] = labels[k].squeeze(1)
+        weights[k, :n] = 1 / n
+    return x_pad, y_pad, weights
@@ -0,0 +1,155 @@
+import argparse
+import itertools
+import math
+import os
+import random
+import shlex
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from main import parse_args as parse_main_args
+
+# Datasets loaded by the current worker process, keyed by the arguments that change the preprocessing
+_data_cache = {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Successive halving search over the arguments of main.py. The budget of a trial is the number "
+                    "of domains it has been trained on: every rung trains the surviving configurations on more "
+                    "domains, resuming them from their checkpoints, and promotes the best 1/eta. "
+                    "Unknown arguments are passed to main.py, e.g. "
+                    "python search.py --space lr=0.0001,0.001 dropout=0.2,0.5 -- --model er --dataset oil-daily.csv")
+    parser.add_argument('--space', nargs='+', required=True,
+                        help="Searched main.py arguments as name=value1,value2,...")
+    parser.add_argument('--n_configs', type=int, default=None,
+                        help="Number of configurations sampled from the grid (default: all the grid)")
+    parser.add_argument('--eta', type=int, default=2,
+                        help="Keep the best 1/eta of the trials at every rung, the domain budget grows by eta")
+    parser.add_argument('--min_domains', type=int, default=1,
+                        help="Domain budget of the first rung")
+    parser.add_argument('--metric', default='acc', choices=['acc', 'forgetting'],
+                        help="Promote by average accuracy (higher is better) or forgetting (lower is better)")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="Trials run in parallel")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Torch threads of every worker")
+    parser.add_argument('--search_dir', type=str, default='search',
+                        help="Directory of the trial checkpoints")
+    args, main_argv = parser.parse_known_args()
+    if main_argv and main_argv[0] == '--':
+        main_argv = main_argv[1:]
+    if args.metric == 'forgetting' and args.min_domains < 2:
+        parser.error("--metric forgetting needs --min_domains 2 or more")
+    return vars(args), main_argv
+
+
+def sample_configs(space, n_configs, seed):
+    # Configurations of the grid of searched arguments, as {name: value} of main.py arguments
+    names, values = zip(*[(item.split('=', 1)[0], item.split('=', 1)[1].split(',')) for item in space])
+    grid = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    if n_configs is not None and n_configs < len(grid):
+        grid = random.Random(seed).sample(grid, n_configs)
+    return grid
+
+
+def trial_argv(main_argv, params):
+    argv = list(main_argv)
+    for name, value in params.items():
+        argv += [f"--{name}", value]
+    return argv
+
+
+def run_trial(trial, argv, budget, checkpoint, threads):
+    # Train (or continue training) one configuration up to `budget` domains, returns its transfer metrics
+    import numpy as np
+    import torch
+    import torch.nn as nn
+    from main import load_data, build_model, load_strategy
+    from utils.results import ResultsStore
+
+    torch.set_num_threads(threads)
+    config = parse_main_args(argv)
+    config['domains'] = budget
+    config['checkpoint'] = checkpoint
+    config['suffix'] = f"{config['suffix']}_trial{trial}"
+
+    if not os.path.exists(checkpoint):
+        random.seed(config['seed'])
+        np.random.seed(config['seed'])
+        torch.manual_seed(config['seed'])
+
+    key = (config['dataset'], config['processing'], config['cnn'])
+    if key not in _data_cache:
+        train_data, test_data = load_data(config)
+        _data_cache[key] = train_data, test_data, config['channels']
+    train_data, test_data, config['channels'] = _data_cache[key]
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model, optimizer = build_model(config, train_data[0][0][0].size()[0], device)
+    results = ResultsStore(config['results']).new_run(config)
+    start = time.time()
+    train = load_strategy(config['model'])
+    metrics = train(train_set=train_data, test_set=test_data, model=model, loss=nn.CrossEntropyLoss(),
+                    optimizer=optimizer, device=device, config=config, suffix=config['suffix'], results=results)
+    results.log_timing('total', time.time() - start)
+    results.close()
+    return {k: float(v) for k, v in metrics.items()}
+
+
+def score(metrics, metric):
+    # Higher is better
+    return metrics['acc'] if metric == 'acc' else -metrics['forgetting']
+
+
+def main():
+    args, main_argv = parse_args()
+    base = parse_main_args(main_argv)
+    if base['model'] == 'online' or base['n_seeds'] > 1:
+        raise SystemExit("search needs a CL method with transfer metrics (not online, no --n_seeds)")
+
+    # Number of domains of the dataset
+    from main import load_data
+    n_domains = len(load_data(dict(base))[0])
+
+    os.makedirs(args['search_dir'], exist_ok=True)
+    configs = sample_configs(args['space'], args['n_configs'], base['seed'])
+    trials = list(range(len(configs)))
+    checkpoints = {t: os.path.join(args['search_dir'], f"trial_{t}.pt") for t in trials}
+    for t in trials:
+        if os.path.exists(checkpoints[t]):
+            os.remove(checkpoints[t])
+    history = {t: {} for t in trials}
+
+    budget = min(args['min_domains'], n_domains)
+    with ProcessPoolExecutor(args['workers'], mp_context=get_context('spawn')) as pool:
+        while True:
+            print(f"Rung: {len(trials)} trials, {budget}/{n_domains} domains")
+            futures = {t: pool.submit(run_trial, t, trial_argv(main_argv, configs[t]), budget, checkpoints[t],
+                                      args['threads']) for t in trials}
+            for t, future in futures.items():
+                history[t][budget] = future.result()
+                print(f"Trial {t} {configs[t]} | domains {budget} | acc {history[t][budget]['acc']:.2f} | "
+                      f"forgetting {history[t][budget]['forgetting']:.2f}")
+            if budget == n_domains:
+                break
+            trials = sorted(trials, key=lambda t: score(history[t][budget], args['metric']), reverse=True)
+            trials = trials[:max(1, math.ceil(len(trials) / args['eta']))]
+            budget = min(budget * args['eta'], n_domains)
+
+    # Trials by budget reached, then by score at that budget
+    def rank(t):
+        reached = max(history[t])
+        return reached, score(history[t][reached], args['metric'])
+
+    budgets = sorted({b for h in history.values() for b in h})
+    print("\nTrial | Params | " + " | ".join(f"{args['metric']}@{b}" for b in budgets))
+    for t in sorted(history, key=rank, reverse=True):
+        print(f"{t} | {configs[t]} | " + " | ".join(f"{v[args['metric']]:.2f}" for _, v in sorted(history[t].items())))
+    best = max(trials, key=rank)
+    print(f"\nBest: python main.py {shlex.join(trial_argv(main_argv, configs[best]))}")
+
+
+if __name__ == "__main__":
+    main()
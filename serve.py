@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+
+import torch
+
+from utils.inference import load_model, WindowBuilder
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the predictions of a backbone exported with main.py --export on a local socket. "
+                    "One JSON request per line: {\"asset\": name, \"prices\": [...]} appends prices to the window "
+                    "of the asset and predicts its latest window, {\"window\": [...]} predicts an input window, "
+                    "{\"meta\": true} returns the preprocessing of the model. Predictions are "
+                    "{\"up\": probability of a target price above the window mean, \"label\": 0 or 1}, "
+                    "{\"ready\": false} while the window of an asset is warming up")
+    parser.add_argument('--model', type=str, required=True,
+                        help="TorchScript file of main.py --export")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max_batch', type=int, default=64,
+                        help="Maximum number of windows of a forward pass")
+    parser.add_argument('--max_wait', type=float, default=2.,
+                        help="Maximum milliseconds a batch waits for more requests")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Torch threads")
+    return vars(parser.parse_args(argv))
+
+
+class MicroBatcher:
+    # Groups the concurrent requests in batches of at most max_batch windows and runs one forward pass per batch.
+    # A batch is dispatched as soon as no other request is ready, or max_wait seconds after its first request
+    def __init__(self, model, max_batch, max_wait):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.requests = 0
+
+    async def predict(self, window):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((window, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(items) < self.max_batch and loop.time() < deadline:
+                if self.queue.empty():
+                    # Let the connections with a pending request enqueue it, dispatch once none is left
+                    await asyncio.sleep(0)
+                    if self.queue.empty():
+                        break
+                items.append(self.queue.get_nowait())
+
+            windows = torch.stack([window for window, _ in items])
+            with torch.inference_mode():
+                up = torch.softmax(self.model(windows), dim=1)[:, 1].tolist()
+            self.batches += 1
+            self.requests += len(items)
+            for (_, future), p in zip(items, up):
+                if not future.cancelled():
+                    future.set_result(p)
+
+
+class Server:
+    def __init__(self, model, meta, max_batch, max_wait):
+        self.meta = meta
+        self.batcher = MicroBatcher(model, max_batch, max_wait)
+        # Input window of the model
+        n_features = 7
+        self.shape = (n_features, meta['n_step']) if meta['cnn'] else (n_features * meta['n_step'],)
+        self.builders = {}
+
+    async def answer(self, request):
+        if request.get('meta'):
+            return {**self.meta, 'window_shape': list(self.shape)}
+        if 'window' in request:
+            window = torch.tensor(request['window'], dtype=torch.float32)
+            if tuple(window.shape) != self.shape:
+                raise ValueError(f"window shape must be {list(self.shape)}")
+        else:
+            asset = request['asset']
+            if asset not in self.builders:
+                self.builders[asset] = WindowBuilder(self.meta['n_step'], self.meta['cnn'])
+            self.builders[asset].append(request['prices'])
+            window = self.builders[asset].window()
+            if window is None:
+                return {'ready': False}
+        up = await self.batcher.predict(window)
+        return {'up': up, 'label': int(up > 0.5)}
+
+    async def handle(self, reader, writer):
+        # Requests of a connection are answered in order
+        while line := await reader.readline():
+            try:
+                response = await self.answer(json.loads(line))
+            except KeyError as e:
+                response = {'error': f"missing {e}"}
+            except (ValueError, TypeError) as e:
+                response = {'error': str(e)}
+            writer.write((json.dumps(response) + '\n').encode())
+            await writer.drain()
+        writer.close()
+
+
+async def serve(config):
+    model, meta = load_model(config['model'])
+    server = Server(model, meta, config['max_batch'], config['max_wait'] / 1000)
+    # The first calls of a TorchScript module optimize it
+    with torch.inference_mode():
+        for size in (1, config['max_batch']):
+            model(torch.zeros((size,) + server.shape))
+    batcher = asyncio.create_task(server.batcher.run())
+    socket = await asyncio.start_server(server.handle, config['host'], config['port'])
+    print(f"Serving {config['model']} ({meta['model']} on {meta['dataset']}) on {config['host']}:{config['port']}",
+          flush=True)
+    try:
+        async with socket:
+            await socket.serve_forever()
+    finally:
+        batcher.cancel()
+        if server.batcher.batches:
+            print(f"{server.batcher.requests} predictions in {server.batcher.batches} batches")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    torch.set_num_threads(args['threads'])
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,25 @@
+import os
+import sys
+
+# The modules of the project are imported from the repository root (main.py, utils/, models/)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Small synthetic run of benchmarks/strategies.py: 3 regimes of 400 steps, one torch thread
+SYNTHETIC = {'threads': 1, 'regimes': 3, 'regime_length': 400, 'steps': 300}
+
+
+def train_synthetic(name, main_argv, steps=None):
+    # Metrics of the CL method name trained on the synthetic series with the arguments main_argv of main.py
+    from benchmarks.strategies import run_strategy
+    args = dict(SYNTHETIC, steps=steps or SYNTHETIC['steps'])
+    return run_strategy(name, ['--dropout', '0', '--buffer_size', '200'] + main_argv, args)['metrics']
+
+
+def run_dir(path):
+    # Working directory of a main.py run in path: the datasets and changepoints of the repository, a checkpoints/ dir
+    os.symlink(os.path.join(ROOT, 'dataset'), os.path.join(path, 'dataset'))
+    os.symlink(os.path.join(ROOT, 'chp_list.txt'), os.path.join(path, 'chp_list.txt'))
+    os.makedirs(os.path.join(path, 'checkpoints'))
+    return str(path)
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, run_dir
+from utils.results import ResultsStore
+
+MAIN_ARGV = ['--dataset', 'oil-daily.csv', '--processing', 'indicators', '--epochs', '1']
+
+
+def train(name, cwd, argv):
+    subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--model', name] + MAIN_ARGV + argv,
+                   check=True, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+@pytest.mark.parametrize('name', ['agem', 'agem_r'])
+def test_train_step_timing(name, tmp_path):
+    cwd = run_dir(tmp_path)
+    path = str(tmp_path / 'results.h5')
+    argv = ['--results', path, '--checkpoint', str(tmp_path / 'checkpoint.pt')]
+    train(name, cwd, argv)
+    timings = ResultsStore(path).select('timings', model=name)
+    assert (timings['phase'] == 'train_step').sum() == 1
+    # Resuming the checkpoint of the last domain trains no step and logs no train step time
+    train(name, cwd, argv)
+    timings = ResultsStore(path).select('timings', model=name)
+    assert timings['run_id'].nunique() == 2 and (timings['phase'] == 'train_step').sum() == 1
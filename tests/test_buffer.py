@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import train_synthetic
+from utils.buffer import Buffer
+
+# Tolerated difference of the final mean accuracy from the float32 buffer, in points
+TOLERANCE = 3.
+
+
+@pytest.mark.parametrize('storage', ['float16', 'int8'])
+def test_examples_roundtrip(storage):
+    # Every example of a full buffer is returned within the precision of its storage
+    torch.manual_seed(0)
+    np.random.seed(0)
+    examples = torch.randn(50, 7 * 30) * torch.logspace(-2, 2, 7).repeat_interleave(30)
+    buffer = Buffer(50, torch.device('cpu'), storage, channels=7)
+    buffer.add_data(examples=examples, labels=torch.zeros(50, 1, dtype=torch.long))
+    stored, _ = buffer.get_data_by_index(torch.arange(50))[:2]
+    # Slot i holds example i while the buffer is filling
+    scale = examples.reshape(50, 7, 30).abs().amax(dim=2, keepdim=True)
+    error = ((stored - examples).reshape(50, 7, 30).abs() / scale).max()
+    assert error < (1e-3 if storage == 'float16' else 1 / 127)
+    assert buffer.memory_report()['slot'] < 7 * 30 * 4
+
+
+@pytest.mark.parametrize('name', ['er', 'derpp'])
+@pytest.mark.parametrize('storage', ['float16', 'int8'])
+def test_accuracy_drift(name, storage):
+    reference = train_synthetic(name, ['--buffer_storage', 'float32'])
+    metrics = train_synthetic(name, ['--buffer_storage', storage])
+    assert abs(metrics['acc'] - reference['acc']) <= TOLERANCE
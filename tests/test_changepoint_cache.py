@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+DETECTION = os.path.join(ROOT, 'detection')
+# The detection tests import the package as sdt (cwd detection/)
+SDT = ("import numpy as np, sdt.changepoint as c; "
+       "print(c.BayesOnline().find_changepoints(np.r_[np.zeros(20), np.ones(20)], 3, 0.5))")
+# main.py detects through utils.utils (cwd repository root)
+MAIN = ("import numpy as np; from utils.utils import detect_changepoints; "
+        "print(detect_changepoints(np.r_[np.zeros(20), np.ones(20)], False, 3, 0.5))")
+
+
+def run(code, cwd, cache):
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache)
+    return subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, capture_output=True, text=True)
+
+
+@pytest.mark.parametrize('order', [(SDT, MAIN), (MAIN, SDT)], ids=['tests_first', 'main_first'])
+def test_kernels_shared_cache(tmp_path, order):
+    # The kernels compiled and cached by one import path are loaded by the other one
+    outputs = []
+    for code in order:
+        cwd = DETECTION if code is SDT else ROOT
+        process = run(code, cwd, str(tmp_path))
+        assert process.returncode == 0, process.stderr
+        outputs.append(process.stdout)
+    assert outputs[0] == outputs[1] == "[20]\n"
+    assert os.listdir(tmp_path)
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from conftest import run_dir
+from benchmarks.ddp import loss_curve
+
+# Two domains of one epoch of oil-daily.csv, as benchmarks/ddp.py compares them
+MAIN_ARGV = ['--dataset', 'oil-daily.csv', '--processing', 'indicators', '--domains', '2', '--epochs', '1']
+TOLERANCE = 1e-4
+
+
+@pytest.mark.parametrize('name', ['er', 'ewc'])
+def test_loss_curve(name, tmp_path):
+    cwd = run_dir(tmp_path)
+    reference, _ = loss_curve(name, 1, MAIN_ARGV, str(tmp_path), cwd)
+    losses, _ = loss_curve(name, 2, MAIN_ARGV, str(tmp_path), cwd)
+    assert len(reference) == 2
+    np.testing.assert_allclose(losses, reference, rtol=0, atol=TOLERANCE)
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from conftest import ROOT, run_dir
+from utils.results import ResultsStore, TRANSFER_COLUMNS
+
+MAIN_ARGV = ['--dataset', 'oil-daily.csv', '--processing', 'indicators', '--dropout', '0', '--domains', '3',
+             '--epochs', '2']
+SEED = 230
+# Records compared between the ensemble and the single runs, and their sort keys
+RECORDS = {'epochs': (['domain', 'epoch'], ['loss', 'accuracy']),
+           'domains': (['domain', 'eval_domain'], ['accuracy', 'error']),
+           'budget': (['domain'], ['epochs']),
+           'transfer': ([], TRANSFER_COLUMNS)}
+
+
+def train(cwd, path, argv):
+    subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--results', path] + MAIN_ARGV + argv,
+                   check=True, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def records(path, key, seed):
+    order, columns = RECORDS[key]
+    table = ResultsStore(path).select(key, seed=seed)
+    return (table.sort_values(order) if order else table)[columns].to_numpy(dtype=float)
+
+
+@pytest.mark.parametrize('argv', [['--model', 'online'], ['--model', 'er'],
+                                  # Early stopping of every member on its own validation error
+                                  ['--model', 'er', '--epochs', '6', '--patience', '1', '--val_fraction', '0.2']])
+def test_seeds_match_single_runs(argv, tmp_path):
+    # Every member of a --n_seeds 2 ensemble matches the run of its seed alone
+    cwd = run_dir(tmp_path)
+    ensemble, single = str(tmp_path / 'ensemble.h5'), str(tmp_path / 'single.h5')
+    train(cwd, ensemble, argv + ['--seed', str(SEED), '--n_seeds', '2'])
+    for seed in (SEED, SEED + 1):
+        train(cwd, single, argv + ['--seed', str(seed)])
+        # The single online run logs no transfer metrics nor epoch budget
+        for key in RECORDS if argv[1] == 'er' else ['epochs', 'domains']:
+            np.testing.assert_allclose(records(ensemble, key, seed), records(single, key, seed), rtol=0, atol=1e-3)
@@ -0,0 +1,79 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from conftest import ROOT
+from utils.ingest import column_path, load_prices
+
+OIL = os.path.join(ROOT, 'dataset', 'oil-daily.csv')
+
+
+def copy_oil(tmp_path):
+    path = str(tmp_path / 'oil-daily.csv')
+    shutil.copy(OIL, path)
+    return path
+
+
+def expected(path):
+    return pd.read_csv(path).iloc[:, 1].to_numpy(dtype=np.float64)
+
+
+def rewrite(path, old, new, mtime_ns=None):
+    # Same-length edit of the CSV, with its mtime set to mtime_ns if given
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert len(old) == len(new) and data.count(old) >= 1
+    with open(path, 'wb') as f:
+        f.write(data.replace(old, new, 1))
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def middle_row(path):
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines()
+    return lines[len(lines) // 2]
+
+
+def test_append_is_incremental(tmp_path):
+    path = copy_oil(tmp_path)
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    with open(path, 'wb') as f:
+        f.writelines(lines[:-10])
+    assert len(load_prices(path)) == len(lines) - 11
+    with open(path, 'ab') as f:
+        f.writelines(lines[-10:])
+    np.testing.assert_array_equal(load_prices(path), expected(path))
+
+
+def test_same_length_edit_in_the_middle(tmp_path):
+    path = copy_oil(tmp_path)
+    load_prices(path)
+    row = middle_row(path)
+    price = row.split(b',')[1]
+    edited = row.replace(price, price[:-1] + (b'1' if price[-1:] != b'1' else b'2'))
+    rewrite(path, row, edited, os.stat(path).st_mtime_ns + 10 ** 9)
+    np.testing.assert_array_equal(load_prices(path), expected(path))
+
+
+def test_edit_with_an_append(tmp_path):
+    # An edit of the ingested bytes is not mistaken for an append even if the CSV grew
+    path = copy_oil(tmp_path)
+    load_prices(path)
+    row = middle_row(path)
+    price = row.split(b',')[1]
+    rewrite(path, row, row.replace(price, price[:-1] + (b'1' if price[-1:] != b'1' else b'2')))
+    with open(path, 'ab') as f:
+        f.write(row + b'\n')
+    np.testing.assert_array_equal(load_prices(path), expected(path))
+
+
+def test_unchanged_csv_is_not_read(tmp_path):
+    path = copy_oil(tmp_path)
+    load_prices(path)
+    mtime = os.stat(column_path(path)).st_mtime_ns
+    np.testing.assert_array_equal(load_prices(path), expected(path))
+    assert os.stat(column_path(path)).st_mtime_ns == mtime
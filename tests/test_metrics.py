@@ -0,0 +1,16 @@
+import numpy as np
+
+from utils.metrics import AccuracyMatrix, summarize
+
+
+def test_domains_cutoff():
+    # 2 of 4 domains trained (--domains 2): the metrics cover the trained domains only, as a 2 domain run
+    accuracy = AccuracyMatrix(4)
+    accuracy.update(0, [60.])
+    accuracy.update_next(0, 40.)
+    accuracy.update(1, [50., 70.])
+    accuracy.update_next(1, 45.)
+    metrics = summarize(accuracy, [30., 35., 40., 45.])
+    assert all(np.isfinite(value) for value in metrics.values())
+    assert metrics == summarize(np.array([[60., 40.], [50., 70.]]), [30., 35.])
+    assert metrics['forgetting'] == 10. and metrics['backward'] == -10. and metrics['forward'] == 5.
@@ -0,0 +1,21 @@
+from functools import lru_cache
+
+import pytest
+
+from conftest import train_synthetic
+
+# Tolerated difference of the final mean accuracy from float32, in points (as benchmarks/precision.py)
+TOLERANCE = 2.
+
+
+@lru_cache(maxsize=None)
+def reference(name, cnn):
+    return train_synthetic(name, ['--cnn'] if cnn else [])
+
+
+@pytest.mark.parametrize('name', ['er', 'ewc'])
+@pytest.mark.parametrize('cnn, mode', [(False, ['--bf16']), (True, ['--bf16']), (True, ['--channels_last']),
+                                       (True, ['--bf16', '--channels_last'])])
+def test_accuracy_parity(name, cnn, mode):
+    metrics = train_synthetic(name, (['--cnn'] if cnn else []) + mode)
+    assert abs(metrics['acc'] - reference(name, cnn)['acc']) <= TOLERANCE
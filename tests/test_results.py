@@ -0,0 +1,30 @@
+import pytest
+
+from utils.results import ResultsStore
+
+CONFIG = {'model': 'er', 'dataset': 'oil-daily.csv', 'seed': 230, 'suffix': 'default'}
+
+
+def test_too_long_suffix_fails_before_training(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.h5'))
+    with pytest.raises(ValueError, match='suffix'):
+        store.new_run(dict(CONFIG, suffix='s' * 70))
+
+
+def test_too_long_dataset_fails_before_training(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.h5'))
+    with pytest.raises(ValueError, match='dataset'):
+        store.new_run(dict(CONFIG, dataset='d' * 65 + '.csv'))
+
+
+def test_long_config_is_stored(tmp_path):
+    store = ResultsStore(str(tmp_path / 'results.h5'))
+    config = dict(CONFIG, note='x' * 5000)
+    for _ in range(2):
+        run = store.new_run(config)
+        run.log_epoch(0, 0, 0.5, 50.)
+        run.close()
+    runs = store.select('runs')
+    assert len(runs) == 2 and runs['config_hash'].nunique() == 1
+    assert store.config(runs['config_hash'].iloc[0]) == config
+    assert len(store.select('epochs', model='er')) == 2
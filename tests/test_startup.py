@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import time
+
+from conftest import ROOT
+
+HEAVY = ['torch', 'numba', 'talib', 'matplotlib']
+# main.py -h takes ~0.2 s, importing torch alone takes longer than the bound
+MAX_SECONDS = 1.5
+
+
+def imported_modules(argv):
+    # Top level modules imported by python main.py <argv> (from -X importtime) and its seconds
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(ROOT, 'main.py')] + argv,
+                             capture_output=True, text=True, check=True)
+    seconds = time.perf_counter() - start
+    modules = {line.rsplit('|', 1)[1].strip().split('.')[0]
+               for line in process.stderr.splitlines() if line.startswith('import time:')}
+    return modules, seconds
+
+
+def test_help_imports_no_heavy_dependency():
+    modules, _ = imported_modules(['-h'])
+    assert not modules & set(HEAVY)
+
+
+def test_help_startup_time():
+    # Best of three, the first run may read cold files
+    seconds = min(imported_modules(['-h'])[1] for _ in range(3))
+    assert seconds < MAX_SECONDS
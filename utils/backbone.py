@@ -1,12 +1,33 @@
 import torch.nn as nn
 import torch
+import torch.nn.functional as F
+
+
+def enable_bf16(model):
+    # Runs the forward passes of the model under bfloat16 autocast with forward hooks, so that every trainer and the
+    # evaluation get it. The weights, their gradients and the optimizer state stay float32 (autocast casts a
+    # bfloat16 copy of the weights for each forward), the logits are cast back to float32 for the losses
+    return model.register_forward_pre_hook(_autocast_pre_hook), model.register_forward_hook(_autocast_hook)
+
+
+def _autocast_pre_hook(module, inputs):
+    module._autocast = torch.autocast(inputs[0].device.type, dtype=torch.bfloat16)
+    module._autocast.__enter__()
+
+
+def _autocast_hook(module, inputs, output):
+    module._autocast.__exit__(None, None, None)
+    module._autocast = None
+    return output.float()
 
 
 class ClassficationMLP(nn.Module):
-    def __init__(self, input_size, dropout):
+    # n_heads > 1: one up/down output per horizon, (batch, 2, n_heads) logits
+    def __init__(self, input_size, dropout, n_heads=1):
         super(ClassficationMLP, self).__init__()
         self.input_size = input_size
         self.dropout = dropout
+        self.n_heads = n_heads
         self.net = nn.Sequential(
             nn.Linear(input_size, 100),
             nn.Dropout(dropout),
@@ -17,11 +38,13 @@ class ClassficationMLP(nn.Module):
             nn.Linear(50, 25),
             nn.Dropout(dropout),
             nn.LeakyReLU(),
-            nn.Linear(25, 2)
+            nn.Linear(25, 2 * n_heads)
         )
 
     def forward(self, x):
         x = self.net(x)
+        if self.n_heads > 1:
+            x = x.view(x.shape[0], 2, self.n_heads)
         return x
 
     def get_params(self):
@@ -38,9 +61,14 @@ class ClassficationMLP(nn.Module):
 
 
 class SimpleCNN(nn.Module):
-    def __init__(self, input_size):
+    # n_heads > 1: one up/down output per horizon, (batch, 2, n_heads) logits
+    # channels_last: the Conv1d stack runs as 2D convolutions of height 1 on channels last (NHWC) tensors, the
+    # layout of the oneDNN kernels on the CPU. Same weights, the outputs differ only by rounding
+    def __init__(self, input_size, n_heads=1, channels_last=False):
         super(SimpleCNN, self).__init__()
         self.input_size = input_size
+        self.n_heads = n_heads
+        self.channels_last = channels_last
         self.cnn = nn.Sequential(
             nn.Conv1d(in_channels=input_size, out_channels=16, kernel_size=(1,), stride=(1,)),
             nn.LeakyReLU(),
@@ -52,15 +80,30 @@ class SimpleCNN(nn.Module):
         self.fc = nn.Sequential(
             nn.Flatten(),
             nn.Linear(9*32, 32),
-            nn.Linear(32, 2),
+            nn.Linear(32, 2 * n_heads),
         )
 
     def forward(self, x):
-        x = self.cnn(x)
+        if self.channels_last:
+            x = self._cnn_channels_last(x)
+        else:
+            x = self.cnn(x)
         # x = x.view(x.shape[0], -1)
         x = self.fc(x)
+        if self.n_heads > 1:
+            x = x.view(x.shape[0], 2, self.n_heads)
         return x
 
+    @torch.jit.unused
+    def _cnn_channels_last(self, x):
+        x = x.unsqueeze(2).contiguous(memory_format=torch.channels_last)
+        for layer in self.cnn:
+            if isinstance(layer, nn.Conv1d):
+                x = F.conv2d(x, layer.weight.unsqueeze(2), layer.bias, (1, layer.stride[0]))
+            else:
+                x = layer(x)
+        return x.squeeze(2)
+
     def get_params(self):
         params = []
         for pp in list(self.parameters()):
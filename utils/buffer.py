@@ -1,5 +1,19 @@
+import json
+import os
 import torch
 import numpy as np
+from utils.profiler import profiler
+
+# Storage dtypes of the examples for each --buffer_storage mode
+STORAGE_DTYPES = {'float32': torch.float32, 'float16': torch.float16, 'bfloat16': torch.bfloat16, 'int8': torch.int8}
+
+
+def report_memory(buffer, results):
+    # Print the bytes per slot of a replay memory and log them with the records of the run
+    report = buffer.memory_report()
+    print(f"Buffer memory ({buffer.storage}): {report['slot']} bytes per slot | "
+          f"{report['total'] / 2 ** 20:.2f} MiB for {buffer.buffer_size} slots")
+    results.log_buffer(buffer.storage, buffer.buffer_size, report)
 
 
 def reservoir(seen_examples, buffer_size):
@@ -14,41 +28,115 @@ def reservoir(seen_examples, buffer_size):
 
 
 class Buffer:
-    def __init__(self, buffer_size, device):
+    # Reservoir replay memory kept in preallocated tensors, allocated on the first add_data.
+    # With a compact storage mode examples are kept as float16/bfloat16, or as int8 with one
+    # scale per example and channel (the 7 indicator series of a window), logits as float16
+    # and labels/task ids as small integers. get_data dequantizes the whole batch at once
+    def __init__(self, buffer_size, device, storage='float32', channels=1):
         self.buffer_size = buffer_size
         self.device = device
+        self.storage = storage
+        # Number of channels of a flattened (MLP) example, used for int8 scales
+        self.channels = channels
         self.seen_examples = 0
-        self.attributes = ['examples', 'labels']
-        self.examples = [None] * self.buffer_size
-        self.labels = [None] * self.buffer_size
-        self.logits = [None] * self.buffer_size
-        self.task_number = [None] * self.buffer_size
+        self.attributes = ['examples', 'labels', 'logits', 'task_number']
+        self.examples = None
+        self.scales = None
+        self.labels = None
+        self.logits = None
+        self.task_number = None
+
+    @property
+    def compact(self):
+        return self.storage != 'float32'
+
+    def _allocate(self, attr, shape, dtype):
+        setattr(self, attr, torch.zeros((self.buffer_size,) + tuple(shape), dtype=dtype, device=self.device))
+        profiler.count('buffer_bytes', getattr(self, attr).numel() * getattr(self, attr).element_size())
+
+    def _channel_view(self, examples):
+        # (n, channels, -1) view of a batch of examples
+        if examples.dim() > 2:
+            return examples.reshape(examples.shape[0], examples.shape[1], -1)
+        return examples.reshape(examples.shape[0], self.channels, -1)
+
+    def _encode(self, examples):
+        if self.storage != 'int8':
+            return examples.to(STORAGE_DTYPES[self.storage]), None
+        x = self._channel_view(examples.float())
+        scales = x.abs().amax(dim=2).clamp_min(1e-12) / 127
+        q = torch.round(x / scales.unsqueeze(2)).clamp_(-127, 127).to(torch.int8)
+        return q.reshape(examples.shape), scales
+
+    def _decode(self, idx):
+        examples = self.examples[idx]
+        if self.storage != 'int8':
+            return examples.float()
+        x = self._channel_view(examples).float() * self.scales[idx].unsqueeze(2)
+        return x.reshape(examples.shape)
 
-    def add_data(self, examples, task=None, labels=None,logits=None):
+    @profiler.timed('buffer_add')
+    def add_data(self, examples, task=None, labels=None, logits=None):
+        # Reservoir sampling decisions, slot -> example (the last example wins if a slot is drawn twice)
+        slots = {}
         for i in range(examples.shape[0]):
             index = reservoir(self.seen_examples, self.buffer_size)
             self.seen_examples += 1
             if index >= 0:
-                self.examples[index] = examples[i].to(self.device)
-                self.task_number[index] = task
-                if labels is not None:
-                    self.labels[index] = labels[i].to(self.device)
-                if logits is not None:
-                    self.logits[index] = logits[i].to(self.device)
+                slots[index] = i
+        if not slots:
+            return
 
-    def get_data(self, size,task_labels=False):
-        if size > min(self.seen_examples, len([x for x in self.examples if x is not None])):
-            size = min(self.seen_examples, len([x for x in self.examples if x is not None]))
+        idx = torch.tensor(list(slots.keys()), device=self.device)
+        src = torch.tensor(list(slots.values()), device=examples.device)
+        self._write(idx, src, examples, task, labels, logits)
 
-        choice = np.random.choice(min(self.seen_examples, len([x for x in self.examples if x is not None])),
-                                  size=size, replace=False)
+    def _write(self, idx, src, examples, task=None, labels=None, logits=None):
+        # Store examples[src] (and the other attributes) in the slots idx
+        if self.examples is None:
+            self._allocate('examples', examples.shape[1:], STORAGE_DTYPES[self.storage])
+            if self.storage == 'int8':
+                self._allocate('scales', (self._channel_view(examples[:1]).shape[1],), torch.float32)
+            self._allocate('task_number', (), torch.int16 if self.compact else torch.long)
+        if labels is not None and self.labels is None:
+            self._allocate('labels', labels.shape[1:], torch.int8 if self.compact else torch.long)
+        if logits is not None and self.logits is None:
+            self._allocate('logits', logits.shape[1:], torch.float16 if self.compact else torch.float32)
 
-        ret_examples = [self.examples[idx] for idx in choice]
-        ret_labels = [self.labels[idx] for idx in choice]
-        ret_logits = [self.logits[idx] for idx in choice]
+        examples, scales = self._encode(examples.detach()[src].to(self.device))
+        self.examples[idx] = examples
+        if scales is not None:
+            self.scales[idx] = scales
+        if task is not None:
+            self.task_number[idx] = int(task)
+        if labels is not None:
+            self.labels[idx] = labels.detach()[src].to(self.device, self.labels.dtype)
+        if logits is not None:
+            self.logits[idx] = logits.detach()[src].to(self.device, self.logits.dtype)
+
+    def __len__(self):
+        return min(self.seen_examples, self.buffer_size)
+
+    def sample_indices(self, size):
+        if size > len(self):
+            size = len(self)
+
+        choice = np.random.choice(len(self), size=size, replace=False)
+        return torch.from_numpy(choice).to(self.device)
+
+    def get_data(self, size, task_labels=False):
+        return self.get_data_by_index(self.sample_indices(size), task_labels)
+
+    @profiler.timed('replay')
+    def get_data_by_index(self, idx, task_labels=False):
+        # Gather (and dequantize) the slots idx, several draws can be concatenated in a single gather
+        profiler.count('buffer_draws', len(idx))
+        ret_examples = self._decode(idx)
+        ret_labels = self.labels[idx].long() if self.labels is not None else None
+        ret_logits = self.logits[idx].float() if self.logits is not None else None
 
         if task_labels:
-            ret_task_labels = [self.task_number[idx] for idx in choice]
+            ret_task_labels = self.task_number[idx].long()
             return ret_examples, ret_labels, ret_task_labels
 
         return ret_examples, ret_labels, ret_logits
@@ -60,17 +148,119 @@ class Buffer:
             return False
 
     def get_all_data(self):
-        ret_tuple = (torch.stack([ee.cpu()
-                                  for ee in self.examples]).to(self.device),)
+        idx = torch.arange(len(self), device=self.device)
+        ret_tuple = (self._decode(idx),)
         for attr_str in self.attributes[1:]:
-            if hasattr(self, attr_str):
-                attr = getattr(self, attr_str)
-                ret_tuple += (attr,)
+            attr = getattr(self, attr_str)
+            if attr is not None:
+                ret_tuple += (attr[:len(self)],)
 
         return ret_tuple
 
+    def memory_report(self):
+        # Bytes used per buffer slot by each stored attribute
+        report = {}
+        for attr_str in self.attributes + ['scales']:
+            attr = getattr(self, attr_str)
+            if attr is not None:
+                report[attr_str] = attr[0].numel() * attr.element_size()
+        report['slot'] = sum(report.values())
+        report['total'] = report['slot'] * self.buffer_size
+        return report
+
     def clear(self):
-        for attr_str in self.attributes:
-            if hasattr(self, attr_str):
-                delattr(self, attr_str)
+        for attr_str in self.attributes + ['scales']:
+            setattr(self, attr_str, None)
         self.seen_examples = 0
+
+    def _state(self):
+        return {'buffer_size': self.buffer_size, 'storage': self.storage, 'channels': self.channels,
+                'seen_examples': self.seen_examples}
+
+    def save(self, path):
+        # Snapshot of the memory in the directory path: the raw bytes of every stored attribute in its own file,
+        # their dtypes and shapes and the reservoir state in meta.json
+        os.makedirs(path, exist_ok=True)
+        meta = dict(self._state(), tensors={})
+        for attr_str in self.attributes + ['scales']:
+            attr = getattr(self, attr_str)
+            if attr is None:
+                continue
+            attr = attr.detach().cpu().contiguous()
+            attr.reshape(-1).view(torch.uint8).numpy().tofile(os.path.join(path, attr_str + '.bin'))
+            meta['tensors'][attr_str] = {'dtype': str(attr.dtype).split('.')[-1], 'shape': list(attr.shape)}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def load(self, path):
+        # Memory saved by save. On the CPU the attributes are copy on write memory maps of the files, so only the
+        # slots that are read are loaded and replacing a slot doesn't change the snapshot
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        for key in ['buffer_size', 'storage']:
+            if meta[key] != getattr(self, key):
+                raise ValueError(f"buffer snapshot {path} has {key} {meta[key]}, not {getattr(self, key)}")
+        self.clear()
+        for attr_str, spec in meta.pop('tensors').items():
+            dtype = getattr(torch, spec['dtype'])
+            data = np.memmap(os.path.join(path, attr_str + '.bin'), dtype=np.uint8, mode='c')
+            attr = torch.from_numpy(data).view(dtype).reshape(spec['shape'])
+            setattr(self, attr_str, attr if torch.device(self.device).type == 'cpu' else attr.to(self.device))
+        self._set_state(meta)
+
+    def _set_state(self, meta):
+        self.channels = meta['channels']
+        self.seen_examples = meta['seen_examples']
+
+
+class TaskBuffer(Buffer):
+    # Buffer partitioned by task: the memories of each task are appended as one contiguous slice,
+    # so the per-task batches are slices of the storage (views with float32 storage)
+    def __init__(self, buffer_size, device, storage='float32', channels=1):
+        super().__init__(buffer_size, device, storage, channels)
+        # offsets[t]:offsets[t + 1] is the slice of task t
+        self.offsets = [0]
+
+    @property
+    def n_tasks(self):
+        return len(self.offsets) - 1
+
+    @profiler.timed('buffer_add')
+    def add_data(self, examples, task=None, labels=None, logits=None):
+        # Every call adds a new task, examples that don't fit in the buffer anymore are dropped
+        start = self.offsets[-1]
+        n = min(examples.shape[0], self.buffer_size - start)
+        if n:
+            idx = torch.arange(start, start + n, device=self.device)
+            src = torch.arange(n, device=examples.device)
+            self._write(idx, src, examples, self.n_tasks if task is None else task, labels, logits)
+        self.offsets.append(start + n)
+        self.seen_examples = self.offsets[-1]
+
+    def _get_slice(self, start, end):
+        ret_labels = self.labels[start:end].long() if self.labels is not None else None
+        return self._decode(slice(start, end)), ret_labels
+
+    @profiler.timed('replay')
+    def get_task_data(self, task):
+        profiler.count('buffer_draws', self.offsets[task + 1] - self.offsets[task])
+        return self._get_slice(self.offsets[task], self.offsets[task + 1])
+
+    @profiler.timed('replay')
+    def get_all_tasks(self):
+        # All the memories in task order, with the number of memories of each task
+        profiler.count('buffer_draws', self.offsets[-1])
+        examples, labels = self._get_slice(0, self.offsets[-1])
+        counts = torch.tensor(np.diff(self.offsets), device=self.device)
+        return examples, labels, counts
+
+    def clear(self):
+        super().clear()
+        self.offsets = [0]
+
+    def _state(self):
+        return dict(super()._state(), offsets=self.offsets)
+
+    def _set_state(self, meta):
+        super()._set_state(meta)
+        self.offsets = meta['offsets']
@@ -0,0 +1,110 @@
+import json
+import os
+import random
+import shutil
+import numpy as np
+import torch
+from utils.distributed import is_main
+
+
+def save_checkpoint(path, domain, objects):
+    # Training state after `domain`: the trainer objects (strategy with model, optimizer and buffer, accuracy
+    # matrix, ...) and the RNG states, so that the run can be continued with the next domain
+    if not is_main():
+        return
+    state = {'domain': domain,
+             'objects': objects,
+             'rng': (random.getstate(), np.random.get_state(), torch.get_rng_state())}
+    tmp = path + '.tmp'
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, model, optimizer):
+    # State saved by save_checkpoint, or None. The restored strategy (first object) is rebound to the model and
+    # optimizer of the caller, which get the saved weights and optimizer state
+    if path is None or not os.path.exists(path):
+        return None
+    state = torch.load(path, map_location=next(model.parameters()).device, weights_only=False)
+    strategy = state['objects'][0]
+    model.load_state_dict(strategy.model.state_dict())
+    optimizer.load_state_dict(strategy.optimizer.state_dict())
+    strategy.model = model
+    strategy.optimizer = optimizer
+    if hasattr(strategy, 'link_grads'):
+        strategy.link_grads()
+
+    py_state, np_state, torch_state = state['rng']
+    random.setstate(py_state)
+    np.random.set_state(np_state)
+    torch.set_rng_state(torch_state)
+    print(f"Resumed from {path} after domain {state['domain']}")
+    return state
+
+
+def save_snapshot(path, domain, name, strategy, accuracy, train_set):
+    # Model, optimizer and replay buffer after `domain` in the directory path, with the accuracies, the sizes of the
+    # domains trained and the RNG states in meta.json, to start later runs on a longer series from this one
+    if not is_main():
+        return
+    tmp = path.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    torch.save({'model_state_dict': strategy.model.state_dict(),
+                'optimizer_state_dict': strategy.optimizer.state_dict()}, os.path.join(tmp, 'model.pt'))
+    strategy.buffer.save(os.path.join(tmp, 'buffer'))
+    py_state, np_state = random.getstate(), np.random.get_state()
+    meta = {'model': name,
+            'domain': domain,
+            'domain_sizes': [len(data) for data in train_set[:domain + 1]],
+            'accuracy': np.where(np.isnan(accuracy.matrix), None, accuracy.matrix)[:domain + 1].tolist(),
+            'rng': {'random': [py_state[0], list(py_state[1]), py_state[2]],
+                    'numpy': [np_state[0], np_state[1].tolist()] + list(np_state[2:]),
+                    'torch': torch.get_rng_state().tolist()}}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    # Swap the directories, a crash in between leaves the old snapshot in path + '.old'
+    old = path.rstrip(os.sep) + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def load_snapshot(path, name, strategy, accuracy, train_set, test_set, device):
+    # Restores a snapshot of save_snapshot into the strategy, the accuracy matrix and the RNGs and returns
+    # {'domain': last domain of the snapshot}, or None without a path. The domains of the snapshot must be the
+    # first domains of train_set, the last one may have grown
+    if path is None:
+        return None
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['model'] != name:
+        raise ValueError(f"snapshot {path} is of model {meta['model']}, not {name}")
+    sizes = [len(data) for data in train_set[:meta['domain'] + 1]]
+    if len(sizes) <= meta['domain'] or sizes[:-1] != meta['domain_sizes'][:-1] or \
+            sizes[-1] < meta['domain_sizes'][-1]:
+        raise ValueError(f"the domains of snapshot {path} ({meta['domain_sizes']}) are not the first domains of "
+                         f"the dataset ({[len(data) for data in train_set]})")
+
+    state = torch.load(os.path.join(path, 'model.pt'), map_location=next(strategy.model.parameters()).device)
+    strategy.model.load_state_dict(state['model_state_dict'])
+    strategy.optimizer.load_state_dict(state['optimizer_state_dict'])
+    strategy.buffer.load(os.path.join(path, 'buffer'))
+    for task, row in enumerate(meta['accuracy']):
+        accuracy.update(task, [np.nan if acc is None else acc for acc in row[:task + 1]])
+        if task + 1 < min(len(row), accuracy.n_tasks) and row[task + 1] is not None:
+            accuracy.update_next(task, row[task + 1])
+    domain = meta['domain']
+    if domain + 1 < len(train_set) and np.isnan(accuracy.matrix[domain, domain + 1]):
+        # The last domain of the snapshot was the last one of its series
+        from utils.evaluation import evaluate_next
+        accuracy.update_next(domain, evaluate_next(strategy.model, domain, test_set, strategy.loss, device))
+
+    rng = meta['rng']
+    random.setstate((rng['random'][0], tuple(rng['random'][1]), rng['random'][2]))
+    np.random.set_state((rng['numpy'][0], np.array(rng['numpy'][1], dtype=np.uint32), *rng['numpy'][2:]))
+    torch.set_rng_state(torch.tensor(rng['torch'], dtype=torch.uint8))
+    print(f"Warm start from {path} after domain {domain}")
+    return {'domain': domain}
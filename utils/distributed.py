@@ -0,0 +1,90 @@
+import os
+import socket
+import sys
+
+import torch
+import torch.distributed as dist
+
+
+def is_main():
+    # True in a single process run and in rank 0 of a --ddp run
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def launch(function, config, world_size):
+    # Runs function(config) in world_size processes joined in a gloo process group on localhost. Every rank loads
+    # the data and runs the same training, the ranks > 0 are silent
+    import torch.multiprocessing as mp
+    mp.spawn(_run_rank, args=(function, config, world_size, free_port()), nprocs=world_size)
+
+
+def _run_rank(rank, function, config, world_size, port):
+    dist.init_process_group('gloo', init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    if rank > 0:
+        sys.stdout = sys.stderr = open(os.devnull, 'w')
+    try:
+        function(config)
+    finally:
+        dist.destroy_process_group()
+
+
+def distribute(model):
+    # Data parallel training of a backbone with forward hooks: every training forward (grad enabled) runs on a
+    # shard of the batch rows per rank and returns the output of the whole batch (all gather), so the losses, the
+    # buffers and the state of the CL methods are computed on the same values by every rank. The gradient of a
+    # parameter is averaged over the ranks whenever it is computed (backward or autograd.grad), the gather scales
+    # the gradient of the local rows by the number of ranks: the average is then the gradient of the whole batch,
+    # while the terms computed by every rank from the parameters (EWC/SI penalties) are counted once
+    for p in model.parameters():
+        p.register_hook(_average_grad)
+    return model.register_forward_pre_hook(_shard_hook), model.register_forward_hook(_gather_hook)
+
+
+def _average_grad(grad):
+    grad = grad.clone()
+    dist.all_reduce(grad)
+    return grad / dist.get_world_size()
+
+
+def _shard_hook(module, inputs):
+    x = inputs[0]
+    module._shards = None
+    world_size = dist.get_world_size()
+    if torch.is_grad_enabled() and x.shape[0] >= world_size:
+        shards = torch.tensor_split(x, world_size)
+        module._shards = [len(shard) for shard in shards]
+        return (shards[dist.get_rank()],) + tuple(inputs[1:])
+
+
+def _gather_hook(module, inputs, output):
+    sizes = getattr(module, '_shards', None)
+    if sizes is None:
+        # Batch smaller than the number of ranks: every rank ran the whole batch
+        return output
+    module._shards = None
+    return _Gather.apply(output, sizes)
+
+
+class _Gather(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x, sizes):
+        ctx.sizes = sizes
+        # all_gather needs the same shape on every rank
+        padded = x.new_zeros((max(sizes),) + x.shape[1:])
+        padded[:x.shape[0]] = x
+        chunks = [torch.empty_like(padded) for _ in sizes]
+        dist.all_gather(chunks, padded)
+        return torch.cat([chunk[:n] for chunk, n in zip(chunks, sizes)])
+
+    @staticmethod
+    def backward(ctx, grad):
+        rank = dist.get_rank()
+        start = sum(ctx.sizes[:rank])
+        return grad[start:start + ctx.sizes[rank]] * len(ctx.sizes), None
@@ -0,0 +1,72 @@
+import torch
+from torch.utils.data import Subset
+
+
+class EpochController:
+    # Adaptive epoch budget of each domain: training stops once the watched score (train loss, or validation
+    # error on the last val_fraction of the domain) has not improved by more than min_delta for `patience`
+    # epochs, after at least min_epochs and at most config['epochs'] epochs. patience 0 keeps the fixed budget
+    def __init__(self, config):
+        self.max_epochs = config['epochs']
+        self.patience = config['patience']
+        self.min_epochs = config['min_epochs']
+        self.min_delta = config['min_delta']
+        self.val_fraction = config['val_fraction']
+        self.device = None
+        self.val_x = None
+        self.val_y = None
+        self.best = None
+        self.bad_epochs = 0
+        # Epochs trained on each domain
+        self.epochs = []
+
+    def start_domain(self, data_set):
+        # Returns the part of the domain to train on, the last val_fraction is held out if requested
+        self.best = None
+        self.bad_epochs = 0
+        self.epochs.append(0)
+        n_val = int(len(data_set) * self.val_fraction) if self.patience > 0 else 0
+        if n_val == 0:
+            self.val_x = self.val_y = None
+            return data_set
+        n_train = len(data_set) - n_val
+        val = [data_set[i] for i in range(n_train, len(data_set))]
+        self.val_x = torch.stack([x for x, _ in val])
+        self.val_y = torch.stack([y for _, y in val]).squeeze(1)
+        return Subset(data_set, range(n_train))
+
+    def _val_error(self, model):
+        # Validation error of a backbone, or mean error of the members of a ModelEnsemble
+        device = next(model.parameters()).device
+        x = self.val_x.to(device)
+        training = model.training
+        model.eval()
+        with torch.no_grad():
+            if hasattr(model, 'expand'):
+                x = model.expand(x)
+            # Class dimension after the batch (and member) dimensions, multi-head outputs are (batch, 2, heads)
+            pred = model(x).argmax(dim=2 if hasattr(model, 'expand') else 1)
+        model.train(training)
+        return 1 - (pred == self.val_y.to(device)).float().mean().item()
+
+    def stop(self, epoch, train_loss, model=None):
+        self.epochs[-1] = epoch + 1
+        if self.patience <= 0:
+            return False
+        score = self._val_error(model) if self.val_x is not None else train_loss
+        if self.best is None or score < self.best - self.min_delta:
+            self.best = score
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return epoch + 1 >= self.min_epochs and self.bad_epochs >= self.patience
+
+    def report(self, results):
+        # Print the epochs trained against the fixed budget and log them per domain
+        total = sum(self.epochs)
+        budget = self.max_epochs * len(self.epochs)
+        print(f"Epochs per domain: {self.epochs} | Trained {total}/{budget} epochs "
+              f"({100 * (1 - total / budget):.1f}% saved)")
+        for run in results if isinstance(results, list) else [results]:
+            for domain, epochs in enumerate(self.epochs):
+                run.log_budget(domain, epochs, self.max_epochs)
@@ -0,0 +1,84 @@
+import copy
+import numpy as np
+import torch.nn as nn
+from torch.func import stack_module_state, functional_call, vmap
+
+
+class ModelEnsemble(nn.Module):
+    # K independent copies of a backbone trained with a single vectorized forward/backward.
+    # Weights are stacked along a leading member dimension, so an elementwise optimizer
+    # (SGD with momentum) over the stacked parameters behaves as K separate optimizers
+    def __init__(self, models):
+        super(ModelEnsemble, self).__init__()
+        self.n_members = len(models)
+        params, buffers = stack_module_state(models)
+        self.param_names = list(params.keys())
+        self.buffer_names = list(buffers.keys())
+        self.params = nn.ParameterList([nn.Parameter(params[n]) for n in self.param_names])
+        for i, n in enumerate(self.buffer_names):
+            self.register_buffer(f"buffer_{i}", buffers[n])
+
+        # Stateless template of the backbone for functional_call, kept out of the
+        # registered submodules so that .to() / .parameters() only see the stacked weights
+        self._template = [copy.deepcopy(models[0]).to('meta')]
+
+    def _state(self):
+        params = {n: p for n, p in zip(self.param_names, self.params)}
+        buffers = {n: getattr(self, f"buffer_{i}") for i, n in enumerate(self.buffer_names)}
+        return params, buffers
+
+    def _call_member(self, params, buffers, x):
+        return functional_call(self._template[0], (params, buffers), (x,))
+
+    def forward(self, x):
+        # x: (K, B, ...) one batch per member, use expand() to share a batch across members
+        params, buffers = self._state()
+        self._template[0].train(self.training)
+        return vmap(self._call_member, randomness='different')(params, buffers, x)
+
+    def expand(self, x):
+        return x.unsqueeze(0).expand(self.n_members, *x.shape)
+
+    def member(self, k):
+        # Materialize member k as a regular backbone with its own copy of the weights
+        model = copy.deepcopy(self._template[0]).to_empty(device=self.params[0].device)
+        params, buffers = self._state()
+        state = {n: t[k].detach().clone() for n, t in {**params, **buffers}.items()}
+        model.load_state_dict(state)
+        model.train(self.training)
+        return model
+
+
+class MemberRNG:
+    # Runs a block with the numpy RNG state of member k (states: one np.random state per member), so that the
+    # replay buffer of every member draws the same random numbers as in its single model run
+    def __init__(self, states, k):
+        self.states = states
+        self.k = k
+
+    def __enter__(self):
+        self.outer = np.random.get_state()
+        np.random.set_state(self.states[self.k])
+
+    def __exit__(self, *args):
+        self.states[self.k] = np.random.get_state()
+        np.random.set_state(self.outer)
+        return False
+
+
+def step_members(optimizer, active):
+    # Optimizer step of the members in `active` only, the other members keep their weights and momentum
+    frozen = ~active
+    saved = []
+    if frozen.any():
+        for group in optimizer.param_groups:
+            for p in group['params']:
+                buf = optimizer.state[p].get('momentum_buffer')
+                saved.append((p, p.data[frozen].clone(), None if buf is None else buf[frozen].clone()))
+    optimizer.step()
+    for p, weights, buf in saved:
+        p.data[frozen] = weights
+        state_buf = optimizer.state[p].get('momentum_buffer')
+        if state_buf is not None:
+            # A buffer created by this step holds the (zero) gradient of the frozen members
+            state_buf[frozen] = 0 if buf is None else buf
@@ -1,11 +1,14 @@
 import statistics
 
+import numpy as np
 import torch
 from torch.utils.data import DataLoader
 
+from utils.profiler import profiler
 from utils.utils import binary_accuracy
 
 
+@profiler.timed('evaluate')
 def test_epoch(model, test_loader, loss, device):
     model.eval()
     test_acc = []
@@ -16,7 +19,7 @@ def test_epoch(model, test_loader, loss, device):
             y = y.to(device)
 
             output = model(x)
-            s_loss = loss(output, y.squeeze(0))
+            s_loss = loss(output, y.squeeze(1))
             _, pred = torch.max(output.data, 1)
             acc = binary_accuracy(pred, y.squeeze(1))
             test_acc.append(acc.item())
@@ -37,7 +40,7 @@ def test(model, loss, test_loader, device):
 
             output = model(x)
             _, pred = torch.max(output.data, 1)
-            s_loss = loss(output, y.squeeze(0))
+            s_loss = loss(output, y.squeeze(1))
             acc = binary_accuracy(pred, y.squeeze(1))
             test_acc.append(acc.item())
             test_loss.append(s_loss.item())
@@ -46,6 +49,7 @@ def test(model, loss, test_loader, device):
     return test_acc, test_loss
 
 
+@profiler.timed('evaluate')
 def evaluate_next(model, domain, test_set, loss, device):
     print("---Eval next domain---")
     test_loader = DataLoader(test_set[domain + 1], batch_size=1, shuffle=False)
@@ -53,6 +57,7 @@ def evaluate_next(model, domain, test_set, loss, device):
     return statistics.mean(accuracy)
 
 
+@profiler.timed('evaluate')
 def evaluate_past(model, domain, test_set, loss, device):
     accs = []
     errors = []
@@ -70,3 +75,16 @@ def evaluate_past(model, domain, test_set, loss, device):
     flat_accs = [item for sublist in accs for item in sublist]
     flat_errors = [item for sublist in errors for item in sublist]
     return flat_accs, flat_errors, mean_accs, mean_errors
+
+
+def evaluate_horizons(model, test_set, device):
+    # Accuracy of every head (horizon) of a multi-head backbone on every domain, (domains, heads)
+    model.eval()
+    accs = []
+    with torch.no_grad():
+        for domain in test_set:
+            x = torch.stack([x for x, _ in domain]).to(device)
+            y = torch.stack([y for _, y in domain]).to(device)
+            pred = model(x).argmax(dim=1)
+            accs.append(((pred == y).float().mean(dim=0) * 100).cpu().numpy())
+    return np.stack(accs)
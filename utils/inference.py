@@ -0,0 +1,63 @@
+import copy
+import json
+from collections import deque
+
+import numpy as np
+import torch
+
+from utils.utils import indicators
+
+# Prices kept by a WindowBuilder on top of the window: the recursive indicators (RSI, CMO) computed on this
+# history differ from the ones of the full series by less than 1e-9
+HISTORY = 300
+
+
+def export_model(model, path, config, n_step):
+    # Frozen TorchScript backbone with the preprocessing it was trained on, loaded back by load_model
+    model.eval()
+    meta = {'processing': config['processing'], 'cnn': config['cnn'], 'n_step': n_step,
+            'dataset': config['dataset'], 'model': config['model']}
+    # Plain float32 copy: scripting would compile the Python forward hooks (profiler, bfloat16 autocast) too
+    model = copy.deepcopy(model)
+    model._forward_pre_hooks.clear()
+    model._forward_hooks.clear()
+    if hasattr(model, 'channels_last'):
+        model.channels_last = False
+    scripted = torch.jit.freeze(torch.jit.script(model))
+    torch.jit.save(scripted, path, _extra_files={'meta.json': json.dumps(meta)})
+
+
+def load_model(path, device='cpu'):
+    extra_files = {'meta.json': ''}
+    model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    return model, json.loads(extra_files['meta.json'])
+
+
+class WindowBuilder:
+    # Input windows of one asset built as prices arrive, with the features of split_with_indicators.
+    # The price differences of the training windows are the changes to the next price, so the last window that
+    # can be built ends one price before the latest one
+    def __init__(self, n_step, cnn):
+        self.n_step = n_step
+        self.cnn = cnn
+        self.prices = deque(maxlen=n_step + HISTORY)
+
+    def append(self, prices):
+        self.prices.extend(float(p) for p in np.atleast_1d(prices))
+
+    def ready(self):
+        return len(self.prices) > self.n_step
+
+    def window(self):
+        # Latest input window, (7, n_step) for the CNN or flattened for the MLP, None while warming up
+        if not self.ready():
+            return None
+        data = np.array(self.prices)
+        features = np.concatenate([data.reshape(-1, 1)] + list(indicators(data)), axis=1)[-self.n_step - 1:-1]
+        diff = np.diff(data)[-self.n_step:].reshape(-1, 1)
+        window = np.concatenate([features[:, :1], diff, features[:, 1:]], axis=1).T
+        if np.isnan(window).any():
+            # Not enough history for the indicators yet
+            return None
+        window = torch.tensor(window, dtype=torch.float32)
+        return window if self.cnn else window.flatten()
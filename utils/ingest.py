@@ -0,0 +1,94 @@
+import hashlib
+import io
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from utils.results import FileLock
+
+# Header of a price column file: magic, number of rows, bytes of the CSV ingested, mtime of the CSV when it was
+# ingested and hash of the whole ingested part of the CSV (to tell an appended CSV from a rewritten one)
+HEADER = struct.Struct('<8sQQq32s')
+HEADER_SIZE = 64
+MAGIC = b'CLPRICE2'
+CHUNK = 1 << 20
+
+
+def column_path(csv_path):
+    return os.path.join(os.path.dirname(csv_path), '.cache', os.path.basename(csv_path) + '.f64')
+
+
+def _hash(f, end, h=None):
+    # Feeds the bytes of f from its position up to end to the hash h
+    h = h or hashlib.blake2b(digest_size=32)
+    while f.tell() < end:
+        h.update(f.read(min(CHUNK, end - f.tell())))
+    return h
+
+
+def _parse(data, header):
+    # Second column (the price) of CSV rows as float64
+    if not data.strip():
+        return np.empty(0)
+    df = pd.read_csv(io.BytesIO(data), header=0 if header else None)
+    return df.iloc[:, 1].to_numpy(dtype=np.float64)
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    magic, rows, ingested, mtime, digest = HEADER.unpack(header)
+    return (rows, ingested, mtime, digest) if magic == MAGIC else None
+
+
+def ingest(csv_path):
+    # Brings the float64 column file of a CSV up to date and returns its number of rows. Only the bytes added to
+    # the CSV since the last ingest are parsed, a CSV changed in any other way is ingested again from scratch
+    path = column_path(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with FileLock(path + '.lock'), open(csv_path, 'rb') as csv:
+        stat = os.fstat(csv.fileno())
+        size, mtime = stat.st_size, stat.st_mtime_ns
+        state = _read_header(path) if os.path.exists(path) else None
+        if state is not None:
+            rows, ingested, ingested_mtime, digest = state
+            if ingested == size and ingested_mtime == mtime:
+                return rows
+            # The CSV was touched: it is appended to only if the bytes already ingested are all unchanged
+            h = _hash(csv, ingested) if ingested <= size else None
+            if h is not None and h.digest() == digest:
+                data = csv.read(size - ingested)
+                values = _parse(data, header=False)
+                h.update(data)
+                digest = h.digest()
+                with open(path, 'r+b') as f:
+                    # Rows first: the header still describes a valid file if the write is interrupted
+                    f.seek(HEADER_SIZE + rows * 8)
+                    f.write(values.tobytes())
+                    f.truncate()
+                    f.seek(0)
+                    f.write(HEADER.pack(MAGIC, rows + len(values), size, mtime, digest))
+                return rows + len(values)
+
+        csv.seek(0)
+        data = csv.read(size)
+        values = _parse(data, header=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(values), size, mtime, hashlib.blake2b(data, digest_size=32).digest())
+                    .ljust(HEADER_SIZE, b'\0'))
+            f.write(values.tobytes())
+        os.replace(tmp, path)
+        return len(values)
+
+
+def load_prices(csv_path):
+    # Price column of a CSV as a read-only float64 memmap, ingesting the rows added since the last call
+    rows = ingest(csv_path)
+    if rows == 0:
+        return np.empty(0)
+    return np.memmap(column_path(csv_path), dtype=np.float64, mode='r', offset=HEADER_SIZE, shape=(rows,))
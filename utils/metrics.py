@@ -1,32 +1,74 @@
 import numpy as np
 
 
-def backward_transfer(results):
-    n_tasks = len(results)
-    li = list()
-    for i in range(n_tasks - 1):
-        li.append(results[-1][i] - results[i][i])
+class AccuracyMatrix:
+    # Preallocated (T, T) accuracy matrix: row i holds the accuracies on every domain after
+    # training on domain i (domains 0..i, plus i+1 from evaluate_next). Missing entries are NaN
+    def __init__(self, n_tasks):
+        self.n_tasks = n_tasks
+        self.matrix = np.full((n_tasks, n_tasks), np.nan)
+        # Number of domains trained so far, when training stops early the metrics cover these only
+        self.n_trained = 0
 
-    return np.mean(li)
+    def update(self, task, accs):
+        row = np.asarray(accs, dtype=float)
+        self.matrix[task, :row.shape[0]] = row
+        self.n_trained = max(self.n_trained, task + 1)
 
+    def update_next(self, task, acc):
+        self.matrix[task, task + 1] = acc
 
-def forward_transfer(results, random_results):
+    def __array__(self, dtype=None, copy=None):
+        matrix = self.matrix[:self.n_trained, :self.n_trained]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+
+def as_matrix(results):
+    # (..., T, T) float array from an AccuracyMatrix, an array or ragged lists (padded with NaN)
+    if isinstance(results, np.ndarray) or hasattr(results, '__array__'):
+        return np.asarray(results, dtype=float)
     n_tasks = len(results)
-    li = list()
-    for i in range(1, n_tasks):
-        li.append(results[i-1][i] - random_results[i])
+    matrix = np.full((n_tasks, n_tasks), np.nan)
+    for i, row in enumerate(results):
+        matrix[i, :len(row)] = row
+    return matrix
 
-    return np.mean(li)
+
+def backward_transfer(results):
+    res = as_matrix(results)
+    last = res[..., -1, :-1]
+    diag = np.diagonal(res, axis1=-2, axis2=-1)[..., :-1]
+    return np.mean(last - diag, axis=-1)
+
+
+def forward_transfer(results, random_results):
+    res = as_matrix(results)
+    upper = np.diagonal(res, offset=1, axis1=-2, axis2=-1)
+    random_results = np.asarray(random_results, dtype=float)[..., 1:res.shape[-1]]
+    return np.mean(upper - random_results, axis=-1)
 
 
 def forgetting(results):
-    n_tasks = len(results)
-    li = list()
-    for i in range(n_tasks - 1):
-        results[i] += [0.0] * (n_tasks - len(results[i]))
-    np_res = np.array(results)
-    maxx = np.max(np_res, axis=0)
-    for i in range(n_tasks - 1):
-        li.append(maxx[i] - results[-1][i])
-
-    return np.mean(li)
+    res = as_matrix(results)
+    # Running maxima over the training sequence, the last row holds the best accuracy ever seen
+    best = np.fmax.accumulate(res, axis=-2)[..., -1, :-1]
+    return np.mean(best - res[..., -1, :-1], axis=-1)
+
+
+def average_accuracy(results):
+    res = as_matrix(results)
+    return np.mean(res[..., -1, :], axis=-1)
+
+
+def learning_accuracy(results):
+    res = as_matrix(results)
+    return np.mean(np.diagonal(res, axis1=-2, axis2=-1), axis=-1)
+
+
+def summarize(results, random_results):
+    # All the metrics at once, results can be a (runs, T, T) stack of runs
+    return {'acc': average_accuracy(results),
+            'learning_acc': learning_accuracy(results),
+            'backward': backward_transfer(results),
+            'forward': forward_transfer(results, random_results),
+            'forgetting': forgetting(results)}
@@ -0,0 +1,197 @@
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+import torch
+
+
+class _NullPhase:
+    # Shared no-op context manager returned while the profiler is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'start', 'children')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.children = 0.
+
+    def __enter__(self):
+        if self.profiler.sync:
+            torch.cuda.synchronize()
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.profiler.sync:
+            torch.cuda.synchronize()
+        end = time.perf_counter()
+        self.profiler.stack.pop()
+        self.profiler.add(self.name, end - self.start, self.start, self.children)
+        return False
+
+
+class Profiler:
+    # Wall time and number of calls of the phases of a run, plus counters. Phases can be nested: the reported
+    # times are inclusive, the self times exclude the nested phases. Disabled by default: phase() then returns a
+    # shared no-op context manager, the timed() wrappers call the function directly and epochs() returns its
+    # iterable unchanged
+    def __init__(self):
+        self.enabled = False
+        self.sync = False
+        self.trace = False
+        self.torch_epochs = None
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.self_times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.stack = []
+        self.events = []
+        self.epoch = 0
+        self.torch_profile = None
+        self.torch_running = False
+        self.origin = time.perf_counter()
+
+    def enable(self, sync=None, trace=False, torch_epochs=None):
+        # sync: wait for the GPU at the phase boundaries (default: when CUDA is available)
+        # trace: keep every phase as an event of the Chrome trace
+        # torch_epochs: (first, last) epochs of the run, counted over all the domains, run under torch.profiler
+        self.enabled = True
+        self.sync = torch.cuda.is_available() if sync is None else sync
+        self.trace = trace
+        self.torch_epochs = torch_epochs
+
+    def disable(self):
+        self.enabled = False
+        self.sync = False
+        self.trace = False
+
+    def add(self, name, seconds, start=None, children=0.):
+        self.times[name] += seconds
+        self.self_times[name] += seconds - children
+        self.calls[name] += 1
+        if self.stack:
+            self.stack[-1].children += seconds
+        if self.trace and start is not None:
+            self.events.append((name, start, seconds))
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def timed(self, name):
+        # Decorator timing every call of a function as the phase `name`
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Phase(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def step(self, samples):
+        # One optimizer step on a batch of `samples` examples
+        if self.enabled:
+            self.counters['steps'] += 1
+            self.counters['samples'] += samples
+
+    def epochs(self, iterable):
+        # Wraps the epoch loop of a trainer: every epoch is an 'epoch' phase and the epochs of the torch_epochs
+        # range run under torch.profiler
+        if not self.enabled:
+            return iterable
+        return self._epochs(iterable)
+
+    def _epochs(self, iterable):
+        for epoch in iterable:
+            if self.torch_epochs is not None and self.epoch == self.torch_epochs[0]:
+                self.torch_profile = torch.profiler.profile(record_shapes=True)
+                self.torch_profile.__enter__()
+                self.torch_running = True
+            try:
+                with _Phase(self, 'epoch'):
+                    yield epoch
+            finally:
+                # Also reached when the trainer breaks out of the loop (early stopping)
+                if self.torch_running and self.epoch == self.torch_epochs[1]:
+                    self.stop_torch_profile()
+                self.epoch += 1
+
+    def stop_torch_profile(self):
+        self.torch_profile.__exit__(None, None, None)
+        self.torch_running = False
+
+    def watch(self, model):
+        # Times the training forward passes (grad enabled) of a model with forward hooks. The hooks are module
+        # functions so that the model can still be pickled in the checkpoints
+        return model.register_forward_pre_hook(_forward_pre_hook), model.register_forward_hook(_forward_hook)
+
+    def report(self):
+        return {'phases': {name: {'seconds': self.times[name], 'self_seconds': self.self_times[name],
+                                  'calls': self.calls[name]} for name in self.times},
+                'counters': dict(self.counters)}
+
+    def save(self, prefix):
+        # <prefix>.json: report, <prefix>.trace.json: Chrome trace of the phases (chrome://tracing or Perfetto),
+        # <prefix>.torch.json: Chrome trace of torch.profiler for the torch_epochs range
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{prefix}.json", 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        if self.events:
+            pid = os.getpid()
+            events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': 0, 'ts': (start - self.origin) * 1e6,
+                       'dur': seconds * 1e6} for name, start, seconds in self.events]
+            end = max(start + seconds for _, start, seconds in self.events) - self.origin
+            events += [{'name': name, 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': end * 1e6, 'args': {name: value}}
+                       for name, value in self.counters.items()]
+            with open(f"{prefix}.trace.json", 'w') as f:
+                json.dump({'traceEvents': events}, f)
+        if self.torch_running:
+            # The run ended before the last epoch of the range
+            self.stop_torch_profile()
+        if self.torch_profile is not None:
+            self.torch_profile.export_chrome_trace(f"{prefix}.torch.json")
+
+
+def _forward_pre_hook(module, inputs):
+    if profiler.enabled and torch.is_grad_enabled():
+        if profiler.sync:
+            torch.cuda.synchronize()
+        module._profiler_start = time.perf_counter()
+
+
+def _forward_hook(module, inputs, output):
+    start = getattr(module, '_profiler_start', None)
+    if start is not None:
+        if profiler.sync:
+            torch.cuda.synchronize()
+        profiler.add('forward', time.perf_counter() - start, start)
+        module._profiler_start = None
+
+
+# Profiler of the process, used by the trainers and the buffers
+profiler = Profiler()
@@ -0,0 +1,64 @@
+import torch
+import torch.nn as nn
+from utils.ensemble import ModelEnsemble
+
+
+class ProxSGD(torch.optim.SGD):
+    # SGD followed by the proximal step of the L1 penalty: after every update the weights are soft-thresholded
+    # by lr * l1, so the penalty adds nothing to the autograd graph and small weights become exactly zero.
+    # Param groups with group_l1 > 0 also get the group lasso step: every slice along the first group_dims
+    # dimensions (the output channels of a conv weight) is shrunk as a whole and can be zeroed
+    def __init__(self, params, lr, momentum=0, l1=0., group_l1=0., group_dims=1):
+        super(ProxSGD, self).__init__(params, lr=lr, momentum=momentum)
+        prox_defaults = {'l1': l1, 'group_l1': group_l1, 'group_dims': group_dims}
+        self.defaults.update(prox_defaults)
+        for group in self.param_groups:
+            for k, v in prox_defaults.items():
+                group.setdefault(k, v)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = super(ProxSGD, self).step(closure)
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if group['l1'] > 0:
+                    threshold = group['lr'] * group['l1']
+                    p.copy_(torch.sign(p) * (p.abs() - threshold).clamp_(min=0))
+                if group['group_l1'] > 0:
+                    dims = group['group_dims']
+                    norms = p.flatten(dims).norm(dim=-1)
+                    scale = (1 - group['lr'] * group['group_l1'] / norms.clamp(min=1e-12)).clamp_(min=0)
+                    p.mul_(scale.view(scale.shape + (1,) * (p.dim() - dims)))
+        return loss
+
+
+def prox_param_groups(model, l1, group_l1=0.):
+    # Param groups for ProxSGD: L1 on every weight, group lasso on the output channels of the Conv1d weights.
+    # Works on a backbone or on a ModelEnsemble (stacked weights, groups are per member and channel)
+    if isinstance(model, ModelEnsemble):
+        template = model._template[0]
+        named_params = zip(model.param_names, model.params)
+        group_dims = 2
+    else:
+        template = model
+        named_params = model.named_parameters()
+        group_dims = 1
+    conv_weights = {f"{name}.weight" for name, module in template.named_modules() if isinstance(module, nn.Conv1d)}
+
+    groups = [{'params': [], 'l1': l1, 'group_l1': group_l1, 'group_dims': group_dims},
+              {'params': [], 'l1': l1, 'group_l1': 0.}]
+    for name, p in named_params:
+        groups[0 if name in conv_weights else 1]['params'].append(p)
+    return [g for g in groups if g['params']]
+
+
+def sparsity(model):
+    # Fraction of exactly zero weights, and of zero output channels of the Conv1d layers
+    n_zero = sum((p == 0).sum().item() for p in model.parameters())
+    n_params = sum(p.numel() for p in model.parameters())
+    channels = [m.weight.flatten(1).abs().sum(dim=1) == 0 for m in model.modules() if isinstance(m, nn.Conv1d)]
+    n_channels = sum(c.numel() for c in channels)
+    zero_channels = sum(c.sum().item() for c in channels) / n_channels if n_channels else 0.
+    return n_zero / n_params, zero_channels
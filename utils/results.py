@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Columns indexed for queries (every table also carries the run_id)
+DATA_COLUMNS = ['model', 'dataset', 'seed']
+TRANSFER_COLUMNS = ['acc', 'learning_acc', 'backward', 'forward', 'forgetting']
+# Fixed width in bytes of the string columns (HDF5 tables can't grow them after creation). The config of a run is
+# stored by its hash, the JSON goes to a variable length node /configs/c<hash>
+MIN_ITEMSIZE = {'run_id': 32, 'model': 16, 'dataset': 64, 'suffix': 64, 'phase': 32, 'config_hash': 40,
+                'storage': 16}
+# Attributes of a replay buffer in the buffer table (bytes per slot, 0 if the method doesn't store it)
+BUFFER_ATTRIBUTES = ['examples', 'scales', 'labels', 'logits', 'task_number']
+
+
+def check_widths(record):
+    # Raise before a run is trained instead of losing its records when they are written
+    for column, value in record.items():
+        if isinstance(value, str) and column in MIN_ITEMSIZE and len(value.encode()) > MIN_ITEMSIZE[column]:
+            raise ValueError(f"{column} {value!r} is longer than the {MIN_ITEMSIZE[column]} bytes of the "
+                             f"'{column}' column of the results")
+
+
+class FileLock:
+    # Exclusive lock on a sidecar file, serializes the writers of a sweep pool
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT)
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        else:
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        os.close(self.fd)
+        self.fd = None
+
+
+class ResultsStore:
+    # Append-only columnar store (HDF5 tables through PyTables), one table per record type:
+    # runs, epochs, evaluations, domains, transfer, timings, budget
+    def __init__(self, path, batch_size=5000):
+        # path None: the records are dropped
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = FileLock(path + '.lock') if path is not None else None
+
+    def new_run(self, config, seed=None):
+        return RunRecorder(self, config, seed)
+
+    def write(self, tables):
+        tables = {k: v for k, v in tables.items() if v}
+        if not tables or self.path is None:
+            return
+        with self.lock:
+            with pd.HDFStore(self.path, mode='a', complevel=5, complib='blosc') as store:
+                for key, records in tables.items():
+                    df = pd.DataFrame.from_records(records)
+                    min_itemsize = {c: n for c, n in MIN_ITEMSIZE.items() if c in df.columns}
+                    store.append(key, df, format='table', data_columns=DATA_COLUMNS,
+                                 min_itemsize=min_itemsize)
+
+    def write_config(self, config_hash, text):
+        # JSON of a run config in a variable length node, written once per distinct config
+        if self.path is None:
+            return
+        import tables
+        with self.lock:
+            with tables.open_file(self.path, mode='a') as h5:
+                if f'/configs/c{config_hash}' not in h5:
+                    h5.create_vlarray('/configs', f'c{config_hash}', tables.VLUnicodeAtom(),
+                                      createparents=True).append(text)
+
+    def config(self, config_hash):
+        # Config of the runs with config_hash (column of the runs table)
+        import tables
+        with self.lock:
+            with tables.open_file(self.path, mode='r') as h5:
+                return json.loads(h5.get_node('/configs', f'c{config_hash}')[0])
+
+    def select(self, key, model=None, dataset=None, seed=None):
+        where = []
+        if model is not None:
+            where.append(f"model == {model!r}")
+        if dataset is not None:
+            where.append(f"dataset == {dataset!r}")
+        if seed is not None:
+            where.append(f"seed == {int(seed)}")
+        with self.lock:
+            return pd.read_hdf(self.path, key, where=" & ".join(where) or None)
+
+    def create_index(self):
+        # Rebuild full PyTables indexes on model/dataset/seed once a sweep is done
+        with self.lock:
+            with pd.HDFStore(self.path, mode='a') as store:
+                for key in store.keys():
+                    store.create_table_index(key, columns=DATA_COLUMNS, optlevel=9, kind='full')
+
+
+class RunRecorder:
+    # Collects the records of one run in memory and writes them to the store in batches
+    def __init__(self, store, config, seed=None):
+        self.store = store
+        self.config = config
+        self.keys = {'run_id': uuid.uuid4().hex,
+                     'model': config['model'],
+                     'dataset': str(config['dataset']),
+                     'seed': int(config['seed'] if seed is None else seed)}
+        self.suffix = str(config.get('suffix', ''))
+        check_widths({**self.keys, 'suffix': self.suffix})
+        self.tables = {'runs': [], 'epochs': [], 'evaluations': [], 'domains': [], 'transfer': [], 'timings': [],
+                       'budget': [], 'horizons': [], 'buffer': []}
+        self.n_records = 0
+        self.start = time.time()
+
+    def _add(self, key, **record):
+        check_widths(record)
+        self.tables[key].append({**self.keys, **record})
+        self.n_records += 1
+        if self.n_records >= self.store.batch_size:
+            self.flush()
+
+    def log_epoch(self, domain, epoch, loss, acc):
+        self._add('epochs', domain=domain, epoch=epoch, loss=float(loss), accuracy=float(acc))
+
+    def log_evaluation(self, domain, epoch, accs):
+        for eval_domain, acc in enumerate(accs):
+            self._add('evaluations', domain=domain, epoch=epoch, eval_domain=eval_domain, accuracy=float(acc))
+
+    def log_domain(self, domain, accs, errors):
+        for eval_domain, (acc, error) in enumerate(zip(accs, errors)):
+            self._add('domains', domain=domain, eval_domain=eval_domain, accuracy=float(acc), error=float(error))
+
+    def log_transfer(self, metrics):
+        # metrics as returned by utils.metrics.summarize
+        self._add('transfer', **{k: float(metrics[k]) for k in TRANSFER_COLUMNS})
+
+    def log_budget(self, domain, epochs, max_epochs):
+        self._add('budget', domain=domain, epochs=int(epochs), max_epochs=int(max_epochs))
+
+    def log_horizons(self, accs, horizons):
+        # accs: (domains, horizons) accuracy of the heads of a multi-horizon backbone
+        for domain, domain_accs in enumerate(accs):
+            for horizon, acc in zip(horizons, domain_accs):
+                self._add('horizons', domain=domain, horizon=int(horizon), accuracy=float(acc))
+
+    def log_buffer(self, storage, buffer_size, report):
+        # report as returned by Buffer.memory_report
+        self._add('buffer', storage=storage, buffer_size=int(buffer_size), slot_bytes=int(report['slot']),
+                  total_bytes=int(report['total']),
+                  **{f'{attr}_bytes': int(report.get(attr, 0)) for attr in BUFFER_ATTRIBUTES})
+
+    def log_timing(self, phase, seconds):
+        self._add('timings', phase=phase, seconds=float(seconds))
+
+    def flush(self):
+        self.store.write(self.tables)
+        for records in self.tables.values():
+            records.clear()
+        self.n_records = 0
+
+    def close(self):
+        config = {k: v for k, v in self.config.items() if isinstance(v, (str, int, float, bool, type(None)))}
+        text = json.dumps(config, sort_keys=True)
+        config_hash = hashlib.sha1(text.encode()).hexdigest()
+        self.store.write_config(config_hash, text)
+        self._add('runs', suffix=self.suffix, start=self.start, elapsed=time.time() - self.start,
+                  config_hash=config_hash)
+        self.flush()
@@ -0,0 +1,13 @@
+import numpy as np
+
+
+def regime_series(n_regimes, regime_length, seed=0, start=100.):
+    # Piecewise stationary price series: every regime draws its own drift and volatility and the log price is a
+    # random walk with those parameters. Returns the prices and the (known) changepoints between the regimes
+    rng = np.random.default_rng(seed)
+    drift = rng.normal(0., 1e-3, n_regimes)
+    volatility = rng.uniform(5e-3, 3e-2, n_regimes)
+    returns = rng.normal(np.repeat(drift, regime_length), np.repeat(volatility, regime_length))
+    prices = start * np.exp(np.cumsum(returns))
+    chps = np.arange(1, n_regimes) * regime_length
+    return prices, chps
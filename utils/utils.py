@@ -1,19 +1,34 @@
+import importlib
 import statistics
+import sys
 import numpy as np
-import pandas as pd
 import torch
-import matplotlib.pyplot as plt
-import talib
 
 from pathlib import Path
 
+from utils.profiler import profiler
 
+DETECTION = str(Path(__file__).resolve().parent.parent / 'detection')
+
+
+def changepoint_module():
+    # detection/ is imported as the top level package sdt, as its tests do: the numba disk cache of the changepoint
+    # kernels records the name of the module, kernels cached as sdt.changepoint can't be loaded as
+    # detection.sdt.changepoint (and the other way round)
+    if DETECTION not in sys.path:
+        sys.path.append(DETECTION)
+    return importlib.import_module('sdt.changepoint')
+
+
+@profiler.timed('indicators')
 def indicators(data):
-    cmo = talib.CMO(np.array(data), timeperiod=10).reshape(-1, 1)
-    roc = talib.ROC(np.array(data), timeperiod=5).reshape(-1, 1)
-    rsi = talib.RSI(np.array(data), timeperiod=5).reshape(-1, 1)
-    wma = talib.WMA(np.array(data), timeperiod=20).reshape(-1, 1)
-    ppo = talib.PPO(np.array(data), fastperiod=5, slowperiod=10, matype=0).reshape(-1, 1)
+    import talib
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    cmo = talib.CMO(data, timeperiod=10).reshape(-1, 1)
+    roc = talib.ROC(data, timeperiod=5).reshape(-1, 1)
+    rsi = talib.RSI(data, timeperiod=5).reshape(-1, 1)
+    wma = talib.WMA(data, timeperiod=20).reshape(-1, 1)
+    ppo = talib.PPO(data, fastperiod=5, slowperiod=10, matype=0).reshape(-1, 1)
     return cmo, roc, rsi, wma, ppo
 
 
@@ -28,56 +43,65 @@ def timeperiod(filename):
         return 0
 
 
-def unique(numbers):
-    output = []
-    for x in numbers:
-        if x not in output:
-            output.append(x)
-    return output
+def indicator_features(data):
+    # (T, 7) price, change to the next price and indicators, NaN where undefined (indicator warm-up, last change)
+    cmo, roc, rsi, wma, ppo = indicators(data)
+    data = np.asarray(data, dtype=np.float64).reshape(-1, 1)
+    # The last price has no next price
+    diff = np.append(np.diff(data, axis=0), np.nan).reshape(-1, 1)
+    return np.concatenate([data, diff, cmo, roc, rsi, wma, ppo], axis=1)
+
+
+def detect_changepoints(data, features, past, prob_threshold, min_size=0):
+    # Online Bayesian changepoints of the price, or of the standardized indicator features (joint multivariate
+    # likelihood) if features. Rows with undefined features are skipped, the changepoints index the price series.
+    # The feature changepoints are at least max(past, min_size) steps apart
+    BayesOnline = changepoint_module().BayesOnline
+    if not features:
+        return BayesOnline().find_changepoints(data, past=past, prob_threshold=prob_threshold)
+    values = indicator_features(data)
+    rows = np.flatnonzero(~np.isnan(values).any(axis=1))
+    values = values[rows]
+    values = (values - values.mean(axis=0)) / values.std(axis=0)
+    # Prior covariance of the standardized features: identity, as strong as 3 * d observations. The vague
+    # univariate prior finds a changepoint every few hundred steps on 7 features
+    d = values.shape[1]
+    det = BayesOnline('const', 'multivariate_t', obs_params={'mu': np.zeros(d), 'nu': 3. * d,
+                                                             'psi': (2. * d - 1.) * np.eye(d)})
+    chps = rows[det.find_changepoints(values, past=past, prob_threshold=prob_threshold)]
+    # Changepoints closer than past steps can't be told apart, keep the first one
+    keep = []
+    for c in chps:
+        if not keep or c - keep[-1] >= max(past, min_size):
+            keep.append(c)
+    return np.array(keep, dtype=chps.dtype)
 
 
 def split_with_indicators(config, data, chps, n_step):
+    # Windows of n_step steps of the price, its change to the next price and the indicators. The label of a window
+    # and horizon h is 1 if the price h steps after the end of the window is greater than the window mean. The
+    # labels are (H,) for the horizons of config['horizons'] (default: one horizon of n_step steps)
+    from numpy.lib.stride_tricks import sliding_window_view
+    horizons = config.get('horizons') or [n_step]
     train_data = []
     test_data = []
 
-    cmo, roc, rsi, wma, ppo = indicators(data)
-    data = np.array(data).reshape(-1, 1)
-    data_split = np.split(data, chps)
-    diff_data = np.diff(data, axis=0)
-    diff_split = np.split(diff_data, chps)
-    cmo_split = np.split(cmo, chps)
-    roc_split = np.split(roc, chps)
-    rsi_split = np.split(rsi, chps)
-    wma_split = np.split(wma, chps)
-    ppo_split = np.split(ppo, chps)
-    for index, (subdata, subdiff, subcmo, subroc, subrsi, subwma, subppo) in \
-            enumerate(zip(data_split, diff_split, cmo_split, roc_split, rsi_split, wma_split, ppo_split)):
+    features = indicator_features(data)
+    for subfeatures in np.split(features, chps):
+        # Windows whose horizons are all inside the domain
+        n_windows = len(subfeatures) - n_step - max(horizons) + 1
         seq = []
-        i = 0
-        while i < len(subdata):
-            end_seq = i + n_step
-            if end_seq > (len(subdata) - n_step):
-                break
-            seq_x, y = subdata[i:end_seq].squeeze(), subdata[end_seq + n_step - 1]
-            seq_diff = subdiff[i:end_seq].squeeze()
-            seq_cmo = subcmo[i:end_seq].squeeze()
-            seq_roc = subroc[i:end_seq].squeeze()
-            seq_rsi = subrsi[i:end_seq].squeeze()
-            seq_wma = subwma[i:end_seq].squeeze()
-            seq_ppo = subppo[i:end_seq].squeeze()
-            input_data = np.stack([seq_x, seq_diff, seq_cmo, seq_roc, seq_rsi, seq_wma, seq_ppo])
-
-            label = 0  # Target value lower or equal than input sequence
-            if y > statistics.mean(seq_x.flatten()):
-                label = 1  # Target value greater than input sequence
+        if n_windows > 0:
+            windows = sliding_window_view(subfeatures, n_step, axis=0)[:n_windows]
+            prices = subfeatures[:, 0]
+            targets = np.stack([prices[n_step - 1 + h:n_step - 1 + h + n_windows] for h in horizons], axis=1)
+            labels = targets > windows[:, 0].mean(axis=1, keepdims=True)
 
-            input_data = torch.Tensor(input_data)
+            inputs = torch.tensor(windows, dtype=torch.float32)
             if not config["cnn"]:
-                input_data = torch.flatten(input_data)
-            label = torch.LongTensor([label])
-            if not torch.isnan(torch.sum(input_data)):
-                seq.append((input_data, label))
-            i += 1
+                inputs = inputs.flatten(1)
+            keep = ~torch.isnan(inputs.flatten(1).sum(dim=1))
+            seq = list(zip(inputs[keep], torch.from_numpy(labels.astype(np.int64))[keep]))
 
         train_data.append(seq[:round(len(seq) * 0.75)])
         test_data.append(seq[round(len(seq) * 0.75):])
@@ -116,12 +140,13 @@ def split_data(config, data, chps, n_step):
     return train_data, test_data
 
 
+@profiler.timed('read_csv')
 def read_csv(filename):
+    # Price column as a float64 array, cached in dataset/.cache and updated with the rows appended to the CSV
+    from utils.ingest import load_prices
     path = Path.cwd()
     csv_path = path.joinpath('dataset', filename)
-    df = pd.read_csv(csv_path)
-    value_list = df.iloc[:, 1].to_list()
-    return value_list
+    return load_prices(str(csv_path))
 
 
 def check_changepoints(filename):
@@ -133,34 +158,55 @@ def check_changepoints(filename):
         tmp = r.split(',')
         if tmp[0] == filename:
             value_list = tmp[1:]
-            chps = np.array(value_list, dtype=np.int)
+            chps = np.array(value_list, dtype=int)
             return True, chps
     return False, chps
 
 
 def binary_accuracy(y_pred, y_true):
     result_sum = (y_pred == y_true).sum()
-    acc = result_sum / y_true.shape[0]
+    acc = result_sum / y_true.numel()
     return acc*100
 
 
-def eval_bayesian(chps, raw_data):
-    plt.figure(figsize=(10, 6))
-    plt.plot(raw_data)
-    plt.grid(True)
-    for i in chps:
-        plt.axvline(i, color="red")
-    plt.title("Bayesian Online")
-    plt.xlabel("Timestep")
-    plt.ylabel("Price")
-    plt.show()
+def eval_bayesian(chps, raw_data, path=None):
+    # Changepoints of the series and train/test split of every domain in one figure, shown or saved to path without
+    # a display. The lines are decimated to the min/max of every pixel column, long series render as fast as short ones
+    changepoint = changepoint_module()
+    decimate, plot_changepoints = changepoint.decimate, changepoint.plot_changepoints
+    splits = np.split(np.asarray(raw_data, dtype=np.float64).reshape(-1), chps)
+    cols = min(4, len(splits))
+    rows = -(-len(splits) // cols)
+    size = (4 * cols, 3 * (rows + 1))
+    if path is None:
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize=size)
+    else:
+        from matplotlib.figure import Figure
+        fig = Figure(figsize=size)
+    # Fixed spacing, a layout engine measuring every tick label takes longer than drawing
+    grid = fig.add_gridspec(rows + 1, cols, left=0.06, right=0.98, bottom=0.05, top=0.95, hspace=0.5, wspace=0.25)
+
+    ax = fig.add_subplot(grid[0, :])
+    plot_changepoints(np.asarray(raw_data).reshape(-1), chps, style='line', ax=ax, downsample='minmax')
+    ax.grid(True)
+    ax.set_title("Bayesian Online")
+    ax.set_xlabel("Timestep")
+    ax.set_ylabel("Price")
 
     # Evaluation of train/test split
-    splits = np.split(raw_data, chps)
     for index, subdata in enumerate(splits):
-        plt.plot(subdata[:round(len(subdata) * 0.75)], color='red', label='Train')
-        tmp = np.arange(round(len(subdata) * 0.75), len(subdata))
-        plt.plot(tmp, subdata[round(len(subdata) * 0.75):], color='green', label='Test')
-        plt.legend(loc='best')
-        plt.title(f'Test/Train split domain {index}')
+        ax = fig.add_subplot(grid[1 + index // cols, index % cols])
+        n_points = 2 * max(int(ax.bbox.width), 1)
+        n_train = round(len(subdata) * 0.75)
+        for start, part, color, label in ((0, subdata[:n_train], 'red', 'Train'),
+                                          (n_train, subdata[n_train:], 'green', 'Test')):
+            idx = decimate(part, n_points)
+            ax.plot(start + idx, part[idx], color=color, label=label)
+        ax.legend(loc='best')
+        ax.set_title(f'Test/Train split domain {index}')
+
+    if path is None:
         plt.show()
+    else:
+        fig.savefig(path)